@@ -16,15 +16,21 @@
  */
 
 import java.util.Calendar;
+import java.util.Iterator;
 import java.util.List;
 import java.util.ArrayList;
 import java.util.Map;
-import java.util.Hashtable;
+import java.util.HashMap;
+import java.util.LinkedHashMap;
 import java.net.URL;
 import org.apache.log4j.Logger;
 
 
 import net.glambda.nsi2.impl.EventListener;
+import net.glambda.nsi2.impl.ProviderPortWithHeader;
+import net.glambda.nsi2.impl.SampleRequesterWaitable;
+import net.glambda.nsi2.util.NSIUtil;
+import net.glambda.nsi2.util.SecurityUtil;
 import net.glambda.nsi2.util.NSITextDump;
 import net.glambda.nsi2.util.TypesBuilder;
 import nsi2.reply.QueryNotificationReply;
@@ -35,14 +41,23 @@ import nsi2.NSI2Client;
 import nsi2.SampleEventListener;
 
 import javax.xml.bind.JAXBElement;
+import javax.xml.bind.DatatypeConverter;
+import javax.xml.ws.BindingProvider;
+import javax.xml.ws.Holder;
 
+import org.ogf.schemas.nsi._2013._12.framework.headers.CommonHeaderType;
 import org.ogf.schemas.nsi._2013._12.framework.types.ServiceExceptionType;
+import org.ogf.schemas.nsi._2013._12.connection.provider.ConnectionProviderPort;
 import org.ogf.schemas.nsi._2013._12.connection._interface.ServiceException;
 import org.ogf.schemas.nsi._2013._12.connection.types.QueryNotificationConfirmedType;
 import org.ogf.schemas.nsi._2013._12.connection.types.QueryNotificationType;
 import org.ogf.schemas.nsi._2013._12.connection.types.QueryRecursiveResultType;
 import org.ogf.schemas.nsi._2013._12.connection.types.QuerySummaryConfirmedType;
 import org.ogf.schemas.nsi._2013._12.connection.types.QuerySummaryResultType;
+import org.ogf.schemas.nsi._2013._12.connection.types.QuerySummaryResultCriteriaType;
+import org.ogf.schemas.nsi._2013._12.connection.types.ChildSummaryType;
+import org.ogf.schemas.nsi._2013._12.connection.types.ConnectionStatesType;
+import org.ogf.schemas.nsi._2013._12.connection.types.DataPlaneStatusType;
 import org.ogf.schemas.nsi._2013._12.connection.types.QueryType;
 import org.ogf.schemas.nsi._2013._12.connection.types.ReservationConfirmCriteriaType;
 import org.ogf.schemas.nsi._2013._12.connection.types.ReservationRequestCriteriaType;
@@ -60,9 +75,6 @@ import org.apache.cxf.transport.http.HTTPConduit;
 
 public class NSI2Interface {
     static final int DEFAULT_DURATION_HOUR = 24 * 3; // 3days
-    static Hashtable<String, ReservationRequestCriteriaType> criterias = new Hashtable<String, ReservationRequestCriteriaType>();
-    static Hashtable<String, Integer> versions = new Hashtable<String, Integer>();
-    static Hashtable<String, Long> capacities =  new Hashtable<String, Long>();
 
     String providerNSA = null;
     String providerURI = null;
@@ -70,12 +82,17 @@ public class NSI2Interface {
     String requesterURI = null;
     String httpUser = null;
     String httpPassword = null;
-    long replyWait = 300 * 1000L; // 60 sec
+    long replyWait = 300 * 1000L; // 300 sec
 
     EventListener listener = null;
     NSI2Client client = null;
     boolean hasRequester = false;
 
+    // asynchronous operations (see enableAsync)
+    String asyncRequesterURI = null;
+    ConnectionProviderPort asyncProvider = null;
+    AsyncRequester asyncRequester = null;
+
     private final String DEFAULT_GLOBAL_RESERVATION_ID = "global";
     private final String DEFAULT_DESCRIPTION = "created by nsi2-rest service";
     private final static Logger logger = Logger.getLogger(NSI2Interface.class.getName());
@@ -86,6 +103,29 @@ public class NSI2Interface {
      String httpUser, String httpPassword)
     throws Exception
     {
+        this(providerNSA, providerURI, requesterNSA, requesterURI, httpUser, httpPassword,
+             new SampleEventListener());
+    }
+
+    /* notifications received by requester (dataPlaneStateChange, errorEvent, error) are passed to listener */
+    public NSI2Interface
+    (String providerNSA, String providerURI, 
+     String requesterNSA, String requesterURI,
+     String httpUser, String httpPassword, EventListener listener)
+    throws Exception
+    {
+        this(providerNSA, providerURI, requesterNSA, requesterURI, httpUser, httpPassword,
+             listener, 300 * 1000L);
+    }
+
+    /* replyWait [msec] limits waiting for XxxConfirmed/Failed messages of every operation */
+    public NSI2Interface
+    (String providerNSA, String providerURI, 
+     String requesterNSA, String requesterURI,
+     String httpUser, String httpPassword, EventListener listener, long replyWait)
+    throws Exception
+    {
+        this.replyWait = replyWait;
         this.providerNSA = providerNSA;
         this.providerURI = providerURI;
         this.requesterNSA = requesterNSA;
@@ -94,7 +134,7 @@ public class NSI2Interface {
         this.httpPassword = httpPassword;
 
         if (requesterURI != null) hasRequester = true;
-        listener = new SampleEventListener();
+        this.listener = listener;
         client = getNSI2Client();
     }
 
@@ -117,20 +157,6 @@ public class NSI2Interface {
         return c;
     }
 
-    private int getNewVersion(String reservationId) 
-    {
-        Integer it = versions.get(reservationId);
-        if (it == null) {
-            it = new Integer(0);
-            versions.put(reservationId, it);
-        } else {
-            it ++;
-        }
-        logger.debug("******************* value=" + it);
-        return it.intValue();
-    }
-
-
     public static P2PServiceBaseType getP2PServiceBaseType(List<Object> list)
     {
         Object o = list.get(0);
@@ -149,45 +175,37 @@ public class NSI2Interface {
     throws Exception 
     {
         ReservationRequestCriteriaType criteria = makeReservationCriteria
-            (gid, sSTP, dSTP, sVlan, dVlan, capacity, start, end);
-
-        P2PServiceBaseType p2p = getP2PServiceBaseType(criteria.getAny());
-        if (p2p != null) {
-            StpListType erolist = p2p.getEro();
-            if (eros != null) {
-                int size = eros.length;
-                if (erolist == null && size != 0) {
-                    erolist = new StpListType();
-                    p2p.setEro(erolist);
-                }
-                List<OrderedStpType> oero = erolist.getOrderedSTP();
-
-                for (int i = 0; i < size; i ++) {
-                    logger.debug("******************* ero[" + i + "]=" + eros[i]);
-                    OrderedStpType ost = new OrderedStpType();
-                    ost.setStp(eros[i]);
-                    ost.setOrder(i);
-                    oero.add(ost);
-                }
-            } else {
-                logger.debug("******************* ero os null");
-            }
-        }
+            (gid, sSTP, dSTP, sVlan, dVlan, capacity, start, end, eros);
 
+        String reservationId = null;
         try {
-            String reservationId = reserve(gid, description, criteria);
+            reservationId = reserve(gid, description, criteria);
             logger.debug("******************* reservationId:" + reservationId);
             commit(reservationId);
-
-            criterias.put(reservationId, criteria);
-            capacities.put(reservationId, new Long(capacity));
             return reservationId;
+        } catch (ServiceException e) {
+            logger.debug("******************* ex:" + e);
+            throw heldReservation(e, reservationId);
         } catch (Exception e) {
             logger.debug("******************* ex:" + e);
             throw e;
         }
     }
 
+    /* connectionId of the fault tells the caller which reservation is held until aborted */
+    public static ServiceException heldReservation(ServiceException e, String reservationId)
+    {
+        if (reservationId == null) return e;
+        ServiceExceptionType t = e.getFaultInfo();
+        if (t == null) {
+            t = new ServiceExceptionType();
+            t.setText(e.getMessage());
+            e = new ServiceException(e.getMessage(), t);
+        }
+        if (t.getConnectionId() == null) t.setConnectionId(reservationId);
+        return e;
+    }
+
     public ReservationRequestCriteriaType makeReservationCriteria
     (String gid, String sSTP, String dSTP, int sVlan, int dVlan, long capacity,
          int startTime, int endTime, String[] ero)
@@ -263,7 +281,7 @@ public class NSI2Interface {
     {
         String reservationId = null;
         String globalReservationId = gid;
-        showMessage(criteria, NSITextDump.toString(criteria));
+        if (logger.isDebugEnabled()) showMessage(criteria, NSITextDump.toString(criteria));
 
         ReserveReply reply = null;
         try {
@@ -276,17 +294,19 @@ public class NSI2Interface {
 
         if (reply.getConfirm() != null) {
             ReservationConfirmCriteriaType conf = reply.getConfirm();
-            showMessage("ConnectionID", reply.getConnectionId());
-            showMessage(conf, NSITextDump.toString(conf));
-            int version = conf.getVersion();
-            versions.put(reply.getConnectionId(), new Integer(version));
+            if (logger.isDebugEnabled()) {
+                showMessage("ConnectionID", reply.getConnectionId());
+                showMessage(conf, NSITextDump.toString(conf));
+            }
         } else if (reply.getServiceException() != null) {
-            showMessage
-               (reply.getServiceException(),
-                NSITextDump.toString(reply.getServiceException()));
-            showMessage
-               (reply.getConnectionStates(),
-                NSITextDump.toString(reply.getConnectionStates()));
+            if (logger.isDebugEnabled()) {
+                showMessage
+                   (reply.getServiceException(),
+                    NSITextDump.toString(reply.getServiceException()));
+                showMessage
+                   (reply.getConnectionStates(),
+                    NSITextDump.toString(reply.getConnectionStates()));
+            }
 
             ServiceExceptionType t = reply.getServiceException();
             String s = NSITextDump.toString(t);
@@ -302,12 +322,14 @@ public class NSI2Interface {
         if (reply.getServiceException() == null) {
             logger.debug("ReserveCommitConfirmed");
         } else if (reply.getServiceException() != null) {
-            showMessage
-               (reply.getServiceException(),
-                NSITextDump.toString(reply.getServiceException()));
-            showMessage
-               (reply.getConnectionStates(),
-                NSITextDump.toString(reply.getConnectionStates()));
+            if (logger.isDebugEnabled()) {
+                showMessage
+                   (reply.getServiceException(),
+                    NSITextDump.toString(reply.getServiceException()));
+                showMessage
+                   (reply.getConnectionStates(),
+                    NSITextDump.toString(reply.getConnectionStates()));
+            }
         }
     }
 
@@ -317,66 +339,189 @@ public class NSI2Interface {
         client.reserveAbort(reservationId);
     }
 
-    public String modify (String gid, String description, String reservationId, int end_time_sec)
-    throws Exception 
+    /* confirmation (error == null) or failure of operation sent by sendReserve or send */
+    public interface ReplyCallback {
+        void reply(String error);
+    }
+
+    /* requester passing replies of asynchronous operations to their callbacks, callbacks of 
+       operations not replied in replyWait are dropped (the caller times them out) */
+    public static class AsyncRequester extends SampleRequesterWaitable {
+        private final LinkedHashMap<String, Pending> callbacks = new LinkedHashMap<String, Pending>();
+        private final long replyWait;
+
+        private static class Pending {
+            final ReplyCallback callback;
+            final long sent = System.currentTimeMillis();
+
+            Pending(ReplyCallback callback) {
+                this.callback = callback;
+            }
+        }
+
+        public AsyncRequester(EventListener listener, long replyWait) {
+            super(listener);
+            this.replyWait = replyWait;
+        }
+
+        void expect(String correlationId, ReplyCallback callback) {
+            Pending pending = new Pending(callback);
+            synchronized (callbacks) {
+                Iterator<Pending> i = callbacks.values().iterator();
+                while (i.hasNext() && i.next().sent < pending.sent - replyWait) i.remove();
+                callbacks.put(correlationId, pending);
+            }
+        }
+
+        void forget(String correlationId) {
+            synchronized (callbacks) {
+                callbacks.remove(correlationId);
+            }
+        }
+
+        @Override
+        protected void addReply(String correlationId, Object o) {
+            Pending pending;
+            synchronized (callbacks) {
+                pending = callbacks.remove(correlationId);
+            }
+            if (pending == null) {
+                super.addReply(correlationId, o);
+                return;
+            }
+            String error = null;
+            if (o instanceof FailedMessage) {
+                ServiceExceptionType t = ((FailedMessage) o).getServiceExceptionType();
+                error = (t == null) ? "operation failed" : NSITextDump.toString(t);
+            }
+            try {
+                pending.callback.reply(error);
+            } catch (Exception e) {
+                logger.error("reply callback of correlationId=" + correlationId + " failed", e);
+            }
+        }
+    }
+
+    /* publishes requester receiving replies of asynchronous operations at asyncRequesterURI, 
+       operations are sent by a provider port of their own */
+    public void enableAsync(String asyncRequesterURI)
     {
-        String globalReservationId = gid;
+        ConnectionProviderPort port = NSIUtil.getProviderPort(providerURI);
+        if (httpUser != null && httpPassword == null) 
+            NSIUtil.setOAuth2Token((BindingProvider) port, httpUser);
+        else
+            NSIUtil.setUserPass((BindingProvider) port, httpUser, httpPassword);
+        asyncRequester = new AsyncRequester(listener, replyWait);
+        SecurityUtil.publish(asyncRequesterURI, asyncRequester);
+        asyncProvider = port;
+        this.asyncRequesterURI = asyncRequesterURI;
+    }
+
+    private CommonHeaderType asyncHeader()
+    {
+        CommonHeaderType header = new CommonHeaderType();
+        header.setProtocolVersion(NSIUtil.getProviderProtocolVersion());
+        header.setCorrelationId(NSIUtil.getNewCorrelationId());
+        header.setRequesterNSA(requesterNSA);
+        header.setProviderNSA(providerNSA);
+        header.setReplyTo(asyncRequesterURI);
+        return header;
+    }
 
-        ReservationRequestCriteriaType old = 
-        (ReservationRequestCriteriaType) criterias.get(reservationId);
-        if (old == null) {
-            throw new ServiceException
-            ("No such reservation, id=" + reservationId);
+    /* sends reserve without waiting for reserveConfirmed/Failed (passed to callback), 
+       returns connectionId acknowledged by the provider */
+    public String sendReserve
+    (String gid, String description, ReservationRequestCriteriaType criteria, ReplyCallback callback)
+    throws Exception
+    {
+        if (logger.isDebugEnabled()) showMessage(criteria, NSITextDump.toString(criteria));
+        CommonHeaderType header = asyncHeader();
+        Holder<String> holder = new Holder<String>();
+        asyncRequester.expect(header.getCorrelationId(), callback);
+        try {
+            new ProviderPortWithHeader(header, asyncProvider).reserve(holder, gid, description, criteria);
+        } catch (Exception e) {
+            asyncRequester.forget(header.getCorrelationId());
+            throw e;
         }
-        ScheduleType oldSchedule = old.getSchedule();
-        Calendar oldStart = oldSchedule.getStartTime();
+        return holder.value;
+    }
 
-        Calendar start = Calendar.getInstance();
-    
-        long lend = ((long) end_time_sec) * 1000;
-        Calendar end = Calendar.getInstance();
-        end.setTimeInMillis(lend);
+    /* sends commit, abort or provision of the reservation without waiting for its reply (passed to callback) */
+    public void send(String operation, String reservationId, ReplyCallback callback) 
+    throws Exception
+    {
+        CommonHeaderType header = asyncHeader();
+        ProviderPortWithHeader port = new ProviderPortWithHeader(header, asyncProvider);
+        asyncRequester.expect(header.getCorrelationId(), callback);
+        try {
+            if (operation.equals("commit")) port.reserveCommit(reservationId);
+            else if (operation.equals("abort")) port.reserveAbort(reservationId);
+            else if (operation.equals("provision")) port.provision(reservationId);
+            else throw new IllegalArgumentException("unknown asynchronous operation: " + operation);
+        } catch (Exception e) {
+            asyncRequester.forget(header.getCorrelationId());
+            throw e;
+        }
+    }
 
-        ScheduleType schedule = TypesBuilder.makeScheduleType(oldStart, end);
+    public int modify
+    (String gid, String description, String reservationId, int startTime, int endTime, long capacity, int version)
+    throws Exception 
+    {
+        // schedule, capacity and version of the reservation are kept by the caller (see reservation_store.py)
+        String globalReservationId = gid;
 
-        long capacity = capacities.get(reservationId).longValue();
+        Calendar start = null;
+        if (startTime != -1) {
+            start = Calendar.getInstance();
+            start.setTimeInMillis(((long) startTime) * 1000);
+        }
+        Calendar end = null;
+        if (endTime != -1) {
+            end = Calendar.getInstance();
+            end.setTimeInMillis(((long) endTime) * 1000);
+        }
+        ScheduleType schedule = TypesBuilder.makeScheduleType(start, end);
 
         ReservationRequestCriteriaType criteria =
         TypesBuilder.makeReservationRequestCriteriaType(schedule, capacity);
-        criteria.setVersion(getNewVersion(reservationId));
-        showMessage(criteria, NSITextDump.toString(criteria));
+        criteria.setVersion(version);
+        if (logger.isDebugEnabled()) showMessage(criteria, NSITextDump.toString(criteria));
 
         ReserveReply reply = client.reserve
         (reservationId, globalReservationId, description, criteria);
 
         if (reply.getConfirm() != null) {
             ReservationConfirmCriteriaType conf = reply.getConfirm();
-            showMessage(conf, NSITextDump.toString(conf));
-            int version = conf.getVersion();
-            versions.put(reservationId, new Integer(version));
+            if (logger.isDebugEnabled()) showMessage(conf, NSITextDump.toString(conf));
+            version = conf.getVersion();
         } else if (reply.getServiceException() != null) {
-            showMessage
-               (reply.getServiceException(),
-                NSITextDump.toString(reply.getServiceException()));
-            showMessage
-               (reply.getConnectionStates(),
-                NSITextDump.toString(reply.getConnectionStates()));
+            if (logger.isDebugEnabled()) {
+                showMessage
+                   (reply.getServiceException(),
+                    NSITextDump.toString(reply.getServiceException()));
+                showMessage
+                   (reply.getConnectionStates(),
+                    NSITextDump.toString(reply.getConnectionStates()));
+            }
 
             ServiceExceptionType t = reply.getServiceException();
             String s = NSITextDump.toString(t);
             throw new Exception (s);
         }
 
-    return reservationId;
+    return version;
     }
 
 
-    public String modifyCommit (String gid, String description, String reservationId, int end_time_sec)
+    public int modifyCommit
+    (String gid, String description, String reservationId, int startTime, int endTime, long capacity, int version)
     throws Exception 
     {
-        String mid = modify(gid, description, reservationId, end_time_sec);
+        int confirmed = modify(gid, description, reservationId, startTime, endTime, capacity, version);
         commit(reservationId);
-        return mid;
+        return confirmed;
     }
 
     public String query(String reservationId) throws Exception {
@@ -384,8 +529,113 @@ public class NSI2Interface {
         queryType.getConnectionId().add(reservationId);
         // QuerySummarySync
         QuerySummaryConfirmedType summary = client.querySummarySync(queryType);
-         showMessage("QuerySummary (sync)", NSITextDump.toString(summary));
-        return NSITextDump.toString(summary);
+        String text = NSITextDump.toString(summary);
+        showMessage("QuerySummary (sync)", text);
+        return text;
+    }
+
+    public List<Map<String, Object>> querySummaries(String[] reservationIds) throws Exception {
+        QueryType queryType = new QueryType();
+        for (String reservationId : reservationIds) {
+            queryType.getConnectionId().add(reservationId);
+        }
+        // one QuerySummarySync for all connections, the text dump is made only for debug logging
+        QuerySummaryConfirmedType summary = client.querySummarySync(queryType);
+        if (logger.isDebugEnabled()) {
+            showMessage("QuerySummary (sync)", NSITextDump.toString(summary));
+        }
+
+        List<Map<String, Object>> results = new ArrayList<Map<String, Object>>();
+        for (QuerySummaryResultType reservation : summary.getReservation()) {
+            results.add(toMap(reservation));
+        }
+        return results;
+    }
+
+    static Map<String, Object> toMap(QuerySummaryResultType summary)
+    {
+        Map<String, Object> map = new HashMap<String, Object>();
+        map.put("connectionId", summary.getConnectionId());
+        map.put("globalReservationId", summary.getGlobalReservationId());
+        map.put("description", summary.getDescription());
+        map.put("requesterNSA", summary.getRequesterNSA());
+        map.put("notificationId", summary.getNotificationId());
+
+        List<Map<String, Object>> criteria = new ArrayList<Map<String, Object>>();
+        for (QuerySummaryResultCriteriaType crit : summary.getCriteria()) {
+            Map<String, Object> c = new HashMap<String, Object>();
+            c.put("version", crit.getVersion());
+            c.put("serviceType", crit.getServiceType());
+            if (crit.getSchedule() != null) {
+                Map<String, Object> schedule = new HashMap<String, Object>();
+                schedule.put("startTime", toString(crit.getSchedule().getStartTime()));
+                schedule.put("endTime", toString(crit.getSchedule().getEndTime()));
+                c.put("schedule", schedule);
+            }
+            c.put("p2ps", toMap(crit.getAny()));
+            List<Map<String, Object>> children = new ArrayList<Map<String, Object>>();
+            if (crit.getChildren() != null) {
+                for (ChildSummaryType child : crit.getChildren().getChild()) {
+                    Map<String, Object> ch = new HashMap<String, Object>();
+                    ch.put("connectionId", child.getConnectionId());
+                    ch.put("providerNSA", child.getProviderNSA());
+                    ch.put("serviceType", child.getServiceType());
+                    ch.put("order", child.getOrder());
+                    ch.put("p2ps", toMap(child.getAny()));
+                    children.add(ch);
+                }
+            }
+            c.put("children", children);
+            criteria.add(c);
+        }
+        map.put("criteria", criteria);
+
+        ConnectionStatesType states = summary.getConnectionStates();
+        if (states != null) {
+            Map<String, Object> s = new HashMap<String, Object>();
+            s.put("reservationState", 
+                  states.getReservationState() == null ? null : states.getReservationState().value());
+            s.put("provisionState", 
+                  states.getProvisionState() == null ? null : states.getProvisionState().value());
+            s.put("lifecycleState", 
+                  states.getLifecycleState() == null ? null : states.getLifecycleState().value());
+            DataPlaneStatusType dataPlane = states.getDataPlaneStatus();
+            if (dataPlane != null) {
+                Map<String, Object> d = new HashMap<String, Object>();
+                d.put("active", dataPlane.isActive());
+                d.put("version", dataPlane.getVersion());
+                d.put("versionConsistent", dataPlane.isVersionConsistent());
+                s.put("dataPlaneStatus", d);
+            }
+            map.put("connectionStates", s);
+        }
+        return map;
+    }
+
+    static Map<String, Object> toMap(List<Object> any)
+    {
+        if (any == null || any.isEmpty()) return null;
+        P2PServiceBaseType p2p = getP2PServiceBaseType(any);
+        if (p2p == null) return null;
+        Map<String, Object> map = new HashMap<String, Object>();
+        map.put("capacity", p2p.getCapacity());
+        map.put("directionality", p2p.getDirectionality() == null ? null : p2p.getDirectionality().value());
+        map.put("symmetricPath", p2p.isSymmetricPath());
+        map.put("sourceSTP", p2p.getSourceSTP());
+        map.put("destSTP", p2p.getDestSTP());
+        List<String> ero = new ArrayList<String>();
+        if (p2p.getEro() != null) {
+            for (OrderedStpType ostp : p2p.getEro().getOrderedSTP()) {
+                ero.add(ostp.getStp());
+            }
+        }
+        map.put("ero", ero);
+        return map;
+    }
+
+    static String toString(Calendar time)
+    {
+        return (time == null) ? null : DatatypeConverter.printDateTime(time);
     }
 
     public void queryNotification (String reservationId) 
@@ -396,7 +646,7 @@ public class NSI2Interface {
         {
             // QueryNotification (sync)
             QueryNotificationConfirmedType conf = client.queryNotificationSync(type);
-            showMessage
+            if (logger.isDebugEnabled()) showMessage
                ("QueryNotification (sync)", 
                 NSITextDump.toString(conf));
         }
@@ -404,11 +654,11 @@ public class NSI2Interface {
             // QueryNotification (async)
             QueryNotificationReply reply = client.queryNotification(type);
             if (reply.getConfirmed() != null) {
-                showMessage
+                if (logger.isDebugEnabled()) showMessage
                    ("QueryNotification (async)", 
                 NSITextDump.toString(reply.getConfirmed()));
             } else {
-                showMessage
+                if (logger.isDebugEnabled()) showMessage
                    ("QueryNotification (async)", 
                 NSITextDump.toString(reply.getException()));
             }
@@ -434,12 +684,9 @@ public class NSI2Interface {
     {
         logger.debug("Terminating " + reservationId);
         client.terminate(reservationId);
-
-        criterias.remove(reservationId);
-        versions.remove(reservationId);
-        capacities.remove(reservationId);
     }
 
+    // callers check logger.isDebugEnabled() before making text dumps of NSI messages
     static private void showMessage(String header, String txt) 
     {
         logger.debug("**** " + header + " ****\n" + txt + "\n");
@@ -478,7 +725,7 @@ public class NSI2Interface {
             nsi.provision(id);
 
             Thread.sleep(10 * 1000);
-            nsi.modifyCommit(gid, "testing", id, 0);
+            nsi.modifyCommit(gid, "testing", id, -1, -1, 50, 1);
 
             Thread.sleep(10 * 1000);
             nsi.release(id);
@@ -0,0 +1,115 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from bisect import bisect_left, insort
+
+INFINITY = float('inf')
+
+
+class AdmissionError(ValueError):
+    """Requested connection conflicts with reservations held by the service"""
+    pass
+
+
+class AdmissionIndex:
+    """Schedules of VLANs and capacity of active reservations on every STP ('domain:port').
+
+    Reservations of one VLAN of STP don't overlap in time (provider doesn't allow it), so intervals
+    kept in start order are also in end order and a VLAN conflict is found by one binary search.
+    Capacity is checked only for ports of limited capacity, by summing reservations overlapping
+    the requested time window (see peak(), linear in the number of reservations of the port starting
+    before the end of the window). Connections being reserved are indexed too (see ReservationStore.hold).
+    """
+    def __init__(self):
+        self.vlans = {}   # (STP, VLAN) -> [(start, end, reservation ID)] sorted by start
+        self.ports = {}   # STP -> [(start, end, reservation ID, capacity)] sorted by start
+        self.size = 0
+
+    def add(self, rid, record):
+        start, end = _window(record)
+        for stp, vlan in _ends(record):
+            insort(self.vlans.setdefault((stp, vlan), []), (start, end, rid))
+            insort(self.ports.setdefault(stp, []), (start, end, rid, record['capacity']))
+        self.size += 1
+
+    def remove(self, rid, record):
+        start, end = _window(record)
+        for stp, vlan in _ends(record):
+            _remove(self.vlans, (stp, vlan), (start, end, rid))
+            _remove(self.ports, stp, (start, end, rid, record['capacity']))
+        self.size -= 1
+
+    def conflicts(self, params, port_capacity=None, ignore=None):
+        """Returns descriptions of conflicts of requested connection (params: src, dst, srcvlan, dstvlan,
+        capacity, start_sec, end_sec) with indexed reservations other than 'ignore' reservation ID.
+
+        port_capacity: dict of STP -> max capacity reserved at any time on the port
+        """
+        start, end = _window(params, time.time())
+        conflicts = []
+        for stp, vlan in _ends(params):
+            intervals = self.vlans.get((stp, vlan), ())
+            # the last reservation starting before the end of requested window
+            i = bisect_left(intervals, (end,)) - 1
+            while i >= 0 and intervals[i][1] > start:
+                if intervals[i][2] != ignore:
+                    conflicts.append("VLAN %s of %s is used by %s" % (vlan, stp, intervals[i][2]))
+                    break
+                i -= 1   # previous version of modified reservation
+            limit = (port_capacity or {}).get(stp)
+            if limit is not None:
+                peak = self.peak(stp, start, end, ignore)
+                if peak + params['capacity'] > limit:
+                    conflicts.append("capacity of %s exceeded: %s reserved of %s" % (stp, peak, limit))
+        return conflicts
+
+    def peak(self, stp, start, end, ignore=None):
+        """Max capacity reserved on STP at any time of window from start to end [sec]"""
+        intervals = self.ports.get(stp, ())
+        changes = []
+        for interval_start, interval_end, rid, capacity in intervals[:bisect_left(intervals, (end,))]:
+            if interval_end > start and rid != ignore:
+                changes.append((max(interval_start, start), capacity))
+                changes.append((interval_end, -capacity))
+        peak = load = 0
+        for _, change in sorted(changes):   # ends (negative changes) are sorted before starts at the same time
+            load += change
+            peak = max(peak, load)
+        return peak
+
+
+def _window(record, now=None):
+    # -1 means not specified: from reservation time / without end
+    start = record['start_sec']
+    if start == -1:
+        start = int(record.get('created', now or time.time()))
+    end = record['end_sec'] if record['end_sec'] != -1 else INFINITY
+    return start, end
+
+
+def _ends(record):
+    ends = [(record['src'], record['srcvlan']), (record['dst'], record['dstvlan'])]
+    return ends if ends[0] != ends[1] else ends[:1]
+
+
+def _remove(index, key, item):
+    items = index.get(key)
+    if items is None:
+        return
+    i = bisect_left(items, item)
+    if i < len(items) and items[i] == item:
+        del items[i]
+    if not items:
+        del index[key]
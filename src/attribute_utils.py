@@ -1,4 +1,9 @@
-from time_utils import time_constrains
+import time
+
+from time_utils import time_constrains, convert_to_utc, convert_to_seconds
+from tracing import span
+
+MODIFIED_ATTRIBUTES = ('end_time', 'capacity', 'description')
 
 
 def prepare_nsi_attributes(connAttributes):
@@ -7,6 +12,8 @@ def prepare_nsi_attributes(connAttributes):
     params['desc'] = connAttributes['description']
     params['src'] = "%(src_domain)s:%(src_port)s" %  connAttributes
     params['dst'] = "%(dst_domain)s:%(dst_port)s" %  connAttributes
+    for name in ('src_domain', 'src_port', 'dst_domain', 'dst_port'):
+        params[name] = connAttributes[name]    # recorded in reservation store for listing
     params['srcvlan'] = int(connAttributes['src_vlan'])
     params['dstvlan'] = int(connAttributes['dst_vlan'])
     params['capacity'] = int(connAttributes['capacity'])
@@ -14,8 +21,25 @@ def prepare_nsi_attributes(connAttributes):
     
     start_time = connAttributes.get('start_time')
     end_time = connAttributes.get('end_time')
-    params['start_sec'], params['end_sec'] = time_constrains(start_time, end_time)
+    with span('time_constrains'):
+        params['start_sec'], params['end_sec'] = time_constrains(start_time, end_time)
+    
+    return params
+    
     
+def prepare_modify_attributes(record, connAttributes):
+    """NSI modify parameters changing end_time, capacity or description of the recorded reservation"""
+    if not any(name in connAttributes for name in MODIFIED_ATTRIBUTES):
+        raise ValueError("Nothing to modify, expected any of %s" % ', '.join(MODIFIED_ATTRIBUTES))
+    params = {}
+    params['gid'] = record['gid']
+    params['desc'] = connAttributes.get('description', record['description'])
+    params['ep_end'] = record['end_sec']
+    params['capacity'] = int(connAttributes.get('capacity', record['capacity']))
+    if connAttributes.get('end_time'):
+        params['ep_end'] = convert_to_seconds(convert_to_utc(connAttributes['end_time']))
+        if params['ep_end'] <= time.time():
+            raise ValueError("end_time %s has already passed" % connAttributes['end_time'])
     return params
     
     
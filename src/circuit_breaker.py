@@ -0,0 +1,92 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading, time
+
+# circuit breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """Provider is considered unavailable, the call was not made"""
+    def __init__(self, message, retry_after=None):
+        Exception.__init__(self, message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calling NSI provider after 'threshold' consecutive failures.
+
+    Calls fail immediately with CircuitOpen for 'reset_timeout' seconds, then a single probe
+    call is let through (half-open state): its success closes the circuit, its failure opens
+    it again. threshold=0 disables the breaker.
+    """
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0          # consecutive failures
+        self.opened = 0            # time of opening the circuit
+        self.probing = False       # probe call of half-open circuit in progress
+        self.lock = threading.Lock()
+        self.rejected = self.trips = 0
+
+    def before(self):
+        """Raises CircuitOpen when the call can't be made now"""
+        if self.threshold <= 0:
+            return
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            left = self.opened + self.reset_timeout - time.time()
+            if self.state == OPEN and left <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpen("NSI provider unavailable, calls suspended", max(left, 0))
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            self.state = CLOSED
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.threshold > 0 and (self.state == HALF_OPEN or self.failures >= self.threshold):
+                if self.state != OPEN:
+                    self.trips += 1
+                self.state = OPEN
+                self.opened = time.time()
+
+    def ignore(self):
+        """Call ended with error which says nothing about availability of the provider"""
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+
+    def stats(self):
+        with self.lock:
+            return {'state': self.state,
+                    'failures': self.failures,
+                    'trips': self.trips,
+                    'rejected': self.rejected}
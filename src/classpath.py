@@ -0,0 +1,116 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob, logging, sys
+
+logger = logging.getLogger(__name__)
+
+# jars of NSI2Interface, AIST NSI2 client library and Apache CXF added to sys.path when 
+# NSI_CLASSPATH option is not set
+DEFAULT_CLASSPATH = (
+    '/usr/share/java/',
+    '../../clientapi/build/jar/nsi2_client.jar',
+    '../libs/commons-logging-1.1.1.jar',
+    '../libs/log4j-1.2.13.jar',
+
+    '/opt/apache-cxf/lib/antlr-2.7.7.jar',
+    '/opt/apache-cxf/lib/aopalliance-1.0.jar',
+    '/opt/apache-cxf/lib/asm-3.3.jar',
+    '/opt/apache-cxf/lib/commons-collections-3.2.1.jar',
+    '/opt/apache-cxf/lib/commons-lang-2.6.jar',
+    '/opt/apache-cxf/lib/commons-logging-1.1.1.jar',
+    '/opt/apache-cxf/lib/cxf-2.4.2.jar',
+    '/opt/apache-cxf/lib/cxf-manifest.jar',
+    '/opt/apache-cxf/lib/cxf-xjc-boolean-2.4.0.jar',
+    '/opt/apache-cxf/lib/cxf-xjc-bug671-2.4.0.jar',
+    '/opt/apache-cxf/lib/cxf-xjc-dv-2.4.0.jar',
+    '/opt/apache-cxf/lib/cxf-xjc-ts-2.4.0.jar',
+    '/opt/apache-cxf/lib/FastInfoset-1.2.9.jar',
+    '/opt/apache-cxf/lib/geronimo-activation_1.1_spec-1.1.jar',
+    '/opt/apache-cxf/lib/geronimo-annotation_1.0_spec-1.1.1.jar',
+    '/opt/apache-cxf/lib/geronimo-javamail_1.4_spec-1.7.1.jar',
+    '/opt/apache-cxf/lib/geronimo-jaxws_2.2_spec-1.0.jar',
+    '/opt/apache-cxf/lib/geronimo-jms_1.1_spec-1.1.1.jar',
+    '/opt/apache-cxf/lib/geronimo-servlet_3.0_spec-1.0.jar',
+    '/opt/apache-cxf/lib/geronimo-stax-api_1.0_spec-1.0.1.jar',
+    '/opt/apache-cxf/lib/geronimo-ws-metadata_2.0_spec-1.1.3.jar',
+    '/opt/apache-cxf/lib/isorelax-20030108.jar',
+    '/opt/apache-cxf/lib/jaxb-api-2.2.1.jar',
+    '/opt/apache-cxf/lib/jaxb-impl-2.2.1.1.jar',
+    '/opt/apache-cxf/lib/jaxb-xjc-2.2.1.1.jar',
+    '/opt/apache-cxf/lib/jettison-1.3.jar',
+    '/opt/apache-cxf/lib/jetty-continuation-7.4.5.v20110725.jar',
+    '/opt/apache-cxf/lib/jetty-http-7.4.5.v20110725.jar',
+    '/opt/apache-cxf/lib/jetty-io-7.4.5.v20110725.jar',
+    '/opt/apache-cxf/lib/jetty-security-7.4.5.v20110725.jar',
+    '/opt/apache-cxf/lib/jetty-server-7.4.5.v20110725.jar',
+    '/opt/apache-cxf/lib/jetty-util-7.4.5.v20110725.jar',
+    '/opt/apache-cxf/lib/joda-time-1.6.2.jar',
+    '/opt/apache-cxf/lib/jra-1.0-alpha-4.jar',
+    '/opt/apache-cxf/lib/js-1.7R2.jar',
+    '/opt/apache-cxf/lib/jsr311-api-1.1.1.jar',
+    '/opt/apache-cxf/lib/msv-core-2010.2.jar',
+    '/opt/apache-cxf/lib/neethi-3.0.1.jar',
+    '/opt/apache-cxf/lib/opensaml-2.4.1.jar',
+    '/opt/apache-cxf/lib/openws-1.4.1.jar',
+    '/opt/apache-cxf/lib/relaxngDatatype-20020414.jar',
+    '/opt/apache-cxf/lib/saaj-api-1.3.jar',
+    '/opt/apache-cxf/lib/saaj-impl-1.3.2.jar',
+    '/opt/apache-cxf/lib/serializer-2.7.1.jar',
+    '/opt/apache-cxf/lib/slf4j-api-1.6.1.jar',
+    '/opt/apache-cxf/lib/slf4j-jdk14-1.6.1.jar',
+    '/opt/apache-cxf/lib/spring-aop-3.0.5.RELEASE.jar',
+    '/opt/apache-cxf/lib/spring-asm-3.0.5.RELEASE.jar',
+    '/opt/apache-cxf/lib/spring-beans-3.0.5.RELEASE.jar',
+    '/opt/apache-cxf/lib/spring-context-3.0.5.RELEASE.jar',
+    '/opt/apache-cxf/lib/spring-core-3.0.5.RELEASE.jar',
+    '/opt/apache-cxf/lib/spring-expression-3.0.5.RELEASE.jar',
+    '/opt/apache-cxf/lib/spring-jms-3.0.5.RELEASE.jar',
+    '/opt/apache-cxf/lib/spring-tx-3.0.5.RELEASE.jar',
+    '/opt/apache-cxf/lib/spring-web-3.0.5.RELEASE.jar',
+    '/opt/apache-cxf/lib/stax2-api-3.1.1.jar',
+    '/opt/apache-cxf/lib/velocity-1.7.jar',
+    '/opt/apache-cxf/lib/woodstox-core-asl-4.1.1.jar',
+    '/opt/apache-cxf/lib/wsdl4j-1.6.2.jar',
+    '/opt/apache-cxf/lib/wss4j-1.6.2.jar',
+    '/opt/apache-cxf/lib/xalan-2.7.1.jar',
+    '/opt/apache-cxf/lib/xmlbeans-2.4.0.jar',
+    '/opt/apache-cxf/lib/xml-resolver-1.2.jar',
+    '/opt/apache-cxf/lib/xmlschema-core-2.0.jar',
+    '/opt/apache-cxf/lib/xmlsec-1.4.5.jar',
+    '/opt/apache-cxf/lib/xmltooling-1.3.1.jar',
+    '/opt/apache-cxf/lib/xsdlib-2010.1.jar',
+)
+
+_done = []
+
+
+def setup(entries=None):
+    """Appends entries (paths of jars or directories, glob patterns like '/opt/apache-cxf/lib/*.jar'
+    are expanded) or DEFAULT_CLASSPATH to sys.path. Only the first call has an effect, so java classes
+    imported later are resolved by the path given in configuration. An empty list adds nothing
+    (classes are found by CLASSPATH of the JVM, see bin/nsi_connection.sh)."""
+    if _done:
+        return
+    _done.append(True)
+    if entries is None:
+        entries = DEFAULT_CLASSPATH
+    paths = []
+    for entry in entries:
+        if glob.has_magic(entry):
+            paths.extend(sorted(glob.glob(entry)))
+        else:
+            paths.append(entry)
+    sys.path.extend(path for path in paths if path not in sys.path)
+    logger.debug("%i classpath entries added to sys.path", len(paths))
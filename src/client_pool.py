@@ -0,0 +1,90 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading, time
+from contextlib import contextmanager
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from tracing import span
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ClientPool:
+    """Pool of NSI clients, each of them is used by one request at a time.
+
+    Requests wait up to 'wait' seconds for a free client (PoolTimeout is raised then),
+    or less when the caller passes shorter wait (eg. time left until its deadline).
+    """
+    def __init__(self, clients, wait=60):
+        self.size = len(clients)
+        self.wait = wait
+        self.idle = Queue()
+        for client in clients:
+            self.idle.put(client)
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @contextmanager
+    def client(self, wait=None):
+        with span('client_pool.checkout'):
+            client = self.checkout(wait)
+        try:
+            yield client
+        finally:
+            self.idle.put(client)
+
+    def checkout(self, wait=None):
+        wait = self.wait if wait is None else max(min(self.wait, wait), 0)
+        start = time.time()
+        with self.lock:
+            self.waiting += 1
+        try:
+            client = self.idle.get(timeout=wait)
+        except Empty:
+            client = None
+        waited = time.time() - start
+        with self.lock:
+            self.waiting -= 1
+            if client is None:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+        if client is None:
+            raise PoolTimeout("No NSI client available in %s sec" % wait)
+        return client
+
+    def stats(self):
+        with self.lock:
+            in_use = self.size - self.idle.qsize()
+            return {'size': self.size,
+                    'in_use': in_use,
+                    'utilization': float(in_use) / self.size if self.size else 0.0,
+                    'waiting': self.waiting,
+                    'checkouts': self.checkouts,
+                    'timeouts': self.timeouts,
+                    'wait_mean': self.wait_total / self.checkouts if self.checkouts else 0.0,
+                    'wait_max': self.wait_max}
@@ -0,0 +1,195 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64, json, threading, time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+
+from reservation_store import CREATED, PASSED_END_TIME, PROVISIONED
+from time_utils import convert_to_utc, convert_to_seconds
+
+# attributes of listed connections
+FIELDS = ('reservation_id', 'global_reservation_id', 'description',
+          'src_domain', 'src_port', 'src_vlan', 'dst_domain', 'dst_port', 'dst_vlan', 'capacity',
+          'start_time', 'end_time', 'explicit_routes', 'lifecycleState', 'provisionState', 'active',
+          'version', 'created')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class ListingError(ValueError):
+    pass
+
+
+class ConnectionIndex:
+    """Keys (creation time, reservation ID) of reservations of the store kept in listing order, so pages
+    are read from the position of the cursor instead of sorting all records. It is kept up to date by
+    changes of the store (see ReservationStore.watch), also of records loaded later from its log.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.keys = []     # (created, reservation ID) sorted
+        self.by_rid = {}   # reservation ID -> its key
+        self.lock = threading.Lock()
+        store.watch(self._changed)
+
+    def records(self, after=None, chunk=DEFAULT_LIMIT):
+        """Yields records of reservations in listing order, starting after 'after' key"""
+        self.store.get_many([])   # reads changes of the log made by other processes
+        while True:
+            with self.lock:
+                i = bisect_right(self.keys, after) if after else 0
+                keys = self.keys[i:i + chunk]
+            if not keys:
+                return
+            for record in self.store.get_many([rid for _, rid in keys]):
+                yield record
+            after = keys[-1]
+
+    def _changed(self, rid, record):
+        # called by the store with its lock held
+        key = (record.get('created', 0), rid) if record is not None else None
+        with self.lock:
+            old = self.by_rid.get(rid)
+            if old == key:
+                return
+            if old is not None:
+                i = bisect_left(self.keys, old)
+                if i < len(self.keys) and self.keys[i] == old:
+                    del self.keys[i]
+                del self.by_rid[rid]
+            if key is not None:
+                insort(self.keys, key)
+                self.by_rid[rid] = key
+
+
+def list_connections(store, index, args):
+    """Lists connections recorded in reservation store, without querying NSI provider.
+
+    args (query string arguments):
+        - state: comma separated lifecycle or provision states (eg. 'CREATED,PROVISIONED')
+        - src_domain, src_port, dst_domain, dst_port: exact values
+        - vlan: VLAN used on any of ports, src_vlan, dst_vlan: VLAN of source/destination port
+        - start_time, end_time: ISO 8601 time window overlapping with connection schedule
+        - description: case-insensitive substring of description
+        - limit: max number of returned connections (up to MAX_LIMIT)
+        - cursor: value of 'next_cursor' returned by the previous call
+        - fields: comma separated attributes to be returned (see FIELDS)
+
+    Returns (connections, next_cursor), connections are ordered by creation time (read from the
+    cursor position of ConnectionIndex until the page is full, unless STP or time window selects
+    fewer records), next_cursor is None on the last page. ListingError is raised for incorrect args.
+    """
+    try:
+        limit = min(int(args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT)
+        window = [convert_to_seconds(convert_to_utc(args[name])) if args.get(name) else None
+                  for name in ('start_time', 'end_time')]
+        vlans = [int(args[name]) if args.get(name) else None for name in ('vlan', 'src_vlan', 'dst_vlan')]
+        after = _decode_cursor(args['cursor']) if args.get('cursor') else None
+    except Exception as e:
+        raise ListingError("Incorrect listing arguments: %r" % e)
+    if limit < 1:
+        raise ListingError("Incorrect listing limit %i" % limit)
+    fields = _split(args.get('fields')) or FIELDS
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        raise ListingError("Unknown fields %s" % ', '.join(sorted(unknown)))
+    states = set(_split(args.get('state')))
+    description = args.get('description', '').lower()
+
+    # the most selective index: STP, time window or all reservations
+    stp = None
+    for end in ('src', 'dst'):
+        if args.get(end + '_domain') and args.get(end + '_port'):
+            stp = '%s:%s' % (args[end + '_domain'], args[end + '_port'])
+    if stp is not None or window != [None, None]:
+        records = sorted((record for record in store.find(stp=stp, start=window[0], end=window[1])
+                          if not after or _key(record) > after), key=_key)
+    else:
+        records = index.records(after, limit + 1)
+
+    now = time.time()
+    matching = []
+    for record in records:
+        connection = describe_connection(record, now)
+        if states and not states & set((connection['lifecycleState'], connection['provisionState'])):
+            continue
+        if any(args.get(name) and connection[name] != args[name]
+               for name in ('src_domain', 'src_port', 'dst_domain', 'dst_port')):
+            continue
+        vlan, src_vlan, dst_vlan = vlans
+        if vlan is not None and vlan not in (connection['src_vlan'], connection['dst_vlan']):
+            continue
+        if (src_vlan is not None and src_vlan != connection['src_vlan'] or
+                dst_vlan is not None and dst_vlan != connection['dst_vlan']):
+            continue
+        if description and description not in (connection['description'] or '').lower():
+            continue
+        matching.append((_key(record), connection))
+        if len(matching) > limit:
+            break
+
+    page = matching[:limit]
+    next_cursor = _encode_cursor(page[-1][0]) if len(matching) > limit else None
+    return [dict((name, connection[name]) for name in fields) for _, connection in page], next_cursor
+
+
+def describe_connection(record, now=None):
+    """Returns FIELDS of connection recorded in reservation store"""
+    lifecycle = record['lifecycleState']
+    now = now or time.time()
+    if lifecycle == CREATED and 0 < record['end_sec'] <= now:
+        lifecycle = PASSED_END_TIME
+    return {'reservation_id': record['reservation_id'],
+            'global_reservation_id': record['gid'],
+            'description': record['description'],
+            'src_domain': record.get('src_domain'),
+            'src_port': record.get('src_port'),
+            'src_vlan': record['srcvlan'],
+            'dst_domain': record.get('dst_domain'),
+            'dst_port': record.get('dst_port'),
+            'dst_vlan': record['dstvlan'],
+            'capacity': record['capacity'],
+            'start_time': _iso(record['start_sec']),
+            'end_time': _iso(record['end_sec']),
+            'explicit_routes': record.get('explicit_routes'),
+            'lifecycleState': lifecycle,
+            'provisionState': record.get('provisionState'),
+            'active': lifecycle == CREATED and record.get('provisionState') == PROVISIONED,
+            'version': record['version'],
+            'created': _iso(record['created'])}
+
+
+def _key(record):
+    return (record.get('created', 0), record['reservation_id'])
+
+
+def _iso(seconds):
+    if seconds == -1:
+        return None
+    return datetime.utcfromtimestamp(int(seconds)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _split(text):
+    return [item.strip() for item in (text or '').split(',') if item.strip()]
+
+
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor):
+    created, rid = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+    return (created, rid)
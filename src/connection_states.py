@@ -0,0 +1,143 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading, time
+from collections import OrderedDict
+
+from reservation_store import FAILED
+
+FORCED_END = 'forcedEnd'   # errorEvent ending the connection (lifecycle state becomes FAILED)
+
+
+class ConnectionStates:
+    """Statuses of connections kept up to date by notifications of NSI provider.
+
+    Status returned by provider query is kept until max_age seconds pass or the end time
+    of the connection (lifecycle state changes then without notification). Meanwhile
+    dataPlaneStateChange and forcedEnd notifications are applied to the status, so it
+    doesn't have to be queried again. Other notifications and operations of the service
+    changing the connection remove its status. max_age=0 disables the table.
+    """
+    def __init__(self, max_age=300, max_size=100000):
+        self.max_age = max_age
+        self.max_size = max_size
+        self.entries = OrderedDict()   # reservation ID -> (expiration time, status), the least recently used first
+        self.changes = 0               # number of invalidations
+        self.changed = {}              # reservation ID -> number of its latest invalidation
+        self.oldest = 0                # invalidations before this one are forgotten
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.notifications = self.applied = 0
+
+    def get(self, rid):
+        """Returns copy of known status of the connection, None when unknown or stale"""
+        with self.lock:
+            entry = self.entries.pop(rid, None)
+            if entry and entry[0] > time.time():
+                self.entries[rid] = entry
+                self.hits += 1
+                return _copy(entry[1])
+            self.misses += 1
+            return None
+
+    def token(self):
+        """Returns token to be passed to put() with status queried after this call"""
+        with self.lock:
+            return self.changes
+
+    def put(self, rid, status, token, end=None):
+        """Keeps status queried from the provider, until connection end time [sec] at latest.
+        Status is ignored when connection was changed after token() was taken."""
+        if self.max_age <= 0 or not status:
+            return
+        expiration = time.time() + self.max_age
+        if end is not None and end > 0:
+            expiration = min(expiration, end)
+        with self.lock:
+            if token < self.oldest or self.changed.get(rid, -1) > token:
+                return
+            entry = self.entries.pop(rid, None)
+            if entry and _notification_id(entry[1]) > _notification_id(status):
+                status = entry[1]   # notification received while status was being queried
+            self.entries[rid] = (expiration, _copy(status))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def notify(self, rid, notification_id, data_plane=None, event=None):
+        """Applies notification to the known status: data_plane (active, version, versionConsistent)
+        of dataPlaneStateChange or event of errorEvent. Returns True when status was updated."""
+        with self.lock:
+            self.notifications += 1
+            entry = self.entries.get(rid)
+            if not entry:
+                self._invalidate(rid)   # status being queried may be older than notification
+                return False
+            expiration, status = entry
+            if notification_id <= _notification_id(status):
+                return False   # already applied or older than queried status
+            if data_plane is not None:
+                states = status.setdefault('connectionStates', {})
+                states['dataPlaneStatus'] = dict(data_plane)
+                for name in ('active', 'version', 'versionConsistent'):
+                    status[name] = _text(data_plane[name])
+            elif event == FORCED_END:
+                status.setdefault('connectionStates', {})['lifecycleState'] = FAILED
+                status['lifecycleState'] = FAILED
+            else:
+                self._invalidate(rid)   # effect of other events is known only to the provider
+                return False
+            status['notificationId'] = _text(notification_id)
+            self.applied += 1
+            return True
+
+    def invalidate(self, rid):
+        with self.lock:
+            self._invalidate(rid)
+
+    def _invalidate(self, rid):
+        self.entries.pop(rid, None)
+        self.changes += 1
+        self.changed[rid] = self.changes
+        if len(self.changed) > self.max_size:
+            self.changed.clear()
+            self.oldest = self.changes
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries),
+                    'max_age': self.max_age,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'notifications': self.notifications,
+                    'applied': self.applied}
+
+
+def _notification_id(status):
+    try:
+        return int(status.get('notificationId') or 0)
+    except ValueError:
+        return 0
+
+
+def _text(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _copy(status):
+    copy = dict(status)
+    states = status.get('connectionStates')
+    if states:
+        copy['connectionStates'] = dict(states)
+    return copy
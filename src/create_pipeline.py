@@ -0,0 +1,278 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, threading, time, uuid
+from collections import deque
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+import tracing
+from job_manager import JobQueueFull
+from reservation_store import FAILED as RESERVATION_FAILED, RELEASED
+from timers import Timers
+
+logger = logging.getLogger(__name__)
+
+# creation states
+RESERVING = 'reserving'
+COMMITTING = 'committing'
+PROVISIONING = 'provisioning'
+CREATED = 'created'
+FAILED = 'failed'
+
+OPERATIONS = {RESERVING: 'reserve', COMMITTING: 'commit', PROVISIONING: 'provision'}
+NEXT_STATE = {RESERVING: COMMITTING, COMMITTING: PROVISIONING, PROVISIONING: CREATED}
+
+
+class Creation:
+    """Connection created by CreatePipeline, see report()"""
+    def __init__(self, params, done):
+        self.id = str(uuid.uuid4())
+        self.params = params
+        self.done = done   # called when the creation ends
+        self.request_id = tracing.request_id()   # creation is traced under ID of the submitting request
+        self.state = RESERVING
+        self.reservation_id = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.steps = {}   # operation -> seconds until its confirmation
+        self.step = 0     # number of the current step, replies of previous ones are stale
+        self.step_started = None
+        self.released = False  # reservation was recorded as failed
+        self.aborted = False   # abort of the reservation was sent
+        self.deleted = False   # deletion of the committed connection was requested
+        self.lock = threading.Lock()
+        self.ended = threading.Event()
+
+    def report(self):
+        return {'id': self.id,
+                'state': self.state,
+                'reservation_id': self.reservation_id,
+                'error': self.error,
+                'created': self.created,
+                'finished': self.finished,
+                'steps': dict(self.steps)}
+
+
+class CreatePipeline:
+    """Creates connections by sending reserve, commit and provision to the provider one after
+    another, without a thread waiting for the confirmations (see NSIBackend.send).
+
+    Every confirmation is put to the event queue by requester thread of the backend and the next
+    operation is sent by one of 'workers' threads, so a few threads drive many creations. A step
+    not confirmed in step_timeout seconds fails. When reserve or commit fails the held reservation
+    is aborted (once, a reserve not confirmed in time when its confirmation comes), connection which
+    failed to provision or was committed after timeout is deleted (see NSIBackend.discard).
+    At most max_pending creations are in progress (JobQueueFull is raised when there are more),
+    ended creations are kept for 'retention' seconds (at most max_size of them).
+    """
+    def __init__(self, backend, workers=2, step_timeout=300, max_pending=1000, retention=3600, max_size=100000):
+        self.backend = backend
+        self.step_timeout = step_timeout
+        self.max_pending = max_pending
+        self.pending = 0
+        self.retention = retention
+        self.max_size = max_size
+        self.events = Queue()
+        self.timers = Timers('create-pipeline-timeouts')
+        self.creations = {}       # id -> Creation
+        self.by_rid = {}          # reservation ID -> Creation
+        self.finished = deque()   # ended creations, the oldest first
+        self.lock = threading.Lock()
+        self.counts = {CREATED: 0, FAILED: 0, 'aborted': 0, 'deleted': 0}
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name='create-pipeline-%i' % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, params, done=None):
+        """Starts creation of the connection (params: see prepare_nsi_attributes), returns Creation.
+        done(creation) is called by a pipeline thread when it ends, so it must not block."""
+        creation = Creation(params, done)
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise JobQueueFull("Too many connections being created (%i)" % self.pending)
+            self._expire()
+            self.creations[creation.id] = creation
+            self.pending += 1
+        self.events.put(('start', creation, 0, None))
+        logger.debug("Creation %s submitted", creation.id)
+        return creation
+
+    def get(self, creation_id):
+        with self.lock:
+            creation = self.creations.get(creation_id)
+        return creation.report() if creation else None
+
+    def find(self, rid):
+        """Report of creation of the connection, None when it wasn't (recently) created by the pipeline"""
+        with self.lock:
+            creation = self.by_rid.get(rid)
+        return creation.report() if creation else None
+
+    def stats(self):
+        with self.lock:
+            states = {RESERVING: 0, COMMITTING: 0, PROVISIONING: 0, CREATED: 0, FAILED: 0}
+            for creation in self.creations.values():
+                states[creation.state] += 1
+            counts = dict(self.counts)
+        return {'workers': len(self.workers),
+                'pending': states[RESERVING] + states[COMMITTING] + states[PROVISIONING],
+                'max_pending': self.max_pending,
+                'events_queued': self.events.qsize(),
+                'timers': len(self.timers),
+                'creations': states,
+                'total': counts}
+
+    def _work(self):
+        while True:
+            kind, creation, step, error = self.events.get()
+            with tracing.traced(creation.request_id):
+                try:
+                    self._handle(kind, creation, step, error)
+                except Exception:
+                    import traceback
+                    logger.error(traceback.format_exc())
+
+    def _handle(self, kind, creation, step, error):
+        with creation.lock:
+            if kind == 'start':
+                self._send(creation, RESERVING)
+                return
+            if step != creation.step or creation.finished:
+                if kind == 'reply' and creation.state == FAILED:
+                    self._late(creation, step, error)
+                return
+            operation = OPERATIONS[creation.state]
+            seconds = time.time() - creation.step_started
+            if kind == 'timeout':
+                self.backend.timed_out(operation, creation.reservation_id, seconds)
+                error = "no confirmation of %s in %s sec" % (operation, self.step_timeout)
+            creation.steps[operation] = seconds
+            if error is not None:
+                self._fail(creation, "%s failed: %s" % (operation, error), kind == 'timeout')
+            elif NEXT_STATE[creation.state] == CREATED:
+                self._end(creation, CREATED)
+            else:
+                self._send(creation, NEXT_STATE[creation.state])
+
+    def _send(self, creation, state):
+        # creation lock must be held, so the reply is handled after the request is recorded
+        creation.state = state
+        creation.step += 1
+        creation.step_started = time.time()
+        reply = self._reply(creation, creation.step)
+        try:
+            if state == RESERVING:
+                creation.reservation_id = self.backend.send('reserve', reply, creation.params)
+                with self.lock:
+                    self.by_rid[creation.reservation_id] = creation
+            else:
+                self.backend.send(OPERATIONS[state], reply, creation.reservation_id)
+        except Exception as e:
+            creation.steps[OPERATIONS[state]] = time.time() - creation.step_started
+            self._fail(creation, "%s failed: %s" % (OPERATIONS[state], str(e) or e.__class__.__name__))
+            return
+        logger.debug("Creation %s: %s of %s sent", creation.id, OPERATIONS[state], creation.reservation_id)
+        self.timers.schedule(self.step_timeout, self.events.put, ('timeout', creation, creation.step, None))
+
+    def _reply(self, creation, step):
+        def reply(error):
+            self.events.put(('reply', creation, step, error))
+        return reply
+
+    def _fail(self, creation, error, timed_out=False):
+        logger.error("Creation %s of connection %s failed: %s", creation.id, creation.reservation_id, error)
+        creation.error = error
+        if creation.reservation_id and creation.state == RESERVING and timed_out:
+            # reservation still being checked can't be aborted, it is aborted when confirmed (see _late)
+            self._release(creation)
+        elif creation.reservation_id and creation.state in (RESERVING, COMMITTING):
+            self._abort(creation)
+        elif creation.state == PROVISIONING:
+            self._delete(creation)
+        self._end(creation, FAILED)
+
+    def _release(self, creation):
+        # reservation isn't used by the connection, admission control doesn't count it
+        if not creation.released:
+            creation.released = True
+            self.backend.store.update(creation.reservation_id, lifecycleState=RESERVATION_FAILED,
+                                      provisionState=RELEASED)
+
+    def _abort(self, creation):
+        # reservation held by the provider (or failed) is aborted once
+        creation.aborted = True
+        rid = creation.reservation_id
+        self._release(creation)
+        with self.lock:
+            self.counts['aborted'] += 1
+
+        def aborted(error):
+            if error is not None:
+                logger.warning("Abort of reservation %s failed: %s", rid, error)
+        try:
+            self.backend.send('abort', aborted, rid)
+        except Exception as e:
+            logger.warning("Abort of reservation %s failed: %s", rid, e)
+
+    def _delete(self, creation):
+        # committed connection is released and terminated once, in background
+        creation.deleted = True
+        creation.released = True
+        with self.lock:
+            self.counts['deleted'] += 1
+        self.backend.discard(creation.reservation_id)
+
+    def _late(self, creation, step, error):
+        # operation confirmed (or failed) after its timeout
+        if step == 1 and not creation.aborted:
+            self._abort(creation)   # held or failed reservation
+        elif step == 2 and error is None and not creation.deleted:
+            logger.warning("Reservation %s committed after timeout of its creation", creation.reservation_id)
+            self._delete(creation)
+
+    def _end(self, creation, state):
+        creation.state = state
+        creation.finished = time.time()
+        with self.lock:
+            self.counts[state] += 1
+            self.pending -= 1
+            self.finished.append(creation.id)
+        if state == CREATED:
+            self.backend.store.set_last(creation.reservation_id)
+            logger.debug("Connection %s created in %.3f sec", creation.reservation_id,
+                         creation.finished - creation.created)
+        creation.ended.set()
+        if creation.done:
+            creation.done(creation)
+
+    def _expire(self):
+        """Drops ended creations older than retention time or exceeding max_size (lock must be held)"""
+        now = time.time()
+        while self.finished:
+            creation = self.creations.get(self.finished[0])
+            if creation and now - creation.finished < self.retention and len(self.creations) < self.max_size:
+                break
+            self.finished.popleft()
+            if creation:
+                del self.creations[creation.id]
+                if self.by_rid.get(creation.reservation_id) is creation:
+                    del self.by_rid[creation.reservation_id]
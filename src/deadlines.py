@@ -0,0 +1,70 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading, time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """Provider operation didn't finish before the deadline, connection_id is set when
+    the operation left a reservation held by the provider"""
+    def __init__(self, message, connection_id=None):
+        Exception.__init__(self, message)
+        self.connection_id = connection_id
+
+
+def current():
+    """Deadline [sec since epoch] of provider operations called by this thread, None when unlimited"""
+    return getattr(_local, 'deadline', None)
+
+
+def remaining():
+    """Seconds left until deadline of this thread (can be negative), None when unlimited"""
+    deadline = current()
+    return None if deadline is None else deadline - time.time()
+
+
+def start(seconds):
+    """Sets deadline of this thread 'seconds' from now (None: no limit) until clear() is called"""
+    _local.deadline = None if seconds is None else time.time() + seconds
+
+
+def clear():
+    _local.deadline = None
+
+
+@contextmanager
+def deadline(seconds):
+    """Limits time of provider operations called by this thread in the block to 'seconds'
+    (None: no limit), an earlier deadline set by the caller still applies"""
+    if seconds is None:
+        yield
+        return
+    limit = time.time() + seconds
+    previous = current()
+    with until(limit if previous is None else min(previous, limit)):
+        yield
+
+
+@contextmanager
+def until(limit):
+    """Replaces deadline of this thread with 'limit' [sec since epoch] in the block (None: no limit)"""
+    previous = current()
+    _local.deadline = limit
+    try:
+        yield
+    finally:
+        _local.deadline = previous
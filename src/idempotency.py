@@ -0,0 +1,117 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, threading, time
+from collections import OrderedDict
+
+from deadlines import remaining
+
+logger = logging.getLogger(__name__)
+
+
+class KeyReused(Exception):
+    """Idempotency key was already used by a different request"""
+    pass
+
+
+class RequestInProgress(Exception):
+    """Request with the same idempotency key is still being processed"""
+    pass
+
+
+class IdempotencyKeys:
+    """Outcomes (result or exception) of operations identified by client supplied keys
+    (Idempotency-Key header), so a retried request doesn't repeat the operation.
+
+    The first request with a key runs the operation, its retries get the same outcome: they wait
+    up to 'wait' seconds (or until their deadline) for the operation in progress, RequestInProgress
+    is raised when it is still running. Keys are kept for 'ttl' seconds, at most max_size of them
+    (the oldest are dropped). Outcomes of 'transient' exceptions (eg. open circuit breaker, the
+    operation was not made) are not kept, so the next retry runs the operation again.
+    """
+    def __init__(self, ttl=86400, max_size=10000, wait=60, transient=()):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.wait = wait
+        self.transient = tuple(transient)
+        self.entries = OrderedDict()   # key -> entry, the oldest first
+        self.lock = threading.Lock()
+        self.replays = self.conflicts = self.in_progress = 0
+
+    def call(self, key, fingerprint, func, *args):
+        """Returns func(*args) or its outcome recorded for the key, 'fingerprint' identifies
+        the request (KeyReused is raised when the key comes with a different one)"""
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {'fingerprint': fingerprint,
+                         'created': time.time(),
+                         'done': threading.Event(),
+                         'result': None,
+                         'error': None}
+                self.entries[key] = entry
+                owner = True
+            elif entry['fingerprint'] != fingerprint:
+                self.conflicts += 1
+                raise KeyReused("Idempotency key %s was used by a different request" % key)
+            else:
+                owner = False
+
+        if owner:
+            return self._run(key, entry, func, args)
+        wait = self.wait
+        left = remaining()
+        if left is not None:
+            wait = max(0, min(wait, left))
+        if not entry['done'].wait(wait):
+            with self.lock:
+                self.in_progress += 1
+            raise RequestInProgress("Request with idempotency key %s is still in progress" % key)
+        with self.lock:
+            self.replays += 1
+        logger.info("Returning recorded outcome of request with idempotency key %s", key)
+        if entry['error'] is not None:
+            raise entry['error']
+        return entry['result']
+
+    def _run(self, key, entry, func, args):
+        try:
+            entry['result'] = func(*args)
+            return entry['result']
+        except Exception as e:
+            entry['error'] = e
+            if isinstance(e, self.transient):
+                with self.lock:
+                    if self.entries.get(key) is entry:
+                        del self.entries[key]
+            raise
+        finally:
+            entry['done'].set()
+
+    def _expire(self):
+        # the oldest keys are dropped first (lock must be held)
+        now = time.time()
+        while self.entries:
+            key = next(iter(self.entries))
+            if len(self.entries) < self.max_size and now - self.entries[key]['created'] < self.ttl:
+                break
+            del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries),
+                    'replays': self.replays,
+                    'conflicts': self.conflicts,
+                    'in_progress': self.in_progress}
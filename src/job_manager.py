@@ -0,0 +1,157 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, threading, time, uuid
+from collections import deque
+
+try:
+    from Queue import Queue, Full, Empty
+except ImportError:
+    from queue import Queue, Full, Empty
+
+import deadlines, tracing
+
+logger = logging.getLogger(__name__)
+
+# job states (names follow TMF Activation API monitor resource)
+IN_PROGRESS = 'InProgress'
+COMPLETED = 'Completed'
+FAILED = 'Failed'
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobManager:
+    """Runs long lasting NSI operations on a bounded pool of worker threads.
+
+    Submitted jobs wait in a bounded queue (JobQueueFull is raised when it is full)
+    and finished jobs are kept for 'retention' seconds, so clients can poll their outcome.
+    """
+    def __init__(self, workers=8, queue_size=1000, retention=3600, max_jobs=100000):
+        self.queue = Queue(queue_size)
+        self.retention = retention
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self.finished = deque()
+        self.lock = threading.Lock()
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name='nsi-job-worker-%i' % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, func, *args):
+        job = {'id': str(uuid.uuid4()),
+                  'state': IN_PROGRESS,
+                  'created': time.time(),
+                  'finished': None,
+                  'result': None,
+                  'error': None}
+        request_id = tracing.request_id()   # job is traced under ID of the submitting request
+        with self.lock:
+            self._expire()
+            self.jobs[job['id']] = job
+        try:
+            self.queue.put_nowait((job, request_id, func, args))
+        except Full:
+            with self.lock:
+                del self.jobs[job['id']]
+            raise JobQueueFull("Job queue is full (%i jobs waiting)" % self.queue.maxsize)
+        logger.debug("Job %s queued", job['id'])
+        return dict(job)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                return dict(job)
+        return None
+
+    def stats(self):
+        with self.lock:
+            states = {IN_PROGRESS: 0, COMPLETED: 0, FAILED: 0}
+            for job in self.jobs.values():
+                states[job['state']] += 1
+        return {'workers': len(self.workers),
+                'queued': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'jobs': states}
+
+    def _work(self):
+        while True:
+            job, request_id, func, args = self.queue.get()
+            with tracing.traced(request_id):
+                try:
+                    with tracing.span('job'):
+                        result = func(*args)
+                    state, error = COMPLETED, None
+                except Exception as e:
+                    import traceback
+                    logger.error(traceback.format_exc())
+                    result, state, error = None, FAILED, str(e) or e.__class__.__name__
+                with self.lock:
+                    job['result'] = result
+                    job['error'] = error
+                    job['state'] = state
+                    job['finished'] = time.time()
+                    self.finished.append(job['id'])
+                logger.debug("Job %s finished with state %s", job['id'], state)
+
+    def _expire(self):
+        """Drops finished jobs older than retention time or exceeding max_jobs (lock must be held)"""
+        now = time.time()
+        while self.finished:
+            job = self.jobs.get(self.finished[0])
+            if job and now - job['finished'] < self.retention and len(self.jobs) < self.max_jobs:
+                break
+            self.jobs.pop(self.finished.popleft(), None)
+
+
+def map_parallel(func, items, concurrency):
+    """Calls func for every item using at most 'concurrency' threads.
+
+    Returns list of (result, error) tuples in order of items, error is None when func succeeded.
+    Deadline and trace of the calling thread apply to calls made by the threads (see deadlines
+    and tracing modules).
+    """
+    results = [None] * len(items)
+    limit = deadlines.current()
+    trace = tracing.context()
+    pending = Queue()
+    for i, item in enumerate(items):
+        pending.put((i, item))
+
+    def work():
+        while True:
+            try:
+                i, item = pending.get_nowait()
+            except Empty:
+                return
+            try:
+                with deadlines.until(limit), tracing.within(trace):
+                    results[i] = (func(item), None)
+            except Exception as e:
+                import traceback
+                logger.error(traceback.format_exc())
+                results[i] = (None, str(e) or e.__class__.__name__)
+
+    threads = [threading.Thread(target=work) for i in range(max(1, min(concurrency, len(items))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
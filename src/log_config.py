@@ -0,0 +1,158 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit, json, logging, random, threading
+from logging.handlers import RotatingFileHandler
+
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
+
+from tracing import RequestIdFilter
+
+TEXT_FORMAT = "%(levelname)s - %(asctime)s - %(request_id)s - %(name)s - %(message)s"
+
+JAVA_LOGGERS = ('NSI2Interface',)   # log4j loggers of NSI2Interface java class
+
+
+class Lazy:
+    """Log message argument computed only when the record is written, eg. Lazy(pformat, status)"""
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
+class AsyncHandler(logging.Handler):
+    """Passes records to the target handler running in a background thread, so request threads
+    don't wait for formatting and file I/O. Records are dropped (and counted) when the queue is full."""
+    def __init__(self, target, queue_size=10000):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = Queue(queue_size)
+        self.dropped = 0
+        self.writer = threading.Thread(target=self._write, name='log-writer')
+        self.writer.daemon = True
+        self.writer.start()
+        atexit.register(self.close)
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def _write(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            try:
+                self.target.handle(record)
+            except Exception:
+                self.target.handleError(record)
+
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(None)   # written records are flushed before exit
+            self.writer.join(5)
+        self.target.close()
+        logging.Handler.close(self)
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'dropped': self.dropped}
+
+
+class SamplingFilter(logging.Filter):
+    """Passes only given fraction of DEBUG records of components, records of other levels always pass.
+
+    rates: fraction (0.0 - 1.0) for all components or dict of component (logger name) -> fraction
+    """
+    def __init__(self, rates):
+        logging.Filter.__init__(self)
+        self.rates = rates if isinstance(rates, dict) else {'': rates}
+        self.cache = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self.cache.get(record.name)
+        if rate is None:
+            rate = self.cache[record.name] = self._rate(record.name)
+        return rate >= 1 or random.random() < rate
+
+    def _rate(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return self.rates.get('', 1.0)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON lines"""
+    def format(self, record):
+        entry = {'time': self.formatTime(record),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'thread': record.threadName,
+                 'request_id': getattr(record, 'request_id', '-'),
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def setup_logging(app, config, log_file):
+    """Configures logging of the service and NSI2Interface using LOG_* configuration options,
+    returns handler writing to log_file"""
+    handler = RotatingFileHandler(log_file, maxBytes=config.get('LOG_MAX_BYTES', 200000000),
+                                  backupCount=config.get('LOG_BACKUP_COUNT', 5))
+    if config.get('LOG_FORMAT', 'text') == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    if config.get('LOG_ASYNC', True):
+        handler = AsyncHandler(handler, config.get('LOG_QUEUE_SIZE', 10000))
+    handler.addFilter(RequestIdFilter())   # filters run in the logging thread, which knows its request
+    sampling = config.get('LOG_DEBUG_SAMPLING', 1.0)
+    if sampling != 1.0:
+        handler.addFilter(SamplingFilter(sampling))
+
+    level = config.get('LOG_LEVEL', 'DEBUG')
+    levels = dict((name, level) for name in JAVA_LOGGERS)
+    levels.update(config.get('LOG_LEVELS', {}))
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+    app.logger.setLevel(levels.get(app.logger.name, level))
+    if not app.logger.propagate:
+        app.logger.addHandler(handler)
+    for name, component_level in levels.items():
+        logging.getLogger(name).setLevel(component_level)
+        if name in JAVA_LOGGERS:
+            _set_java_level(name, component_level)
+    return handler
+
+
+def _set_java_level(name, level):
+    try:
+        from org.apache.log4j import Logger, Level
+    except ImportError:
+        return   # not running in Jython
+    Logger.getLogger(name).setLevel(Level.toLevel(level))
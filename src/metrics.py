@@ -0,0 +1,163 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os, threading
+
+from operation_stats import OperationStats, BUCKETS
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+CIRCUIT_STATES = ('closed', 'open', 'half_open')
+
+
+class RequestMetrics:
+    """Counts HTTP requests by method, endpoint (URL rule) and status code,
+    keeps latency histograms of endpoints and number of requests in progress"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}   # (method, endpoint, status) -> count
+        self.latency = OperationStats(samples=1)   # only histograms are reported
+        self.in_progress = 0
+
+    def started(self):
+        with self.lock:
+            self.in_progress += 1
+
+    def finished(self):
+        with self.lock:
+            self.in_progress -= 1
+
+    def record(self, method, endpoint, status, seconds):
+        key = (method, endpoint, status)
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+        self.latency.record(endpoint, seconds, status < 500)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.requests), self.in_progress
+
+
+def render(requests, phases, backends, store, jobs, logging_handler=None, reaper=None):
+    """Returns metrics in Prometheus text format.
+
+    requests: RequestMetrics, phases: OperationStats of request processing steps,
+    backends: list of (labels, NSIBackend) - one per provider, reaper: ReservationReaper or None.
+    """
+    lines = []
+    counts, in_progress = requests.snapshot()
+    _header(lines, 'nsi_rest_requests_total', 'counter', 'HTTP requests by method, endpoint and status code')
+    for (method, endpoint, status), count in sorted(counts.items()):
+        _sample(lines, 'nsi_rest_requests_total', {'method': method, 'endpoint': endpoint, 'status': status}, count)
+    _header(lines, 'nsi_rest_requests_in_progress', 'gauge', 'HTTP requests being processed')
+    _sample(lines, 'nsi_rest_requests_in_progress', {}, in_progress)
+    _histograms(lines, 'nsi_rest_request_duration_seconds', 'Latency of HTTP requests by endpoint',
+                'endpoint', [({}, requests.latency)])
+    _histograms(lines, 'nsi_rest_phase_duration_seconds', 'Latency of request processing steps',
+                'phase', [({}, phases)])
+    _histograms(lines, 'nsi_operation_duration_seconds', 'Latency of NSI provider operations',
+                'operation', [(labels, backend.stats) for labels, backend in backends])
+
+    _header(lines, 'nsi_operation_errors_total', 'counter', 'Failed NSI provider operations')
+    for labels, backend in backends:
+        for name, histogram in sorted(backend.stats.histograms().items()):
+            _sample(lines, 'nsi_operation_errors_total', dict(labels, operation=name), histogram['errors'])
+
+    reports = [(labels, backend.report()) for labels, backend in backends]
+    gauges = [('nsi_status_cache_entries', 'Connection statuses in query cache', 'query_cache', 'size'),
+              ('nsi_connection_states_entries', 'Connection statuses kept up to date by notifications',
+               'connection_states', 'size'),
+              ('nsi_waiting_requests', 'Requests waiting for connection changes', 'waiting', 'waiting'),
+              ('nsi_deferred_operations', 'Operations retried in background', 'deferred', 'size'),
+              ('nsi_client_pool_size', 'NSI clients in the pool', 'nsi_client_pool', 'size'),
+              ('nsi_client_pool_in_use', 'NSI clients used by requests', 'nsi_client_pool', 'in_use'),
+              ('nsi_client_pool_waiting', 'Requests waiting for NSI client', 'nsi_client_pool', 'waiting')]
+    for name, description, section, key in gauges:
+        _header(lines, name, 'gauge', description)
+        for labels, report in reports:
+            if section in report:
+                _sample(lines, name, labels, report[section][key])
+    _header(lines, 'nsi_circuit_breaker_state', 'gauge', 'State of NSI provider circuit breaker (1: current state)')
+    for labels, report in reports:
+        for state in CIRCUIT_STATES:
+            _sample(lines, 'nsi_circuit_breaker_state', dict(labels, state=state),
+                    int(report['circuit_breaker']['state'] == state))
+
+    store_stats = store.stats()
+    _header(lines, 'nsi_reservations', 'gauge', 'Reservations recorded in reservation store')
+    _sample(lines, 'nsi_reservations', {}, store_stats['reservations'])
+    _header(lines, 'nsi_admitted_reservations', 'gauge', 'Not terminated reservations indexed for admission control')
+    _sample(lines, 'nsi_admitted_reservations', {}, store_stats['admitted'])
+    if reaper is not None:
+        stats = reaper.stats()
+        _header(lines, 'nsi_reaper_scheduled', 'gauge', 'Reservations waiting for their end or removal')
+        _sample(lines, 'nsi_reaper_scheduled', {}, stats['scheduled'])
+        _header(lines, 'nsi_reservations_expired_total', 'counter', 'Reservations which passed their end time')
+        _sample(lines, 'nsi_reservations_expired_total', {}, stats['expired'])
+        _header(lines, 'nsi_reservations_removed_total', 'counter', 'Finished reservations removed from the store')
+        _sample(lines, 'nsi_reservations_removed_total', {}, stats['removed'])
+    _header(lines, 'nsi_memory_bytes', 'gauge', 'Memory used by the process')
+    for area, value in sorted(memory().items()):
+        _sample(lines, 'nsi_memory_bytes', {'area': area}, value)
+    _header(lines, 'nsi_async_jobs_queued', 'gauge', 'Asynchronous requests waiting for a worker')
+    _sample(lines, 'nsi_async_jobs_queued', {}, jobs.stats()['queued'])
+    if logging_handler is not None:
+        stats = logging_handler.stats()
+        _header(lines, 'nsi_log_records_dropped_total', 'counter', 'Log records dropped because of full queue')
+        _sample(lines, 'nsi_log_records_dropped_total', {}, stats['dropped'])
+    return '\n'.join(lines) + '\n'
+
+
+def memory():
+    """Memory of the process [bytes]: used and max JVM heap (under Jython) or resident set size
+    (Linux), empty when unknown"""
+    try:
+        from java.lang import Runtime
+        runtime = Runtime.getRuntime()
+        return {'heap_used': runtime.totalMemory() - runtime.freeMemory(),
+                'heap_max': runtime.maxMemory()}
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return {'resident': int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')}
+    except (IOError, OSError, ValueError, IndexError):
+        return {}
+
+
+def _histograms(lines, name, description, label, sources):
+    _header(lines, name, 'histogram', description)
+    for labels, stats in sources:
+        for key, histogram in sorted(stats.histograms().items()):
+            sample_labels = dict(labels)
+            sample_labels[label] = key
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+                _sample(lines, name + '_bucket', dict(sample_labels, le=bound), count)
+            _sample(lines, name + '_sum', sample_labels, histogram['total'])
+            _sample(lines, name + '_count', sample_labels, histogram['count'])
+
+
+def _header(lines, name, kind, description):
+    lines.append('# HELP %s %s' % (name, description))
+    lines.append('# TYPE %s %s' % (name, kind))
+
+
+def _sample(lines, name, labels, value):
+    if labels:
+        name += '{%s}' % ','.join('%s="%s"' % (key, _escape(labels[key])) for key in sorted(labels))
+    lines.append('%s %s' % (name, repr(float(value)) if isinstance(value, float) else value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
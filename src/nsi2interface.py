@@ -12,136 +12,315 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import sys
+import logging, sys, threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import time
 import types
 
-sys.path.append('/usr/share/java/')
-sys.path.append('../../clientapi/build/jar/nsi2_client.jar')
-sys.path.append('../libs/commons-logging-1.1.1.jar')
-sys.path.append('../libs/log4j-1.2.13.jar')
-
-sys.path.append('/opt/apache-cxf/lib/antlr-2.7.7.jar')
-sys.path.append('/opt/apache-cxf/lib/aopalliance-1.0.jar')
-sys.path.append('/opt/apache-cxf/lib/asm-3.3.jar')
-sys.path.append('/opt/apache-cxf/lib/commons-collections-3.2.1.jar')
-sys.path.append('/opt/apache-cxf/lib/commons-lang-2.6.jar')
-sys.path.append('/opt/apache-cxf/lib/commons-logging-1.1.1.jar')
-sys.path.append('/opt/apache-cxf/lib/cxf-2.4.2.jar')
-sys.path.append('/opt/apache-cxf/lib/cxf-manifest.jar')
-sys.path.append('/opt/apache-cxf/lib/cxf-xjc-boolean-2.4.0.jar')
-sys.path.append('/opt/apache-cxf/lib/cxf-xjc-bug671-2.4.0.jar')
-sys.path.append('/opt/apache-cxf/lib/cxf-xjc-dv-2.4.0.jar')
-sys.path.append('/opt/apache-cxf/lib/cxf-xjc-ts-2.4.0.jar')
-sys.path.append('/opt/apache-cxf/lib/FastInfoset-1.2.9.jar')
-sys.path.append('/opt/apache-cxf/lib/geronimo-activation_1.1_spec-1.1.jar')
-sys.path.append('/opt/apache-cxf/lib/geronimo-annotation_1.0_spec-1.1.1.jar')
-sys.path.append('/opt/apache-cxf/lib/geronimo-javamail_1.4_spec-1.7.1.jar')
-sys.path.append('/opt/apache-cxf/lib/geronimo-jaxws_2.2_spec-1.0.jar')
-sys.path.append('/opt/apache-cxf/lib/geronimo-jms_1.1_spec-1.1.1.jar')
-sys.path.append('/opt/apache-cxf/lib/geronimo-servlet_3.0_spec-1.0.jar')
-sys.path.append('/opt/apache-cxf/lib/geronimo-stax-api_1.0_spec-1.0.1.jar')
-sys.path.append('/opt/apache-cxf/lib/geronimo-ws-metadata_2.0_spec-1.1.3.jar')
-sys.path.append('/opt/apache-cxf/lib/isorelax-20030108.jar')
-sys.path.append('/opt/apache-cxf/lib/jaxb-api-2.2.1.jar')
-sys.path.append('/opt/apache-cxf/lib/jaxb-impl-2.2.1.1.jar')
-sys.path.append('/opt/apache-cxf/lib/jaxb-xjc-2.2.1.1.jar')
-sys.path.append('/opt/apache-cxf/lib/jettison-1.3.jar')
-sys.path.append('/opt/apache-cxf/lib/jetty-continuation-7.4.5.v20110725.jar')
-sys.path.append('/opt/apache-cxf/lib/jetty-http-7.4.5.v20110725.jar')
-sys.path.append('/opt/apache-cxf/lib/jetty-io-7.4.5.v20110725.jar')
-sys.path.append('/opt/apache-cxf/lib/jetty-security-7.4.5.v20110725.jar')
-sys.path.append('/opt/apache-cxf/lib/jetty-server-7.4.5.v20110725.jar')
-sys.path.append('/opt/apache-cxf/lib/jetty-util-7.4.5.v20110725.jar')
-sys.path.append('/opt/apache-cxf/lib/joda-time-1.6.2.jar')
-sys.path.append('/opt/apache-cxf/lib/jra-1.0-alpha-4.jar')
-sys.path.append('/opt/apache-cxf/lib/js-1.7R2.jar')
-sys.path.append('/opt/apache-cxf/lib/jsr311-api-1.1.1.jar')
-sys.path.append('/opt/apache-cxf/lib/msv-core-2010.2.jar')
-sys.path.append('/opt/apache-cxf/lib/neethi-3.0.1.jar')
-sys.path.append('/opt/apache-cxf/lib/opensaml-2.4.1.jar')
-sys.path.append('/opt/apache-cxf/lib/openws-1.4.1.jar')
-sys.path.append('/opt/apache-cxf/lib/relaxngDatatype-20020414.jar')
-sys.path.append('/opt/apache-cxf/lib/saaj-api-1.3.jar')
-sys.path.append('/opt/apache-cxf/lib/saaj-impl-1.3.2.jar')
-sys.path.append('/opt/apache-cxf/lib/serializer-2.7.1.jar')
-sys.path.append('/opt/apache-cxf/lib/slf4j-api-1.6.1.jar')
-sys.path.append('/opt/apache-cxf/lib/slf4j-jdk14-1.6.1.jar')
-sys.path.append('/opt/apache-cxf/lib/spring-aop-3.0.5.RELEASE.jar')
-sys.path.append('/opt/apache-cxf/lib/spring-asm-3.0.5.RELEASE.jar')
-sys.path.append('/opt/apache-cxf/lib/spring-beans-3.0.5.RELEASE.jar')
-sys.path.append('/opt/apache-cxf/lib/spring-context-3.0.5.RELEASE.jar')
-sys.path.append('/opt/apache-cxf/lib/spring-core-3.0.5.RELEASE.jar')
-sys.path.append('/opt/apache-cxf/lib/spring-expression-3.0.5.RELEASE.jar')
-sys.path.append('/opt/apache-cxf/lib/spring-jms-3.0.5.RELEASE.jar')
-sys.path.append('/opt/apache-cxf/lib/spring-tx-3.0.5.RELEASE.jar')
-sys.path.append('/opt/apache-cxf/lib/spring-web-3.0.5.RELEASE.jar')
-sys.path.append('/opt/apache-cxf/lib/stax2-api-3.1.1.jar')
-sys.path.append('/opt/apache-cxf/lib/velocity-1.7.jar')
-sys.path.append('/opt/apache-cxf/lib/woodstox-core-asl-4.1.1.jar')
-sys.path.append('/opt/apache-cxf/lib/wsdl4j-1.6.2.jar')
-sys.path.append('/opt/apache-cxf/lib/wss4j-1.6.2.jar')
-sys.path.append('/opt/apache-cxf/lib/xalan-2.7.1.jar')
-sys.path.append('/opt/apache-cxf/lib/xmlbeans-2.4.0.jar')
-sys.path.append('/opt/apache-cxf/lib/xml-resolver-1.2.jar')
-sys.path.append('/opt/apache-cxf/lib/xmlschema-core-2.0.jar')
-sys.path.append('/opt/apache-cxf/lib/xmlsec-1.4.5.jar')
-sys.path.append('/opt/apache-cxf/lib/xmltooling-1.3.1.jar')
-sys.path.append('/opt/apache-cxf/lib/xsdlib-2010.1.jar')
+import classpath
+classpath.setup()   # DEFAULT_CLASSPATH unless NSI_CLASSPATH was set up before (see create_backend)
 
 import NSI2Interface
+from nsi_backend import NSIBackend
+from client_pool import ClientPool
+from deadlines import DeadlineExceeded, remaining
+from tracing import request_id, span
 
-from java.lang import String
-from java.util import ArrayList
+from net.glambda.nsi2.impl import EventListener
+
+from java.lang import Runnable, String, Thread
+from java.util.concurrent import Executors, ThreadFactory, TimeUnit
+from javax.xml.ws import WebServiceException
+from javax.xml.ws.soap import SOAPFaultException
+from org.ogf.schemas.nsi._2013._12.connection._interface import ServiceException
+from org.apache.log4j import MDC
+from java.util import ArrayList, List, Map
 import jarray
 
 user = ''
 password = ''
 
-class NSI:
-    def __init__(self, pNSA, pURI, rNSA, rURI):
-        self.nsi = NSI2Interface(pNSA, pURI, rNSA, rURI, user, password)
+logger = logging.getLogger(__name__)
+
+
+class NotificationListener(EventListener):
+    """Passes notifications received by NSI requester of NSI2Interface to the backend (see NSIBackend.notify)"""
+    def __init__(self, backend):
+        self.backend = backend
+
+    def dataPlaneStateChange(self, header, connectionId, notificationId, timeStamp, dataPlaneStatus):
+        data_plane = {'active': bool(dataPlaneStatus.isActive()),
+                      'version': dataPlaneStatus.getVersion(),
+                      'versionConsistent': bool(dataPlaneStatus.isVersionConsistent())}
+        self._notify(connectionId, notificationId, data_plane=data_plane)
+
+    def errorEvent(self, header, connectionId, notificationId, timeStamp, event, originatingConnectionId,
+                   originatingNSA, additionalInfo, serviceException):
+        self._notify(connectionId, notificationId, event=event.value())
+
+    def error(self, header, serviceException):
+        logger.error("NSI error notification: %s %s", header.getCorrelationId(),
+                     serviceException.getText() if serviceException else None)
+
+    def _notify(self, rid, notification_id, **notification):
+        try:
+            self.backend.notify(rid, int(notification_id), **notification)
+        except Exception:
+            import traceback
+            logger.error(traceback.format_exc())   # exceptions must not reach NSI requester service
+
+
+class _DaemonThreads(ThreadFactory):
+    def newThread(self, runnable):
+        thread = Thread(runnable, 'nsi-deadlines')
+        thread.setDaemon(True)
+        return thread
+
+_timer = Executors.newSingleThreadScheduledExecutor(_DaemonThreads())
+
+
+class _Interrupter(Runnable):
+    """Interrupts thread waiting for reply of NSI provider when its deadline passes
+    (NSI2Client fails with TIMEOUT then, its own reply wait is fixed when created)"""
+    def __init__(self, thread):
+        self.thread = thread
+        self.lock = threading.Lock()
+        self.active = True
+        self.fired = False
+
+    def run(self):
+        with self.lock:
+            if self.active:
+                self.fired = True
+                self.thread.interrupt()
+
+    def cancel(self):
+        with self.lock:
+            self.active = False
+        if self.fired:
+            Thread.interrupted()   # clears interrupt status of the thread
+
+
+class _ReplyCallback(NSI2Interface.ReplyCallback):
+    """Passes reply of operation sent by NSI2Interface.sendReserve or send to python callback"""
+    def __init__(self, callback):
+        self.callback = callback
+
+    def reply(self, error):
+        self.callback(error)
 
-    def reserve(self, params):
-        rid = self.nsi.reserveCommit(params['gid'], params['desc'], params['src'], params['dst'], 
-                                              params['srcvlan'], params['dstvlan'], params['capacity'], 
-                                              params['start_sec'], params['end_sec'], params['explicit_routes'])
+
+def _connection_id(e):
+    """Reservation ID reported by ServiceException of NSI2Client, None when unknown"""
+    try:
+        return e.getFaultInfo().getConnectionId()
+    except Exception:
+        return None
+
+
+class NSI(NSIBackend):
+    """NSI provider accessed by a pool of NSI2Interface clients.
+
+    Every pooled client publishes its own NSI requester endpoint, so rURIs must contain
+    at least pool_size URIs (unless requester is not used at all: rURIs=None).
+    Every operation waits up to reply_wait seconds for reply of the provider, or until
+    deadline of the calling thread (see deadlines module). With lazy=True clients are
+    constructed by warm_up() or by the first operation.
+
+    With pipeline_uri operations sent by send() are replied to the requester endpoint published
+    there by a separate NSI2Interface client (see NSI2Interface.enableAsync).
+    """
+    def __init__(self, pNSA, pURI, rNSA, rURIs, query_batch_size=500, pool_size=1, pool_wait=60, reply_wait=300,
+                 lazy=False, pipeline_uri=None, **options):
+        NSIBackend.__init__(self, **options)   # see NSIBackend for options
+        self.pipeline_uri = pipeline_uri
+        self.pipelined = pipeline_uri is not None
+        self.async_client = None
+        if rURIs is None or isinstance(rURIs, basestring):
+            rURIs = [rURIs] * (pool_size if rURIs is None else 1)
+        if len(rURIs) < pool_size:
+            raise ValueError("%i requester URIs needed for %i pooled NSI clients, got %i" % 
+                             (pool_size, pool_size, len(rURIs)))
+        self.client_args = (pNSA, pURI, rNSA, rURIs[:pool_size], long(reply_wait * 1000))
+        self.pool_wait = pool_wait
+        self.init_lock = threading.Lock()
+        self.query_batch_size = query_batch_size
+        if not lazy:
+            self.warm_up()
+
+    def warm_up(self):
+        """Constructs NSI clients (CXF bus, WSDL processing, requester endpoints) unless lazy
+        construction was already done by the first request"""
+        with self.init_lock:
+            if self.pool is None:
+                start = time.time()
+                pNSA, pURI, rNSA, rURIs, reply_wait = self.client_args
+                listener = NotificationListener(self)
+                clients = [NSI2Interface(pNSA, pURI, rNSA, rURI, user, password, listener, reply_wait)
+                           for rURI in rURIs]
+                if self.pipeline_uri:
+                    self.async_client = NSI2Interface(pNSA, pURI, rNSA, None, user, password, listener, reply_wait)
+                    self.async_client.enableAsync(self.pipeline_uri)
+                self.pool = ClientPool(clients, self.pool_wait)
+                logger.info("%i NSI clients constructed in %.1f sec", len(clients), time.time() - start)
+        return self.pool
+
+    @contextmanager
+    def _client(self):
+        """Pooled NSI client, the calling thread is interrupted when its deadline passes.
+        NSI2Interface log lines of the call carry ID of the traced request (log4j MDC request_id)"""
+        pool = self.pool
+        if pool is None:
+            with span('nsi_clients.init'):
+                pool = self.warm_up()
+        with pool.client(remaining()) as nsi:
+            left = remaining()
+            if left is not None and left <= 0:
+                raise DeadlineExceeded("No time left for NSI request")
+            MDC.put('request_id', request_id() or '-')
+            interrupter = None
+            if left is not None:
+                interrupter = _Interrupter(Thread.currentThread())
+                future = _timer.schedule(interrupter, long(left * 1000), TimeUnit.MILLISECONDS)
+            try:
+                yield nsi
+            except Exception as e:
+                if interrupter and interrupter.fired:
+                    raise DeadlineExceeded("NSI provider didn't reply before deadline", _connection_id(e))
+                raise
+            finally:
+                if interrupter:
+                    future.cancel(False)
+                    interrupter.cancel()
+                MDC.remove('request_id')
+
+    def _reserve(self, params):
+        # steps of NSI2Interface.reserveCommit timed separately
+        with self._client() as nsi:
+            with span('marshal'):   # conversion of python arguments and building of java criteria
+                criteria = nsi.makeReservationCriteria(params['gid'], params['src'], params['dst'],
+                                                       params['srcvlan'], params['dstvlan'], params['capacity'],
+                                                       params['start_sec'], params['end_sec'],
+                                                       params['explicit_routes'])
+            with span('soap.reserve'):
+                rid = nsi.reserve(params['gid'], params['desc'], criteria)
+            with span('soap.commit'):
+                try:
+                    nsi.commit(rid)
+                except ServiceException as e:
+                    raise NSI2Interface.heldReservation(e, rid)
         return rid
 
-    def modify(self, rid, params):
-        mid = self.nsi.modifyCommit(params['gid'], params['desc'], rid, params['ep_end'])
-        return mid
+    def _send(self, operation, callback, *args):
+        # the provider acknowledges the request, its reply is passed to callback by requester thread
+        if self.pool is None:
+            with span('nsi_clients.init'):
+                self.warm_up()
+        nsi = self.async_client
+        reply = _ReplyCallback(callback)
+        MDC.put('request_id', request_id() or '-')
+        try:
+            if operation == 'reserve':
+                params = args[0]
+                criteria = nsi.makeReservationCriteria(params['gid'], params['src'], params['dst'],
+                                                       params['srcvlan'], params['dstvlan'], params['capacity'],
+                                                       params['start_sec'], params['end_sec'],
+                                                       params['explicit_routes'])
+                return nsi.sendReserve(params['gid'], params['desc'], criteria, reply)
+            nsi.send(operation, args[0], reply)
+            return args[0]
+        finally:
+            MDC.remove('request_id')
 
-    def commit(self, rid):
-        self.nsi.commit(rid)
+    def _modify(self, rid, params):
+        reservation = self.store.get(rid)
+        if not reservation:
+            raise Exception("No such reservation, id=%s" % rid)
+        start_sec = reservation['start_sec']
+        if start_sec != -1:
+            start_sec = max(start_sec, int(reservation['created']))  # reserved from now when start was in the past
+        with self._client() as nsi:
+            version = nsi.modifyCommit(params['gid'], params['desc'], rid, start_sec, params['ep_end'],
+                                                 params.get('capacity', reservation['capacity']), reservation['version'] + 1)
+        self.store.update(rid, version=version)
+        return rid
 
-    def abort(self, rid):
-        self.nsi.abort(rid)
+    def _commit(self, rid):
+        with self._client() as nsi:
+            nsi.commit(rid)
 
-    def terminate(self, rid):
-        self.nsi.terminate(rid)
+    def _abort(self, rid):
+        with self._client() as nsi:
+            nsi.abort(rid)
 
-    def provision(self, rid):
-        self.nsi.provision(rid)
+    def _terminate(self, rid):
+        with self._client() as nsi:
+            nsi.terminate(rid)
 
-    def release(self, rid):
-        self.nsi.release(rid)
+    def _provision(self, rid):
+        with self._client() as nsi:
+            nsi.provision(rid)
+
+    def _release(self, rid):
+        with self._client() as nsi:
+            nsi.release(rid)
         
-    def query(self, rid):
-        summary_text = self.nsi.query(rid)
-        return convert_summary2dict(summary_text)
+    def _query(self, rid):
+        return self._query_many([rid]).get(rid, {})
+
+    def _unavailable(self, error):
+        # SOAP faults and NSI errors are replies of the provider, NSI2Client reports missing reply as TIMEOUT
+        if isinstance(error, WebServiceException):
+            return not isinstance(error, SOAPFaultException)
+        return isinstance(error, ServiceException) and (error.getMessage() or '').startswith('TIMEOUT')
+
+    def _query_many(self, rids):
+        statuses = {}
+        for i in range(0, len(rids), self.query_batch_size):
+            chunk = rids[i:i+self.query_batch_size]
+            with self._client() as nsi:
+                summaries = nsi.querySummaries(jarray.array(chunk, String))
+            for summary in summaries:
+                status = summary2status(java2python(summary))
+                if status.get('connectionId'):
+                    statuses[status['connectionId']] = status
+        return statuses
     
         
-def convert_summary2dict(text):
-    status = {}
-    for line in text.splitlines():
-        line = line.split()
-        if len(line) == 2:
-            status[line[0]] = line[1]
-        if len(line) > 2:
-            status[line[0]] = ' '.join(line[1:])
+# status attributes returned by REST API as strings (see GET /nsi/connections/<reservation_id>)
+STATUS_ATTRIBUTES = ('active', 'connectionId', 'description', 'globalReservationId', 'lifecycleState',
+                     'notificationId', 'provisionState', 'requesterNSA', 'reservationState', 'version',
+                     'versionConsistent')
+
+def summary2status(summary):
+    """Connection status made of query summary returned by NSI2Interface.querySummaries: typed 'criteria'
+    (schedule, p2ps, children segments) and 'connectionStates' plus flat string STATUS_ATTRIBUTES"""
+    status = dict(summary)
+    states = summary.get('connectionStates') or {}
+    data_plane = states.get('dataPlaneStatus') or {}
+    for name in ('reservationState', 'provisionState', 'lifecycleState'):
+        status[name] = states.get(name)
+    for name in ('active', 'version', 'versionConsistent'):
+        status[name] = data_plane.get(name)
+    for name in STATUS_ATTRIBUTES:
+        status[name] = _text(status.get(name))
     return status
+
+
+def _text(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value if value is None else unicode(value)
+
+
+def java2python(value):
+    """Converts nested java Maps and Lists to dicts and lists"""
+    if isinstance(value, Map):
+        return dict((entry.getKey(), java2python(entry.getValue())) for entry in value.entrySet())
+    if isinstance(value, List):
+        return [java2python(item) for item in value]
+    return value
     
     
 
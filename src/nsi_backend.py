@@ -0,0 +1,518 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, time, uuid
+
+from status_cache import StatusCache
+from operation_stats import OperationStats
+from reservation_store import ReservationStore, CREATED, TERMINATED, FAILED, PROVISIONED, RELEASED
+from admission_control import AdmissionError
+from connection_states import ConnectionStates, FORCED_END
+from status_watch import ChangeNotifier, FINAL_STATES, satisfied
+from deadlines import DeadlineExceeded, current, deadline, remaining, until
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from retry_queue import RetryQueue
+from tracing import span
+from startup import EAGER
+
+logger = logging.getLogger(__name__)
+
+# operations retried when provider is unavailable (repeating them doesn't change the result)
+RETRIED_OPERATIONS = ('query', 'query_many', 'release', 'terminate')
+MAX_BACKOFF = 10   # max delay [sec] between retries
+
+
+class NSIBackend:
+    """Interface of NSI connection service used by REST API.
+
+    Backends implement provider operations in _reserve, _commit, ... methods, this class
+    takes care of caching of connection statuses returned by _query and _query_many,
+    keeps statuses of connections made by the service updated by provider notifications
+    (see notify() and 'states' attribute),
+    records reservations in the reservation store (see 'store' attribute), rejects requests
+    conflicting with reservations held by the service (see admit()) and measures latency of every provider operation (see 'stats' attribute).
+
+    Provider operations are limited by operation_timeouts (operation name -> seconds) and by
+    deadline of the calling thread (see deadlines module), DeadlineExceeded is raised when
+    the time runs out. Reservation held by the provider after expired reserve is aborted.
+
+    When the provider is unavailable (see unavailable()) RETRIED_OPERATIONS are repeated up to
+    retry_attempts times with exponential backoff, repeated failures open circuit breaker
+    (see 'breaker' attribute) and deletes are retried in background (see delete()).
+
+    Pipelined backends (implementing _send) also send operations without waiting for their
+    confirmation (see send() and CreatePipeline).
+    """
+    pool = None   # ClientPool of backends using pooled provider clients
+    pipelined = False
+
+    def __init__(self, cache_ttl=0, cache_size=10000, cache_negative_ttl=None, store=None,
+                 admission_control=True, port_capacity=None, state_max_age=0, operation_timeouts=None,
+                 breaker=None, retry_attempts=3, retry_backoff=0.5, deferred_interval=30, deferred_max_age=86400):
+        self.cache = StatusCache(cache_ttl, cache_size, cache_negative_ttl)
+        self.states = ConnectionStates(state_max_age)
+        self.changes = ChangeNotifier()
+        self.stats = OperationStats()
+        self.store = store or ReservationStore()
+        self.admission_control = admission_control
+        self.port_capacity = port_capacity or {}
+        self.timeouts = operation_timeouts or {}
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_attempts = retry_attempts
+        self.retry_backoff = retry_backoff
+        self.deferred = RetryQueue(self._retry, deferred_interval, max_age=deferred_max_age, name='nsi-deferred')
+
+    def admit(self, params, rid=None):
+        """Raises AdmissionError when VLANs or capacity requested by params (see prepare_nsi_attributes)
+        are already used by reservations of the service (except reservation 'rid' being modified).
+        It only checks them, reserve(), send() and modify() hold them until the reservation is recorded."""
+        if not self.admission_control:
+            return
+        conflicts = self.stats.call('admission', self.store.conflicts, params, self.port_capacity, rid)
+        if conflicts:
+            raise AdmissionError("; ".join(conflicts))
+
+    def reserve(self, params):
+        """Reserves and commits a new connection, returns its reservation ID"""
+        hold = self._admit_and_hold(params)
+        try:
+            try:
+                rid = self._call('reserve', self._reserve, params)
+            except DeadlineExceeded as e:
+                if e.connection_id:
+                    self._abort_held(e.connection_id)
+                raise
+            if rid:
+                self.store.add(rid, params)
+        finally:
+            self._unhold(hold)
+        return rid
+
+    def modify(self, rid, params):
+        """Changes end time and capacity of the reservation (params: gid, desc, ep_end, optional capacity)"""
+        record = self.store.get(rid)
+        hold = None
+        if record:
+            hold = self._admit_and_hold(dict(record, end_sec=params['ep_end'], capacity=params.get('capacity', record['capacity'])), rid)
+        try:
+            mid = self._operation('modify', self._modify, rid, params)
+            changes = {'end_sec': params['ep_end'], 'description': params['desc']}
+            if 'capacity' in params:
+                changes['capacity'] = params['capacity']
+            self.store.update(rid, **changes)
+        finally:
+            self._unhold(hold)
+        return mid
+
+    def commit(self, rid):
+        self._operation('commit', self._commit, rid)
+
+    def abort(self, rid):
+        self._operation('abort', self._abort, rid)
+
+    def terminate(self, rid):
+        self._operation('terminate', self._terminate, rid)
+        self.store.update(rid, lifecycleState=TERMINATED, provisionState=RELEASED)
+
+    def provision(self, rid):
+        self._operation('provision', self._provision, rid)
+        self.store.update(rid, provisionState=PROVISIONED)
+
+    def release(self, rid):
+        self._operation('release', self._release, rid)
+        self.store.update(rid, provisionState=RELEASED)
+
+    def delete(self, rid):
+        """Releases (if provisioned) and terminates the connection. Returns False when the provider
+        is unavailable, the deletion is retried in background then."""
+        try:
+            self._release_and_terminate(rid)
+        except Exception as e:
+            if not self.unavailable(e) or not self.deferred.add(('delete', rid)):
+                raise
+            logger.warning("Deletion of connection %s deferred: %s", rid, e)
+            return False
+        return True
+
+    def discard(self, rid):
+        """Releases and terminates in background (retried while NSI provider is unavailable) the connection
+        which failed to be created after it was reserved. Its record stops holding VLANs and capacity at once,
+        so the creation can be repeated. Returns False when the queue of deferred operations is full."""
+        record = self.store.get(rid)
+        if record and record['lifecycleState'] == CREATED:
+            self.store.update(rid, lifecycleState=FAILED, provisionState=RELEASED)
+        if self.deferred.add(('delete', rid), 0):
+            logger.warning("Connection %s which failed to be created will be deleted", rid)
+            return True
+        logger.error("Connection %s which failed to be created can't be deleted, too many deferred operations", rid)
+        return False
+
+    def send(self, operation, callback, *args):
+        """Sends 'reserve' (args: connection params), 'commit', 'abort' or 'provision' (args: reservation ID)
+        without waiting for its confirmation, returns reservation ID (assigned by the provider to a new one).
+
+        callback(error) is called once the provider confirms the operation (error is None) or reports
+        its failure (error: reason), by requester thread of the backend, so it must not block.
+        Operations not confirmed in time are reported by the caller with timed_out().
+        """
+        hold = self._admit_and_hold(args[0]) if operation == 'reserve' else None
+        try:
+            return self._send_held(operation, callback, *args)
+        finally:
+            self._unhold(hold)   # recorded reservation is admitted instead (or reserve failed)
+
+    def _send_held(self, operation, callback, *args):
+        self.breaker.before()
+        start = time.time()
+        rid = [None if operation == 'reserve' else args[0]]
+
+        def replied(error=None):
+            self.stats.record(operation, time.time() - start, error is None)
+            if rid[0]:
+                self._changed(rid[0])
+                if operation == 'provision' and error is None:
+                    self.store.update(rid[0], provisionState=PROVISIONED)
+            callback(error)
+
+        try:
+            with span('send ' + operation):
+                sent = self._send(operation, replied, *args)
+        except Exception as e:
+            self.stats.record(operation, time.time() - start, False)
+            if self._unavailable(e):
+                self.breaker.failure()
+            else:
+                self.breaker.ignore()
+            raise
+        self.breaker.success()   # acknowledged by the provider
+        if operation == 'reserve':
+            self.store.add(sent, args[0])   # admission control sees the reservation being checked
+        rid[0] = sent
+        self._changed(sent)
+        return sent
+
+    def timed_out(self, operation, rid, seconds):
+        """Records operation sent by send() which wasn't confirmed in 'seconds'"""
+        logger.warning("No confirmation of %s of %s in %.1f sec", operation, rid, seconds)
+        self.stats.record(operation, seconds, False)
+        self.breaker.failure()
+        self._changed(rid)
+
+    def unavailable(self, error):
+        """True when the operation failed because NSI provider couldn't be reached or didn't reply"""
+        return isinstance(error, (CircuitOpen, DeadlineExceeded)) or self._unavailable(error)
+
+    def query(self, rid):
+        """Returns status of the connection, empty when connection not found"""
+        status = self.states.get(rid)
+        if status is None:
+            token = self.states.token()
+            status = self.cache.get(rid, lambda rid: self._call('query', self._query, rid))
+            self._remember(rid, status, token)
+        return status
+
+    def query_many(self, rids):
+        """Returns dict of statuses of given connections (empty status when connection not found)"""
+        statuses, unknown = {}, []
+        for rid in rids:
+            status = self.states.get(rid)
+            if status is None:
+                unknown.append(rid)
+            else:
+                statuses[rid] = status
+        if unknown:
+            token = self.states.token()
+            queried = self.cache.get_many(unknown, lambda rids: self._call('query_many', self._query_many, rids))
+            for rid, status in queried.items():
+                self._remember(rid, status, token)
+            statuses.update(queried)
+        return statuses
+
+    def wait(self, rid, conditions, timeout, interval=10):
+        """Waits until status of the connection meets conditions (see status_watch.parse_conditions)
+        or timeout [sec] passes, returns the latest status (empty when connection not found).
+
+        Waiting threads are woken up by operations and notifications changing the connection,
+        the status is also read every 'interval' seconds (from connection states table or cache,
+        so waiters of one connection share provider queries).
+        """
+        deadline = time.time() + timeout
+        with self.changes.watching(rid) as watch:
+            while True:
+                seen = watch.generation
+                status = self.query(rid)
+                remaining = deadline - time.time()
+                if not status or satisfied(status, conditions) or remaining <= 0:
+                    return status
+                watch.wait(seen, min(interval, remaining))
+
+    def watch(self, rid, timeout, interval=10):
+        """Yields status of the connection and then its every change, until the connection ends,
+        is not found or timeout [sec] passes. None is yielded when status didn't change for interval."""
+        deadline = time.time() + timeout
+        last = None
+        with self.changes.watching(rid) as watch:
+            while True:
+                seen = watch.generation
+                status = self.query(rid)
+                if status != last:
+                    yield status
+                    last = status
+                else:
+                    yield None
+                remaining = deadline - time.time()
+                if not status or status.get('lifecycleState') in FINAL_STATES or remaining <= 0:
+                    return
+                watch.wait(seen, min(interval, remaining))
+
+    def notify(self, rid, notification_id, data_plane=None, event=None):
+        """Applies notification received by NSI requester: dataPlaneStateChange (data_plane: active,
+        version, versionConsistent) or errorEvent (event: eg. 'forcedEnd', 'dataplaneError')"""
+        logger.info("Notification %s of connection %s: %s", notification_id, rid, data_plane or event)
+        if event == FORCED_END:
+            self.store.update(rid, lifecycleState=FAILED, provisionState=RELEASED)
+        self.cache.invalidate(rid)
+        self.states.notify(rid, notification_id, data_plane, event)
+        self.changes.changed(rid)
+
+    def warm_up(self):
+        """Prepares provider clients before the first request (see NSI_CLIENT_INIT)"""
+        pass
+
+    def report(self):
+        """Statistics of the backend (see GET /nsi/stats)"""
+        report = {'query_cache': self.cache.stats(),
+                  'connection_states': self.states.stats(),
+                  'waiting': self.changes.stats(),
+                  'circuit_breaker': self.breaker.stats(),
+                  'deferred': self.deferred.stats(),
+                  'nsi_operations': self.stats.snapshot()}
+        if self.pool:
+            report['nsi_client_pool'] = self.pool.stats()
+        return report
+
+    def forget(self, rid):
+        """Drops what the backend knows about the reservation (see ReservationReaper)"""
+        self.cache.invalidate(rid)
+        self.states.invalidate(rid)
+
+    def _admit_and_hold(self, params, rid=None):
+        """Admits requested connection (see admit()) and holds its VLANs and capacity, so concurrent
+        requests aren't admitted for them while the provider processes it. Returns ID for _unhold()."""
+        if not self.admission_control:
+            return None
+        hold = 'hold:%s' % uuid.uuid4()
+        conflicts = self.stats.call('admission', self.store.hold, hold, params, self.port_capacity, rid)
+        if conflicts:
+            raise AdmissionError("; ".join(conflicts))
+        return hold
+
+    def _unhold(self, hold):
+        if hold:
+            self.store.unhold(hold)
+
+    def _remember(self, rid, status, token):
+        # only connections made by the service are notified to its requester
+        finished = status and status.get('lifecycleState') in FINAL_STATES
+        if not status or not (self.states.max_age > 0 or finished):
+            return
+        record = self.store.get(rid)
+        if not record:
+            return
+        if finished and record['lifecycleState'] == CREATED:
+            # ended by the provider (or another requester), its VLANs are free and its record can be reaped
+            self.store.update(rid, lifecycleState=status['lifecycleState'], provisionState=RELEASED)
+        if self.states.max_age > 0:
+            self.states.put(rid, status, token, record['end_sec'])
+
+    def _operation(self, operation, func, rid, *args):
+        # known status is outdated also when the operation failed (it could be partially done)
+        try:
+            return self._call(operation, func, rid, *args)
+        finally:
+            self._changed(rid)
+
+    def _changed(self, rid):
+        self.cache.invalidate(rid)
+        self.states.invalidate(rid)
+        self.changes.changed(rid)
+
+    def _call(self, operation, func, *args):
+        caller = current()
+        with deadline(self.timeouts.get(operation)):
+            attempt = 1
+            while True:
+                left = remaining()
+                if left is not None and left <= 0:
+                    self.stats.record(operation, 0, False)
+                    raise DeadlineExceeded("No time left for %s operation" % operation)
+                self.breaker.before()
+                try:
+                    with span(operation if attempt == 1 else '%s (retry %i)' % (operation, attempt - 1)):
+                        result = self.stats.call(operation, func, *args)
+                except DeadlineExceeded:
+                    if caller is None or time.time() < caller:
+                        self.breaker.failure()   # operation timeout, not the caller's deadline passed
+                    else:
+                        self.breaker.ignore()
+                    raise
+                except Exception as e:
+                    if not self._unavailable(e):
+                        self.breaker.ignore()   # provider replied with error
+                        raise
+                    self.breaker.failure()
+                    delay = min(self.retry_backoff * 2 ** (attempt - 1), MAX_BACKOFF)
+                    left = remaining()
+                    if operation not in RETRIED_OPERATIONS or attempt >= self.retry_attempts or \
+                            (left is not None and left <= delay):
+                        raise
+                    logger.warning("Retrying %s in %.1f sec, provider unavailable: %s", operation, delay, e)
+                    time.sleep(delay)
+                    attempt += 1
+                else:
+                    self.breaker.success()
+                    return result
+
+    def _abort_held(self, rid):
+        # the caller has no time left, abort gets its own timeout
+        logger.warning("Aborting reservation %s held after reserve deadline", rid)
+        with until(None):
+            try:
+                self.abort(rid)
+            except Exception as e:
+                if self.unavailable(e) and self.deferred.add(('abort', rid)):
+                    logger.warning("Abort of reservation %s deferred: %s", rid, e)
+                else:
+                    logger.exception("Abort of reservation %s failed", rid)
+
+    def _release_and_terminate(self, rid):
+        try:
+            self.release(rid)
+        except Exception as e:
+            if self.unavailable(e):
+                raise
+            logger.debug("Connection %s not released: %s", rid, e)   # could be not provisioned yet
+        self.terminate(rid)
+
+    def _retry(self, task):
+        # deferred operation, see 'deferred' attribute
+        operation, rid = task
+        if operation == 'delete':
+            self._release_and_terminate(rid)
+        else:
+            self.abort(rid)
+
+    def _unavailable(self, error):
+        return False
+
+    def _query_many(self, rids):
+        statuses = {}
+        for rid in rids:
+            status = self._query(rid)
+            if status:
+                statuses[rid] = status
+        return statuses
+
+    def _send(self, operation, callback, *args):
+        raise NotImplementedError
+
+    def _reserve(self, params):
+        raise NotImplementedError
+
+    def _modify(self, rid, params):
+        raise NotImplementedError
+
+    def _commit(self, rid):
+        raise NotImplementedError
+
+    def _abort(self, rid):
+        raise NotImplementedError
+
+    def _terminate(self, rid):
+        raise NotImplementedError
+
+    def _provision(self, rid):
+        raise NotImplementedError
+
+    def _release(self, rid):
+        raise NotImplementedError
+
+    def _query(self, rid):
+        raise NotImplementedError
+
+
+def create_backend(config, store=None, worker=0):
+    """Creates NSI backend selected by NSI_BACKEND configuration option.
+    
+    Worker process number 'worker' uses its own NSI_POOL_SIZE requester URIs from REQUESTER_URIS.
+    With PROVIDERS option every provider gets its own backend, configured by options of its entry
+    (besides 'name' and 'domains' used for routing, see ProviderRouter) and then by global options.
+    """
+    if config.get('PROVIDERS'):
+        from provider_routing import ProviderRouter
+        if store is None:
+            store = ReservationStore()   # shared by providers
+        providers = []
+        for entry in config['PROVIDERS']:
+            options = dict(config, PROVIDERS=None)
+            options.update((key, value) for key, value in entry.items() if key not in ('name', 'domains'))
+            providers.append((entry['name'], entry.get('domains', []), create_backend(options, store, worker)))
+        return ProviderRouter(providers, store)
+
+    options = {'cache_ttl': config.get('QUERY_CACHE_TTL', 0),
+                'cache_size': config.get('QUERY_CACHE_SIZE', 10000),
+                'cache_negative_ttl': config.get('QUERY_CACHE_NEGATIVE_TTL'),
+                'store': store,
+                'admission_control': config.get('ADMISSION_CONTROL', True),
+                'port_capacity': config.get('PORT_CAPACITY'),
+                'state_max_age': config.get('STATE_MAX_AGE', 300),
+                'operation_timeouts': config.get('OPERATION_TIMEOUTS'),
+                'breaker': CircuitBreaker(config.get('CIRCUIT_BREAKER_THRESHOLD', 5),
+                                          config.get('CIRCUIT_BREAKER_RESET', 30)),
+                'retry_attempts': config.get('RETRY_ATTEMPTS', 3),
+                'retry_backoff': config.get('RETRY_BACKOFF', 0.5),
+                'deferred_interval': config.get('DEFERRED_RETRY_INTERVAL', 30),
+                'deferred_max_age': config.get('DEFERRED_RETRY_MAX_AGE', 86400)}
+    backend = config.get('NSI_BACKEND', 'nsi2interface')
+
+    if backend == 'nsi2interface':
+        import classpath
+        classpath.setup(config.get('NSI_CLASSPATH'))   # before java classes are imported
+        import nsi2interface   # requires Jython and NSI2Interface java class
+        pool_size = config.get('NSI_POOL_SIZE', 1)
+        requester_uris = config.get('REQUESTER_URIS')
+        if requester_uris:
+            requester_uris = requester_uris[worker * pool_size:(worker + 1) * pool_size]
+        elif worker and config['REQUESTER_URI']:
+            raise ValueError("REQUESTER_URIS required by worker processes, they can't share REQUESTER_URI")
+        else:
+            requester_uris = config['REQUESTER_URI']
+        pipeline_uri = config.get('PIPELINE_REQUESTER_URI')
+        if isinstance(pipeline_uri, (list, tuple)):
+            pipeline_uri = pipeline_uri[worker]   # one per worker process
+        elif worker and pipeline_uri:
+            raise ValueError("PIPELINE_REQUESTER_URI must be a list of URIs with worker processes")
+        return nsi2interface.NSI(config['PROVIDER_NSA'], config['PROVIDER_URI'],
+                                 config['REQUESTER_NSA'], requester_uris,
+                                 query_batch_size=config.get('QUERY_BATCH_SIZE', 500),
+                                 pool_size=pool_size,
+                                 pool_wait=config.get('NSI_POOL_WAIT', 60),
+                                 reply_wait=config.get('NSI_REPLY_WAIT', 300),
+                                 lazy=config.get('NSI_CLIENT_INIT', EAGER) != EAGER,
+                                 pipeline_uri=pipeline_uri, **options)
+    if backend == 'simulated':
+        from simulated_backend import SimulatedNSI
+        return SimulatedNSI(config.get('SIMULATED_LATENCY', {}), config.get('SIMULATED_FAILURE_RATE', {}),
+                            config.get('REQUESTER_NSA', 'urn:ogf:network:simulated:nsa'), **options)
+    raise ValueError("Unknown NSI backend '%s'" % backend)
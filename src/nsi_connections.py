@@ -12,46 +12,311 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import logging, os, time
-from logging.handlers import RotatingFileHandler
+import json, os, sys, time
+STARTED = time.time()   # beginning of startup timing (see GET /nsi/ready)
 from pprint import pformat
 
-from flask import Flask, request, jsonify, abort
+from flask import Flask, Response, request, jsonify, abort, g
 from flasgger import Swagger
 
-import nsi2interface
-from attribute_utils import prepare_nsi_attributes
+from nsi_backend import create_backend
+from admission_control import AdmissionError
+from reservation_store import create_store
+from reservation_reaper import ReservationReaper
+from server import worker_number, start_workers, serve
+from log_config import setup_logging, Lazy
+from attribute_utils import prepare_nsi_attributes, prepare_modify_attributes
+from job_manager import JobManager, JobQueueFull, map_parallel, IN_PROGRESS, COMPLETED, FAILED
+from create_pipeline import CreatePipeline, CREATED, FAILED as CREATION_FAILED
+from connection_listing import ConnectionIndex, list_connections, describe_connection, ListingError
+from status_watch import parse_conditions, WaitError
+from deadlines import DeadlineExceeded, remaining
+from circuit_breaker import CircuitOpen
+from client_pool import PoolTimeout
+import deadlines
+import metrics
+import tracing
+from operation_stats import OperationStats
+from startup import Startup, MODES, EAGER, BACKGROUND, LAZY
+from idempotency import IdempotencyKeys, KeyReused, RequestInProgress
 
 #----------------------------------------------------------
 
+# when run as a script, tmf_service_activation_api must import this module instead of loading its second copy
+sys.modules.setdefault('nsi_connections', sys.modules[__name__])
+
+startup = Startup(STARTED)
+startup.mark('imports')
+
 app = Flask(__name__)
 Swagger(app)                               
 
 app.config.from_envvar('NSI_CONNECTIONS_SETTINGS')  # config file name declared in environment variable (see start script)
 
-handler = RotatingFileHandler(app.config['LOG_FILE'], maxBytes=200000000, backupCount=5)
-handler.setFormatter(logging.Formatter("%(levelname)s - %(asctime)s - %(name)s - %(message)s"))
-handler.setLevel(logging.DEBUG)
-app.logger.addHandler(handler)
-app.logger.setLevel(logging.DEBUG)
+WORKER = worker_number()   # worker processes are started when SERVER_PROCESSES > 1
+
+log_file = app.config['LOG_FILE'] + ('.%i' % WORKER if WORKER else '')   # every process rotates its own log
+handler = setup_logging(app, app.config, log_file)   # LOG_LEVEL, LOG_LEVELS, LOG_ASYNC, ... options
+tracing.configure(app.config.get('TRACE_SLOW_THRESHOLD'), app.config.get('TRACE_PROFILE_INTERVAL'))
+startup.mark('config')
+
+# NSI clients are constructed now ('eager'), by warm-up thread ('background') or by the first request ('lazy')
+CLIENT_INIT = app.config.get('NSI_CLIENT_INIT', EAGER)
+if CLIENT_INIT not in MODES:
+    raise ValueError("Unknown NSI_CLIENT_INIT '%s', expected one of %s" % (CLIENT_INIT, ', '.join(MODES)))
+
+# reservations recorded in RESERVATION_STORE file (shared by worker processes) or kept in memory
+with startup.step('reservation_store'):
+    store = create_store(app.config, exclusive=app.config.get('SERVER_PROCESSES', 1) == 1)
+with startup.step('nsi_backend'):
+    nsi = create_backend(app.config, store, WORKER)  # NSI_BACKEND option selects real NSI provider or its simulation
+
+jobs = JobManager(app.config.get('ASYNC_WORKERS', 8), app.config.get('ASYNC_QUEUE_SIZE', 1000),
+                            app.config.get('ASYNC_JOB_RETENTION', 3600))
 
-werkzeug_loggger = logging.getLogger('werkzeug')
-werkzeug_loggger.addHandler(handler)
+# asynchronous and batch creations sent step by step without waiting threads (see CREATE_PIPELINE)
+pipeline = None
+if app.config.get('CREATE_PIPELINE', False):
+    if not nsi.pipelined:
+        raise ValueError("CREATE_PIPELINE requires simulated backend or PIPELINE_REQUESTER_URI")
+    pipeline = CreatePipeline(nsi, app.config.get('PIPELINE_WORKERS', 2),
+                              app.config.get('PIPELINE_STEP_TIMEOUT', app.config.get('NSI_REPLY_WAIT', 300)),
+                              app.config.get('PIPELINE_MAX_PENDING', 1000),
+                              app.config.get('ASYNC_JOB_RETENTION', 3600))
 
-utils_loggger = logging.getLogger('time_utils')
-utils_loggger.addHandler(handler)
+# finished reservations are forgotten RESERVATION_RETENTION seconds later (kept forever when it is None)
+reaper = None
+if app.config.get('RESERVATION_RETENTION', 86400) is not None:
+    reaper = ReservationReaper(store, nsi, app.config.get('RESERVATION_RETENTION', 86400),
+                               app.config.get('REAPER_TERMINATE_EXPIRED', False),
+                               active=not WORKER or not app.config.get('RESERVATION_STORE'))   # shared store is reaped by one process
 
+# listing order of recorded reservations (see GET /nsi/connections)
+connection_index = ConnectionIndex(store)
 
-nsi = nsi2interface.NSI(app.config['PROVIDER_NSA'], app.config['PROVIDER_URI'], 
-                                app.config['REQUESTER_NSA'], app.config['REQUESTER_URI'])
+# outcomes of connection creations with Idempotency-Key header, kept by every worker process
+# (except transient failures, a connection reserved by them is deleted, so the retry creates it)
+idempotency_keys = IdempotencyKeys(app.config.get('IDEMPOTENCY_TTL', 86400),
+                                   app.config.get('IDEMPOTENCY_MAX_KEYS', 10000),
+                                   app.config.get('IDEMPOTENCY_WAIT', 60),
+                                   transient=(CircuitOpen, JobQueueFull, DeadlineExceeded, PoolTimeout))
+
+request_metrics = metrics.RequestMetrics()   # reported by GET /metrics
+phases = OperationStats()             # latency of request processing steps besides NSI operations
 
 LOGGER_INTRO = '\n'*3+'*'*80
+MAX_IDEMPOTENCY_KEY = 255   # max length of Idempotency-Key header
+
+#----------------------------------------------
+
+def warm_up():
+    """Loads reservation store log and constructs NSI clients unless they are made lazily"""
+    store.get_last()
+    if CLIENT_INIT != LAZY:
+        nsi.warm_up()
+
+
+def phase(name, func, *args):
+    """Calls func as a timed step of request processing (see /metrics and tracing)"""
+    with tracing.span(name):
+        return phases.call(name, func, *args)
+
+
+def reserve_and_provision(params):
+    """Reserves (reserve + commit) and provisions a new connection, returns its reservation ID"""
+    reservation_id = nsi.reserve(params)
+    app.logger.debug("reservation ID=%s", reservation_id)
+    
+    if not reservation_id:
+        raise Exception("Couldn't reserve the connection")
+
+    try:
+        nsi.provision(reservation_id)
+    except:
+        # failed creation is retried (with the same Idempotency-Key, see create_once), so it must not stay reserved
+        nsi.discard(reservation_id)
+        raise
+    
+    app.logger.debug("Connection %s created", reservation_id)
+    
+    store.set_last(reservation_id)
+    return reservation_id
+    
+
+def create_pipelined(params_list):
+    """Creates connections by the pipeline, returns list of (reservation ID, error) tuples in order
+    of params_list. Connections still being created at deadline of the request are reported as errors."""
+    creations = []
+    for params in params_list:
+        try:
+            creations.append((pipeline.submit(params), None))
+        except JobQueueFull as e:
+            creations.append((None, str(e)))
+    results = []
+    for creation, error in creations:
+        if error:
+            results.append((None, error))
+            continue
+        left = remaining()
+        creation.ended.wait(None if left is None else max(left, 0))
+        if not creation.ended.is_set():
+            results.append((None, "Creation of connection %s still in progress" % creation.reservation_id))
+        elif creation.state == CREATED:
+            results.append((creation.reservation_id, None))
+        else:
+            results.append((None, creation.error))
+    return results
+
+
+def creation_job(creation_id):
+    """Creation made by the pipeline as asynchronous job (see JobManager), None when not found"""
+    creation = pipeline.get(creation_id) if pipeline else None
+    if not creation:
+        return None
+    state = {CREATED: COMPLETED, CREATION_FAILED: FAILED}.get(creation['state'], IN_PROGRESS)
+    return {'id': creation['id'],
+            'state': state,
+            'step': creation['state'],
+            'created': creation['created'],
+            'finished': creation['finished'],
+            'result': creation['reservation_id'] if state == COMPLETED else None,
+            'error': creation['error']}
+
+
+def query_status(reservation_id, args):
+    """Returns status of the connection, when args contain 'wait_for' conditions (and optional 'timeout' [sec])
+    waits until they are met, raises WaitError for incorrect args"""
+    if not args.get('wait_for'):
+        return nsi.query(reservation_id)
+    conditions = parse_conditions(args['wait_for'])
+    timeout = wait_timeout(args)
+    left = remaining()
+    if left is not None:
+        timeout = max(0, min(timeout, left))   # waiting ends at deadline of the request
+    return nsi.wait(reservation_id, conditions, timeout, app.config.get('WAIT_INTERVAL', 10))
+
+
+def wait_timeout(args):
+    """Timeout [sec] of waiting requests, limited by WAIT_MAX_TIMEOUT"""
+    max_timeout = app.config.get('WAIT_MAX_TIMEOUT', 300)
+    try:
+        timeout = float(args.get('timeout', max_timeout))
+    except ValueError:
+        raise WaitError("Incorrect timeout '%s'" % args['timeout'])
+    return max(0, min(timeout, max_timeout))
+
+
+def modify_connection(reservation_id, params):
+    """Changes end time, capacity or description of the connection by NSI modify (reserve + commit)
+    without interrupting its data plane, returns its description (see describe_connection)"""
+    nsi.modify(reservation_id, params)
+    app.logger.debug("Connection %s modified", reservation_id)
+    return describe_connection(store.get(reservation_id))
+
+
+def release_and_terminate(reservation_id):
+    """Releases (if provisioned) and terminates the connection, returns False when NSI provider 
+    is unavailable and the deletion is retried in background (see DEFERRED_RETRY_INTERVAL)"""
+    deleted = nsi.delete(reservation_id)
+    if not deleted:
+        app.logger.warning("Connection %s will be deleted when NSI provider is available", reservation_id)
+    return deleted
+
+
+def create_once(func, *args):
+    """Calls func(*args) once for all requests with the same Idempotency-Key header (retries
+    get the recorded result or exception), raises KeyReused when the key was used by a different
+    request and RequestInProgress when the first request didn't finish in IDEMPOTENCY_WAIT seconds"""
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        return func(*args)
+    fingerprint = (request.path, request.headers.get('Expect'), request.get_data())
+    return idempotency_keys.call(key, fingerprint, func, *args)
+
+
+def idempotency_response(e):
+    """HTTP 409 (request with the same Idempotency-Key in progress) or 422 (key reused) response"""
+    code = 409 if isinstance(e, RequestInProgress) else 422
+    app.logger.error("%s. Responging HTTP code: %i", e, code)
+    return jsonify({'error': str(e)}), code
+
+
+def unavailable_response(e):
+    """HTTP 503 response to a request failed because of open circuit breaker"""
+    app.logger.error("%s. Responging HTTP code: 503", e)
+    return jsonify({'error': str(e)}), 503, {'Retry-After': str(int(e.retry_after or 0) + 1)}
+    
+
+@app.before_request
+def start_trace():
+    """Request ID is taken from X-Request-ID (or X-Correlation-ID) header or generated,
+    it is logged with messages of the request and returned in X-Request-ID header"""
+    tracing.start(request.headers.get('X-Request-ID') or request.headers.get('X-Correlation-ID'))
+
+
+@app.after_request
+def add_request_id(response):
+    response.headers['X-Request-ID'] = tracing.request_id()
+    return response
+
+
+@app.before_request
+def start_metrics():
+    g.started = time.time()
+    request_metrics.started()
+
+
+@app.after_request
+def record_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_metrics.record(request.method, endpoint, response.status_code, time.time() - g.started)
+    return response
+
+
+@app.before_request
+def start_deadline():
+    """Provider operations of the request are limited by X-Request-Timeout header
+    or request_timeout argument [sec], DeadlineExceeded is raised when the time runs out"""
+    timeout = request.headers.get('X-Request-Timeout') or request.args.get('request_timeout')
+    if timeout is None:
+        return
+    try:
+        seconds = float(timeout)
+    except ValueError:
+        seconds = -1
+    if not seconds > 0:
+        app.logger.error("Incorrect request timeout '%s'. Responging HTTP code: 400", timeout)
+        abort(400)
+    deadlines.start(seconds)
+
+
+@app.before_request
+def check_idempotency_key():
+    key = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= MAX_IDEMPOTENCY_KEY:
+        app.logger.error("Incorrect Idempotency-Key '%s'. Responging HTTP code: 400", key[:MAX_IDEMPOTENCY_KEY])
+        abort(400)
+
+
+@app.teardown_request
+def clear_deadline(exception=None):
+    deadlines.clear()
+
+
+@app.teardown_request
+def finish_metrics(exception=None):
+    request_metrics.finished()
+
+
+@app.teardown_request
+def finish_trace(exception=None):
+    tracing.finish()   # span tree is logged when request lasted TRACE_SLOW_THRESHOLD
+
 
 from tmf_service_activation_api import activation_api
 app.register_blueprint(activation_api)
 
 
-
 #----------------------------------------------
 @app.route("/nsi/connections", methods=['POST'])
 def create_connection():
@@ -80,18 +345,33 @@ def create_connection():
         1. HTTP code 201 and JSON object containing one attribute
             - reservation_id: [string] URN identifier of the reserved connection (eg.: 'urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266')
         2. HTTP code 400 when incorrect connection attributes provided
-        3. HTTP code 500 when a connection couldn't be reserved in the BoD system or other problem occured
+        3. HTTP code 409 and JSON object with 'error' attribute when VLAN or port capacity is already
+           used by other reservation of the service in overlapping time (checked without contacting BoD)
+        4. HTTP code 500 when a connection couldn't be reserved in the BoD system or other problem occured
+        5. HTTP code 504 and JSON object with 'error' attribute when the request timeout passed
+           (X-Request-Timeout header or request_timeout argument [sec], a reservation held by BoD is aborted)
+        6. HTTP code 503 and JSON object with 'error' attribute when NSI provider is unavailable
+           (requests are not sent to it for CIRCUIT_BREAKER_RESET seconds, see 'Retry-After' header)
+        7. HTTP code 409 and JSON object with 'error' attribute when request with the same 
+           Idempotency-Key header is still in progress
+        8. HTTP code 422 and JSON object with 'error' attribute when Idempotency-Key header was used
+           by a different request
+           
+        Retried request with the same Idempotency-Key header (kept for IDEMPOTENCY_TTL seconds) gets 
+        outcome of the first one instead of creating another connection. Outcomes 503 and 504 are not
+        kept, the retry creates the connection (a reservation made by the failed request is deleted
+        in background, see NSIBackend.discard).
     """
     app.logger.debug(LOGGER_INTRO)
     
     connAttributes = request.get_json() 
-    app.logger.info("Creating connection with attributes \n%s", pformat(connAttributes))
+    app.logger.info("Creating connection with attributes \n%s", Lazy(pformat, connAttributes))
     if not connAttributes:
         app.logger.error("Responging HTTP code: 400")
         abort(400)
     
     try:
-        params = prepare_nsi_attributes(connAttributes)
+        params = phase('prepare_nsi_attributes', prepare_nsi_attributes, connAttributes)
     except:
         import traceback
         app.logger.error(traceback.format_exc())
@@ -99,21 +379,160 @@ def create_connection():
         abort(400)
         
     try:      
-        reservation_id = nsi.reserve(params)
-        app.logger.debug("reservation ID=" + reservation_id)
+        reservation_id = create_once(reserve_and_provision, params)
         
-        if not reservation_id:
-            app.logger.error("Couldn't reserve the connection. Responging HTTP code: 500")
-            abort(500)
+        return jsonify({'reservation_id': reservation_id}), 201, {'location': '/nsi/connection/%s' % reservation_id}
+    except AdmissionError as e:
+        app.logger.error("Connection conflicts with reservations: %s. Responging HTTP code: 409", e)
+        return jsonify({'error': str(e)}), 409
+    except (KeyReused, RequestInProgress) as e:
+        return idempotency_response(e)
+    except DeadlineExceeded as e:
+        app.logger.error("%s. Responging HTTP code: 504", e)
+        return jsonify({'error': str(e)}), 504
+    except CircuitOpen as e:
+        return unavailable_response(e)
+    except:
+        import traceback
+        app.logger.error(traceback.format_exc())
+        app.logger.error("Responging HTTP code: 500")
+        abort(500)
 
-        nsi.provision(reservation_id)
+
+#----------------------------------------------
+
+@app.route("/nsi/connections/batch", methods=['POST'])
+def create_connections():
+    """Create many data plane connections at once
+    
+    Data:  JSON object containing:
+        - connections: [list of objects] attributes of every connection (see POST /nsi/connections)
+        - all_or_nothing: (optional) [bool] if true then connections are provisioned only when all of 
+            them were reserved, otherwise all reserved connections are terminated (default: false)
         
-        app.logger.debug("Connection %s created" % reservation_id)
+        All connection attributes are validated before any connection is reserved. 
+        Up to BATCH_CONCURRENCY connections are reserved and provisioned in parallel (with CREATE_PIPELINE
+        all of them are sent by the pipeline, except all_or_nothing batches).
         
-        global LAST_RESERVATION
-        LAST_RESERVATION = reservation_id
+    Returns:
+        1. HTTP code 201 when all connections were created, 207 when any of them failed
+           or 500 when all_or_nothing was requested and any of them failed; JSON object containing:
+            - results: [list of objects] result for each requested connection (in request order):
+                - reservation_id: [string] URN identifier of the reserved connection
+                - error: [string] reason of the failure (when connection couldn't be created)
+                - rolled_back: [bool] true when connection was terminated because of other failures
+        2. HTTP code 400 and JSON object with 'errors' list when any of connection attributes are incorrect
+    """
+    app.logger.debug(LOGGER_INTRO)
+    
+    batch = request.get_json()
+    if isinstance(batch, list):
+        batch = {'connections': batch}
+    if not batch or not isinstance(batch.get('connections'), list) or not batch['connections']:
+        app.logger.error("Responging HTTP code: 400")
+        abort(400)
+    all_or_nothing = bool(batch.get('all_or_nothing'))
+    app.logger.info("Creating %i connections (all or nothing: %s)", len(batch['connections']), all_or_nothing)
+    
+    params_list, errors = [], []
+    for index, connAttributes in enumerate(batch['connections']):
+        try:
+            params_list.append(phase('prepare_nsi_attributes', prepare_nsi_attributes, connAttributes))
+        except Exception as e:
+            errors.append({'index': index, 'error': 'bad connection attributes: %r' % e})
+    if errors:
+        app.logger.error("Bad connection attributes %s. Responging HTTP code: 400", errors)
+        return jsonify({'errors': errors}), 400
+    
+    concurrency = app.config.get('BATCH_CONCURRENCY', 8)
+    if not all_or_nothing:
+        if pipeline:
+            outcomes = create_pipelined(params_list)
+        else:
+            outcomes = map_parallel(reserve_and_provision, params_list, concurrency)
+        results = [{'reservation_id': rid} if not error else {'error': error} for rid, error in outcomes]
+        code = 201 if all('reservation_id' in result for result in results) else 207
+        app.logger.debug("Batch results: %s", results)
+        return jsonify({'results': results}), code
         
-        return jsonify({'reservation_id': reservation_id}), 201, {'location': '/nsi/connection/%s' % reservation_id}
+    # all or nothing: connections are provisioned only when all of them were reserved
+    outcomes = map_parallel(nsi.reserve, params_list, concurrency)
+    results = [{'reservation_id': rid} if rid else {'error': error or "Couldn't reserve the connection"} 
+                 for rid, error in outcomes]
+    if all('reservation_id' in result for result in results):
+        outcomes = map_parallel(nsi.provision, [result['reservation_id'] for result in results], concurrency)
+        for result, (_, error) in zip(results, outcomes):
+            if error:
+                result['error'] = error
+    if not any('error' in result for result in results):
+        app.logger.debug("Batch results: %s", results)
+        return jsonify({'results': results}), 201
+        
+    reserved = [result['reservation_id'] for result in results if 'reservation_id' in result]
+    app.logger.error("Batch failed, terminating reserved connections %s", reserved)
+    map_parallel(release_and_terminate, reserved, concurrency)
+    for result in results:
+        if 'reservation_id' in result:
+            result['rolled_back'] = True
+    app.logger.error("Responging HTTP code: 500")
+    return jsonify({'results': results}), 500
+
+
+#----------------------------------------------
+
+@app.route("/nsi/connections/<reservation_id>", methods=['PATCH'])
+def patch_connection(reservation_id):
+    """Change schedule end, capacity or description of the connection in place (NSI modify)
+    
+    Arguments:
+        - reservation_id: [string] URN identifier of the reserved connection (eg.: 'urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266')
+        
+    Data:  JSON object containing any of attributes:
+        - end_time: [string] new date and time when connection should be terminated, ISO 8601 format 
+            (eg.: '2017-09-1T13:00:00+02:00', see POST /nsi/connections)
+        - capacity: [int] new bandwidth of the connection
+        - description: [string] new description of the connection
+        
+        Only connections made by the service can be modified (their schedule and version are recorded).
+        
+    Returns:
+        1. HTTP code 200 and JSON object describing the modified connection (attributes as in listing
+           of connections, see GET /nsi/connections)
+        2. HTTP code 400 when incorrect attributes provided
+        3. HTTP code 404 when connection was not made by the service
+        4. HTTP code 409 and JSON object with 'error' attribute when the change conflicts with 
+           other reservations of the service (see POST /nsi/connections)
+        5. HTTP code 500 when a connection couldn't be modified in the BoD system or other problem occured
+        6. HTTP code 504 and JSON object with 'error' attribute when the request timeout passed (see POST /nsi/connections)
+        7. HTTP code 503 and JSON object with 'error' attribute when NSI provider is unavailable (see POST /nsi/connections)
+    """
+    app.logger.debug(LOGGER_INTRO)
+    
+    connAttributes = request.get_json() 
+    app.logger.info("Modifying connection %s with attributes \n%s", reservation_id, Lazy(pformat, connAttributes))
+    record = store.get(reservation_id)
+    if not record:
+        app.logger.error("Connection not found. Responging HTTP code: 404")
+        abort(404)
+    
+    try:
+        params = phase('prepare_modify_attributes', prepare_modify_attributes, record, connAttributes)
+    except:
+        import traceback
+        app.logger.error(traceback.format_exc())
+        app.logger.error("Bad connection attributes. Responging HTTP code: 400")
+        abort(400)
+    
+    try:
+        return jsonify(modify_connection(reservation_id, params))
+    except AdmissionError as e:
+        app.logger.error("Connection conflicts with reservations: %s. Responging HTTP code: 409", e)
+        return jsonify({'error': str(e)}), 409
+    except DeadlineExceeded as e:
+        app.logger.error("%s. Responging HTTP code: 504", e)
+        return jsonify({'error': str(e)}), 504
+    except CircuitOpen as e:
+        return unavailable_response(e)
     except:
         import traceback
         app.logger.error(traceback.format_exc())
@@ -121,6 +540,58 @@ def create_connection():
         abort(500)
 
 
+#----------------------------------------------
+
+@app.route("/nsi/connections/batch", methods=['PATCH'])
+def patch_connections():
+    """Change many connections at once (NSI modify)
+    
+    Data:  JSON object containing:
+        - connections: [list of objects] reservation_id and attributes changed in every connection 
+            (end_time, capacity, description, see PATCH /nsi/connections/<reservation_id>)
+        
+        All attributes are validated before any connection is modified. 
+        Up to BATCH_CONCURRENCY connections are modified in parallel.
+        
+    Returns:
+        1. HTTP code 200 when all connections were modified, 207 when any of them failed; JSON object containing:
+            - results: [list of objects] result for each requested connection (in request order):
+                - connection: [object] description of the modified connection 
+                - error: [string] reason of the failure (when connection couldn't be modified)
+        2. HTTP code 400 and JSON object with 'errors' list when any of connections is unknown 
+            or its attributes are incorrect
+    """
+    app.logger.debug(LOGGER_INTRO)
+    
+    batch = request.get_json()
+    if isinstance(batch, list):
+        batch = {'connections': batch}
+    if not batch or not isinstance(batch.get('connections'), list) or not batch['connections']:
+        app.logger.error("Responging HTTP code: 400")
+        abort(400)
+    app.logger.info("Modifying %i connections", len(batch['connections']))
+    
+    changes, errors = [], []
+    for index, connAttributes in enumerate(batch['connections']):
+        try:
+            record = store.get(connAttributes['reservation_id'])
+            if not record:
+                errors.append({'index': index, 'error': 'connection not found'})
+                continue
+            changes.append((record['reservation_id'], phase('prepare_modify_attributes', prepare_modify_attributes, record, connAttributes)))
+        except Exception as e:
+            errors.append({'index': index, 'error': 'bad connection attributes: %r' % e})
+    if errors:
+        app.logger.error("Bad connection attributes %s. Responging HTTP code: 400", errors)
+        return jsonify({'errors': errors}), 400
+    
+    outcomes = map_parallel(lambda change: modify_connection(*change), changes, app.config.get('BATCH_CONCURRENCY', 8))
+    results = [{'connection': connection} if not error else {'error': error} for connection, error in outcomes]
+    code = 200 if all('connection' in result for result in results) else 207
+    app.logger.debug("Batch results: %s", results)
+    return jsonify({'results': results}), code
+
+
 #----------------------------------------------
     
 @app.route("/nsi/connections/<reservation_id>", methods=['DELETE'])
@@ -131,17 +602,21 @@ def delete_connection(reservation_id):
         - reservation_id: [string] URN identifier of the reserved connection (eg.: 'urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266')
         
     Returns:
-        1. HTTP code 200 for all conditions
+        1. HTTP code 200 when the connection was deleted
+        2. HTTP code 202 when NSI provider is unavailable, deletion is retried in background
+        3. HTTP code 500 when a connection couldn't be deleted in the BoD system or other problem occured
     """
     app.logger.debug(LOGGER_INTRO)
     app.logger.info("Deleting connection %s", reservation_id)
     
     try:
-        nsi.release(reservation_id)
-        nsi.terminate(reservation_id)
+        if not release_and_terminate(reservation_id):
+            return "Deletion of connection %s scheduled\n" % reservation_id, 202
     except:
         import traceback
         app.logger.error(traceback.format_exc())
+        app.logger.error("Responging HTTP code: 500")
+        abort(500)
         
     app.logger.debug("Connection %s delated", reservation_id)
     return "Connection %s has been deleted\n" % reservation_id, 200
@@ -155,15 +630,19 @@ def delete_last_connection():
     app.logger.debug(LOGGER_INTRO)
     app.logger.info("Deleting last connection")
     
+    reservation_id = store.get_last()
+    
     try:
-        nsi.release(LAST_RESERVATION)
-        nsi.terminate(LAST_RESERVATION)
+        if not release_and_terminate(reservation_id):
+            return "Deletion of connection %s scheduled\n" % reservation_id, 202
     except:
         import traceback
         app.logger.error(traceback.format_exc())
+        app.logger.error("Responging HTTP code: 500")
+        abort(500)
         
-    app.logger.debug("Connection %s deleted", LAST_RESERVATION)
-    return "Connection %s deleted\n" % LAST_RESERVATION, 200
+    app.logger.debug("Connection %s deleted", reservation_id)
+    return "Connection %s deleted\n" % reservation_id, 200
     
     
 #----------------------------------------------
@@ -174,9 +653,13 @@ def query_connection(reservation_id):
     
     Arguments:
         - reservation_id: [string] URN identifier of the reserved connection (eg.: 'urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266')
+        - wait_for: (optional) [string] comma separated attribute:value conditions (eg.: 'provisionState:PROVISIONED'
+            or 'active:true'), the response is returned when all of them are met or the timeout passes
+        - timeout: (optional) [float] max time [sec] of waiting for conditions (default and max: WAIT_MAX_TIMEOUT)
         
     Returns:
-        1. HTTP code 200 and JSON object containing status information about the connection:
+        1. HTTP code 200 and JSON object containing status information about the connection
+           (when wait_for conditions are not met before the timeout, the latest status is returned):
             - active: ["false", "true"] is data plane for the connection provisioned (can traffic be send)
             - connectionId: [string] URN identifier of the reserved connection
             - description:  [string] description of the connection 
@@ -188,15 +671,34 @@ def query_connection(reservation_id):
             - reservationState: ["RESERVE_START", "RESERVE CHECKING", "RESERVE_FAILED", "RESERVE_ABORTING", "RESERVE_HELD", "RESERVE_COMMITTING", "RESERVE_TIMEOUT"] transitions of the reservation lifecycle
             - version: [int] version of the reservation instantiated in the data plan
             - versionConsistent:  ["true", "false"] consistency of reservation versions for NSI AG
-        2. HTTP code 404 when connection was not found 
-        3. HTTP code 500 when query request could not be sent to NSI API
+            - criteria: [list of objects] typed reservation criteria: version, serviceType, schedule (startTime, endTime),
+                p2ps (capacity, directionality, symmetricPath, sourceSTP, destSTP, ero) and children segments
+                (connectionId, providerNSA, serviceType, order, p2ps)
+            - connectionStates: [object] reservationState, provisionState, lifecycleState and 
+                dataPlaneStatus (active, version, versionConsistent) with typed values
+            - creation: [object] (only connections recently created by CREATE_PIPELINE) id, state ("reserving",
+                "committing", "provisioning", "created", "failed"), error and steps (operation -> seconds until
+                its confirmation) of the creation
+        2. HTTP code 400 when wait_for or timeout is incorrect
+        3. HTTP code 404 when connection was not found 
+        4. HTTP code 500 when query request could not be sent to NSI API
+        5. HTTP code 504 when the request timeout passed (see POST /nsi/connections)
+        6. HTTP code 503 when NSI provider is unavailable (see POST /nsi/connections)
     """
     app.logger.debug(LOGGER_INTRO)
     app.logger.debug("Query connection %s", reservation_id)
     status = {}
     
     try:
-        status = nsi.query(reservation_id)
+        status = query_status(reservation_id, request.args)
+    except WaitError as e:
+        app.logger.error("%s. Responging HTTP code: 400", e)
+        abort(400)
+    except DeadlineExceeded as e:
+        app.logger.error("%s. Responging HTTP code: 504", e)
+        abort(504)
+    except CircuitOpen as e:
+        return unavailable_response(e)
     except:
         import traceback
         app.logger.error(traceback.format_exc())
@@ -205,16 +707,245 @@ def query_connection(reservation_id):
     if not status:
         app.logger.debug("Connection not found")
         abort(404)
+    
+    creation = pipeline.find(reservation_id) if pipeline else None
+    if creation:
+        status = dict(status, creation=creation)
         
-    app.logger.debug("Connection status is \n%s", pformat(status))
+    app.logger.debug("Connection status is \n%s", Lazy(pformat, status))
     return jsonify(status)
    
     
+#----------------------------------------------
+
+@app.route("/nsi/connections/<reservation_id>/events", methods=['GET'])
+def watch_connection(reservation_id):
+    """Stream of status changes of the connection (server-sent events)
+    
+    Arguments:
+        - reservation_id: [string] URN identifier of the reserved connection (eg.: 'urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266')
+        - timeout: (optional) [float] max duration [sec] of the stream (default and max: WAIT_MAX_TIMEOUT)
+        
+    Returns:
+        1. HTTP code 200 and text/event-stream: 'status' event with JSON status (see GET /nsi/connections/<reservation_id>)
+           sent at start and after every change, comments sent every WAIT_INTERVAL seconds without changes.
+           The stream ends when the connection ends (lifecycleState FAILED, PASSED_END_TIME, TERMINATED),
+           is not found (status is {}) or the timeout passes.
+        2. HTTP code 400 when timeout is incorrect
+    """
+    app.logger.debug(LOGGER_INTRO)
+    app.logger.debug("Watching connection %s", reservation_id)
+    try:
+        timeout = wait_timeout(request.args)
+    except WaitError as e:
+        app.logger.error("%s. Responging HTTP code: 400", e)
+        abort(400)
+    
+    def events():
+        try:
+            for status in nsi.watch(reservation_id, timeout, app.config.get('WAIT_INTERVAL', 10)):
+                if status is None:
+                    yield ": no changes\n\n"
+                else:
+                    yield "event: status\ndata: %s\n\n" % json.dumps(status, sort_keys=True)
+        except Exception:
+            import traceback
+            app.logger.error(traceback.format_exc())
+            yield "event: error\ndata: {}\n\n"
+    
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    
+    
+#----------------------------------------------
+
+@app.route("/nsi/connections", methods=['GET'])
+def query_connections():
+    """Query status of many connections using single NSI query or list connections made by the service
+    
+    Arguments:
+        - ids: [string] comma separated URN identifiers of the reserved connections, parameter can be repeated
+            (eg.: '?ids=urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266,urn:uuid:5f3d47d2-b201-4943-8606-7893d2dc246b')
+            
+        Without 'ids' connections recorded by the service are listed (NSI provider is not queried):
+        - state: (optional) [string] comma separated lifecycle or provision states (eg.: 'CREATED,PROVISIONED')
+        - src_domain, src_port, dst_domain, dst_port: (optional) [string] connection end points
+        - vlan, src_vlan, dst_vlan: (optional) [int] VLAN tag used on any, source or destination port
+        - start_time, end_time: (optional) [string] ISO 8601 time window overlapping with connection schedule
+        - description: (optional) [string] case-insensitive substring of connection description
+        - limit: (optional) [int] max number of listed connections (default 100, max 1000)
+        - cursor: (optional) [string] 'next_cursor' returned with the previous page
+        - fields: (optional) [string] comma separated attributes of listed connections
+        
+    Returns:
+        1. HTTP code 200 and JSON object containing:
+            - connections: [list of objects] status of every found connection (see GET /nsi/connections/<reservation_id>)
+            - not_found: [list of strings] identifiers of connections which were not found
+        2. HTTP code 200 (listing) and JSON object containing:
+            - connections: [list of objects] connections ordered by creation time with attributes:
+                reservation_id, global_reservation_id, description, src_domain, src_port, src_vlan, 
+                dst_domain, dst_port, dst_vlan, capacity, start_time, end_time, explicit_routes,
+                lifecycleState, provisionState, active, version, created
+            - next_cursor: [string] cursor of the next page, null on the last page
+        3. HTTP code 400 when listing arguments are incorrect
+        4. HTTP code 500 when query request could not be sent to NSI API
+        5. HTTP code 504 and JSON object with 'error' attribute when the request timeout passed
+        6. HTTP code 503 and JSON object with 'error' attribute when NSI provider is unavailable
+    """
+    app.logger.debug(LOGGER_INTRO)
+    reservation_ids = []
+    for ids in request.args.getlist('ids'):
+        reservation_ids.extend(rid.strip() for rid in ids.split(',') if rid.strip())
+    if not reservation_ids:
+        return list_recorded_connections()
+    app.logger.debug("Query %i connections", len(reservation_ids))
+    
+    try:
+        statuses = nsi.query_many(reservation_ids)
+    except DeadlineExceeded as e:
+        app.logger.error("%s. Responging HTTP code: 504", e)
+        return jsonify({'error': str(e)}), 504
+    except CircuitOpen as e:
+        return unavailable_response(e)
+    except:
+        import traceback
+        app.logger.error(traceback.format_exc())
+        app.logger.error("Responging HTTP code: 500")
+        abort(500)
+    
+    connections = [statuses[rid] for rid in reservation_ids if statuses.get(rid)]
+    not_found = [rid for rid in reservation_ids if not statuses.get(rid)]
+    app.logger.debug("Found %i connections, not found %s", len(connections), not_found)
+    return jsonify({'connections': connections, 'not_found': not_found})
+    
+    
+def list_recorded_connections():
+    app.logger.debug("List connections %s", request.args.to_dict())
+    try:
+        connections, next_cursor = list_connections(store, connection_index, request.args)
+    except ListingError as e:
+        app.logger.error("%s. Responging HTTP code: 400", e)
+        abort(400)
+    app.logger.debug("Listed %i connections", len(connections))
+    return jsonify({'connections': connections, 'next_cursor': next_cursor})
+   
+    
+#----------------------------------------------
+
+@app.route("/nsi/stats", methods=['GET'])
+def get_stats():
+    """Statistics of the service internals
+    
+    Returns:
+        1. HTTP code 200 and JSON object containing:
+            - query_cache: hits, misses and size of the connection status cache
+                (requests coalesced with in-flight provider query are counted in 'coalesced')
+            - async_jobs: state of asynchronous connection creation workers
+            - nsi_operations: number of calls, errors and latency [sec] (mean, p50, p95, p99, max) 
+                of every NSI provider operation 
+            - nsi_client_pool: size, utilization and wait time [sec] of pool of NSI clients 
+                (only when NSI backend uses the pool)
+            - connection_states: number of connection statuses kept up to date by NSI notifications,
+                hits and misses of status reads, received and applied notifications
+            - waiting: number of requests and event streams waiting for changes and of their connections
+            - circuit_breaker: state (closed, open, half_open) of NSI provider circuit breaker, consecutive
+                failures, number of openings and of requests rejected while it was open
+            - deferred: number of deletes waiting for retry while NSI provider is unavailable,
+                retries made, completed and dropped after DEFERRED_RETRY_MAX_AGE
+            - reservation_store: number of recorded reservations, size of the log, 
+                number of group commits and compactions (log is used when RESERVATION_STORE is set)
+            - reaper: (unless RESERVATION_RETENTION is None) retention [sec], reservations waiting for
+                their end or removal, being terminated (REAPER_TERMINATE_EXPIRED), totals of expired,
+                terminated and removed ones
+            - memory: JVM heap used and its max [bytes], resident memory outside of JVM
+            - logging: number of log records waiting for the writer thread and dropped because 
+                its queue was full (only when LOG_ASYNC is set)
+            - providers: when PROVIDERS are configured, query_cache, nsi_operations, nsi_client_pool, 
+                connection_states, waiting, circuit_breaker and deferred are reported for each provider
+            - startup: readiness and timing of startup steps (see GET /nsi/ready)
+            - idempotency: number of recorded Idempotency-Key outcomes, requests which got recorded 
+                outcome, which used a key of different request or came while the first one was in progress
+            - create_pipeline: (only with CREATE_PIPELINE) creations in progress and their limit, queued events,
+                pending step timeouts, recent creations by state and totals of created, failed and aborted ones
+    """
+    stats = nsi.report()
+    stats['async_jobs'] = jobs.stats()
+    stats['reservation_store'] = store.stats()
+    if reaper:
+        stats['reaper'] = reaper.stats()
+    stats['memory'] = metrics.memory()
+    stats['startup'] = startup.report()
+    stats['idempotency'] = idempotency_keys.stats()
+    if pipeline:
+        stats['create_pipeline'] = pipeline.stats()
+    if hasattr(handler, 'stats'):
+        stats['logging'] = handler.stats()
+    return jsonify(stats)
+
+
+@app.route("/nsi/ready", methods=['GET'])
+def get_readiness():
+    """Readiness of the service for load balancers and rolling restarts
+    
+    Returns:
+        1. HTTP code 200 when the service is ready (NSI clients are constructed unless NSI_CLIENT_INIT
+            is 'lazy') and JSON object containing:
+            - ready: true
+            - error: null
+            - steps: list of startup steps with their duration [sec] ('jvm' - JVM and Jython start,
+                'imports', 'config', 'reservation_store', 'nsi_backend' (in 'eager' mode including 
+                NSI clients), 'routes', 'warm_up' - loading of reservation store and NSI clients)
+            - total: startup time [sec]
+        2. HTTP code 503 and the same JSON object (ready: false) during warm-up, 'error' is set
+            when warm-up failed
+    """
+    report = startup.report()
+    return jsonify(report), 200 if report['ready'] else 503
+
+
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+    """Metrics of the service in Prometheus text format
+    
+    Returns:
+        1. HTTP code 200 and text containing:
+            - nsi_rest_requests_total: counter of HTTP requests by method, endpoint and status code
+            - nsi_rest_requests_in_progress: number of HTTP requests being processed
+            - nsi_rest_request_duration_seconds: latency histogram of HTTP requests by endpoint
+            - nsi_rest_phase_duration_seconds: latency histogram of request processing steps 
+                (eg. prepare_nsi_attributes)
+            - nsi_operation_duration_seconds, nsi_operation_errors_total: latency histogram and errors 
+                of NSI provider operations (reserve includes commit)
+            - nsi_status_cache_entries, nsi_connection_states_entries, nsi_waiting_requests, 
+                nsi_deferred_operations, nsi_client_pool_size, nsi_client_pool_in_use, nsi_client_pool_waiting,
+                nsi_circuit_breaker_state, nsi_reservations, nsi_admitted_reservations, nsi_reaper_scheduled,
+                nsi_async_jobs_queued: sizes of tables and queues (see GET /nsi/stats)
+            - nsi_reservations_expired_total, nsi_reservations_removed_total: reservations which passed
+                their end time and finished ones removed after RESERVATION_RETENTION
+            - nsi_memory_bytes: JVM heap used and its max ('area' label), resident memory outside of JVM
+            Metrics of NSI backend have 'provider' label when PROVIDERS are configured.
+    """
+    routed = getattr(nsi, 'backends', None)
+    if routed:
+        backends = [({'provider': name}, backend) for name, backend in sorted(routed.items())]
+    else:
+        backends = [({}, nsi)]
+    text = metrics.render(request_metrics, phases, backends, store, jobs, 
+                          handler if hasattr(handler, 'stats') else None, reaper)
+    return Response(text, content_type=metrics.CONTENT_TYPE)
+    
+    
+startup.mark('routes')
+startup.warm_up(warm_up, background=CLIENT_INIT == BACKGROUND)
+
  #############################################################   
 
 if __name__ == "__main__":
-    app.logger.info("Running HTTP REST API on port %i", app.config['REST_PORT'])
-    app.run(host="0.0.0.0", port=app.config['REST_PORT'])
+    if not WORKER and app.config.get('SERVER_PROCESSES', 1) > 1:
+        if hasattr(store, 'compact'):
+            store.compact()   # log can be compacted only before workers use it
+        start_workers(app.config)
+    app.logger.info("Running HTTP REST API on port %i", app.config['REST_PORT'] + WORKER)
+    serve(app, app.config, WORKER)
 
     
 
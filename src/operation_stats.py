@@ -0,0 +1,92 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect, threading, time
+from collections import deque
+
+# upper bounds [sec] of latency histogram buckets (see histograms())
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return None
+    index = int(round(p / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class OperationStats:
+    """Counts calls and errors of operations and keeps their latest latencies for percentiles
+    and histogram of all latencies"""
+    def __init__(self, samples=10000, buckets=BUCKETS):
+        self.samples = samples
+        self.buckets = buckets
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def call(self, operation, func, *args):
+        start = time.time()
+        ok = False
+        try:
+            result = func(*args)
+            ok = True
+            return result
+        finally:
+            self.record(operation, time.time() - start, ok)
+
+    def record(self, operation, seconds, ok=True):
+        with self.lock:
+            stats = self.operations.get(operation)
+            if not stats:
+                stats = self.operations[operation] = {'count': 0, 'errors': 0, 'total': 0.0,
+                                                            'latencies': deque(maxlen=self.samples),
+                                                            'histogram': [0] * (len(self.buckets) + 1)}
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['latencies'].append(seconds)
+            stats['histogram'][bisect.bisect_left(self.buckets, seconds)] += 1
+            if not ok:
+                stats['errors'] += 1
+
+    def snapshot(self):
+        """Returns count, errors and latency [sec] summary of every operation"""
+        with self.lock:
+            operations = [(name, dict(stats, latencies=sorted(stats['latencies'])))
+                              for name, stats in self.operations.items()]
+        return dict((name, summarize(stats['count'], stats['errors'], stats['total'], stats['latencies']))
+                      for name, stats in operations)
+
+    def histograms(self):
+        """Returns count, errors, total latency [sec] and cumulative counts of latencies 
+        in BUCKETS (the last one is +Inf) of every operation"""
+        with self.lock:
+            operations = [(name, stats['count'], stats['errors'], stats['total'], list(stats['histogram']))
+                            for name, stats in self.operations.items()]
+        histograms = {}
+        for name, count, errors, total, counts in operations:
+            for i in range(1, len(counts)):
+                counts[i] += counts[i - 1]
+            histograms[name] = {'count': count, 'errors': errors, 'total': total, 'buckets': counts}
+        return histograms
+
+
+def summarize(count, errors, total, sorted_latencies):
+    return {'count': count,
+            'errors': errors,
+            'mean': total / count if count else None,
+            'p50': percentile(sorted_latencies, 50),
+            'p95': percentile(sorted_latencies, 95),
+            'p99': percentile(sorted_latencies, 99),
+            'max': sorted_latencies[-1] if sorted_latencies else None}
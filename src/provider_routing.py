@@ -0,0 +1,142 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderRouter:
+    """NSI backend (see NSIBackend) passing requests to one of several NSI providers.
+
+    providers is a list of (name, domains, backend), every backend has its own client pool,
+    timeouts and circuit breaker, the reservation store is shared. A new connection is sent
+    to the provider of its src_domain (or dst_domain when src_domain is not routed): domains
+    are exact URNs or prefixes ending with '*', exact match wins over prefix and longer prefix
+    over shorter. Connections of other domains go to the first provider without domains
+    (or the first one). Provider of a recorded connection is kept in the reservation store.
+    """
+    def __init__(self, providers, store):
+        self.store = store
+        self.backends = dict((name, backend) for name, domains, backend in providers)
+        self.exact = {}      # domain -> provider name
+        self.prefixes = []   # (prefix, provider name), the longest first
+        for name, domains, backend in providers:
+            for domain in domains:
+                if domain.endswith('*'):
+                    self.prefixes.append((domain[:-1], name))
+                elif domain not in self.exact:
+                    self.exact[domain] = name
+        self.prefixes.sort(key=lambda prefix: -len(prefix[0]))
+        defaults = [name for name, domains, backend in providers if not domains] or [providers[0][0]]
+        self.default = defaults[0]
+        self.pipelined = all(backend.pipelined for backend in self.backends.values())
+
+    def route(self, params):
+        """Returns name of the provider of connection params (see prepare_nsi_attributes)"""
+        for name in (self._match(params.get('src_domain')), self._match(params.get('dst_domain'))):
+            if name:
+                return name
+        return self.default
+
+    def provider(self, rid):
+        """Returns backend of the connection, the default one when connection is not recorded"""
+        record = self.store.get(rid)
+        if not record:
+            return self.backends[self.default]
+        return self.backends.get(record.get('provider')) or self.backends[self.route(record)]
+
+    def admit(self, params, rid=None):
+        self.backends[self.route(params)].admit(params, rid)
+
+    def reserve(self, params):
+        name = self.route(params)
+        logger.debug("Connection %s -> %s routed to provider %s", params.get('src'), params.get('dst'), name)
+        return self.backends[name].reserve(dict(params, provider=name))
+
+    def modify(self, rid, params):
+        return self.provider(rid).modify(rid, params)
+
+    def commit(self, rid):
+        self.provider(rid).commit(rid)
+
+    def abort(self, rid):
+        self.provider(rid).abort(rid)
+
+    def terminate(self, rid):
+        self.provider(rid).terminate(rid)
+
+    def provision(self, rid):
+        self.provider(rid).provision(rid)
+
+    def release(self, rid):
+        self.provider(rid).release(rid)
+
+    def delete(self, rid):
+        return self.provider(rid).delete(rid)
+
+    def discard(self, rid):
+        return self.provider(rid).discard(rid)
+
+    def send(self, operation, callback, *args):
+        if operation == 'reserve':
+            name = self.route(args[0])
+            return self.backends[name].send(operation, callback, dict(args[0], provider=name))
+        return self.provider(args[0]).send(operation, callback, *args)
+
+    def timed_out(self, operation, rid, seconds):
+        self.provider(rid).timed_out(operation, rid, seconds)
+
+    def forget(self, rid):
+        # called when the record (and so the provider) of the connection was already removed
+        for backend in self.backends.values():
+            backend.forget(rid)
+
+    def query(self, rid):
+        return self.provider(rid).query(rid)
+
+    def query_many(self, rids):
+        groups = {}
+        for rid in rids:
+            groups.setdefault(id(self.provider(rid)), []).append(rid)
+        statuses = {}
+        for group in groups.values():
+            statuses.update(self.provider(group[0]).query_many(group))
+        return statuses
+
+    def wait(self, rid, conditions, timeout, interval=10):
+        return self.provider(rid).wait(rid, conditions, timeout, interval)
+
+    def watch(self, rid, timeout, interval=10):
+        return self.provider(rid).watch(rid, timeout, interval)
+
+    def warm_up(self):
+        for backend in self.backends.values():
+            backend.warm_up()
+
+    def unavailable(self, error):
+        return any(backend.unavailable(error) for backend in self.backends.values())
+
+    def report(self):
+        return {'providers': dict((name, backend.report()) for name, backend in self.backends.items())}
+
+    def _match(self, domain):
+        if not domain:
+            return None
+        if domain in self.exact:
+            return self.exact[domain]
+        for prefix, name in self.prefixes:
+            if domain.startswith(prefix):
+                return name
+        return None
@@ -0,0 +1,132 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, threading, time
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from reservation_store import CREATED, PASSED_END_TIME, RELEASED
+from timers import Timers
+
+logger = logging.getLogger(__name__)
+
+
+class ReservationReaper:
+    """Forgets reservations 'retention' seconds after they finished, so memory of a long running
+    service doesn't grow with every connection it ever made.
+
+    Recorded reservations are checked at their end time: CREATED ones passing it are marked
+    PASSED_END_TIME (or deleted by a background thread when terminate_expired is set, see
+    NSIBackend.delete). Reservations terminated, failed, passed their end time or found finished
+    by queries (see NSIBackend.query) are removed from the reservation store 'retention' seconds
+    later. Checks are driven by changes of the store (see ReservationStore.watch) and kept in a heap
+    of due times. Only the active reaper changes records (one for a shared store), every reaper drops
+    removed reservations from its backend (see NSIBackend.forget).
+    """
+    def __init__(self, store, backend, retention=86400, terminate_expired=False, active=True):
+        self.store = store
+        self.backend = backend
+        self.retention = retention
+        self.terminate_expired = terminate_expired
+        self.active = active
+        self.scheduled = {}   # reservation ID -> time of its next check
+        self.timers = Timers('reservation-reaper')
+        self.lock = threading.Lock()
+        self.expired = self.terminated = self.removed = 0
+        self.expiring = Queue()
+        if terminate_expired and active:
+            worker = threading.Thread(target=self._terminate, name='reservation-reaper-terminate')
+            worker.daemon = True
+            worker.start()
+        store.watch(self._changed)   # also gets records loaded later from the log of the store
+
+    def stats(self):
+        with self.lock:
+            return {'retention': self.retention,
+                    'active': self.active,
+                    'scheduled': len(self.scheduled),
+                    'terminating': self.expiring.qsize(),
+                    'expired': self.expired,
+                    'terminated': self.terminated,
+                    'removed': self.removed}
+
+    def _changed(self, rid, record):
+        # called by the store with its lock held
+        if record is None:
+            with self.lock:
+                self.scheduled.pop(rid, None)
+            self.backend.forget(rid)
+        elif self.active:
+            due = self._due(record)
+            if due is not None:
+                self._schedule(rid, due)
+
+    def _due(self, record):
+        """Time of the next check of the reservation, None when it doesn't end by itself"""
+        if record['lifecycleState'] != CREATED:
+            return record.get('finished', record.get('created', 0)) + self.retention
+        end = record.get('end_sec', -1)
+        return end if end != -1 else None
+
+    def _schedule(self, rid, due):
+        with self.lock:
+            scheduled = self.scheduled.get(rid)
+            if scheduled is not None and scheduled <= due:
+                return   # checked earlier, scheduled again then
+            self.scheduled[rid] = due
+        self.timers.schedule(max(due - time.time(), 0), self._check, rid, due)
+
+    def _check(self, rid, due):
+        with self.lock:
+            if self.scheduled.get(rid) != due:
+                return   # rescheduled or removed
+            del self.scheduled[rid]
+        record = self.store.get(rid)
+        if record is None:
+            return
+        due = self._due(record)
+        if due is None:
+            return   # end time was removed by modify
+        if due > time.time():
+            self._schedule(rid, due)   # end time was extended
+        elif record['lifecycleState'] == CREATED:
+            self._expire(rid)
+        elif self.store.remove(rid):
+            logger.debug("Finished reservation %s (%s) removed", rid, record['lifecycleState'])
+            with self.lock:
+                self.removed += 1
+
+    def _expire(self, rid):
+        with self.lock:
+            self.expired += 1
+        if self.terminate_expired:
+            self.expiring.put(rid)
+        else:
+            self.store.update(rid, lifecycleState=PASSED_END_TIME, provisionState=RELEASED)
+
+    def _terminate(self):
+        while True:
+            rid = self.expiring.get()
+            try:
+                if self.backend.delete(rid):
+                    logger.info("Reservation %s passed its end time and was terminated", rid)
+                    with self.lock:
+                        self.terminated += 1
+                continue   # or deferred by the backend
+            except Exception as e:
+                logger.warning("Termination of reservation %s which passed its end time failed: %s", rid, e)
+            self.store.update(rid, lifecycleState=PASSED_END_TIME, provisionState=RELEASED)
@@ -0,0 +1,433 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json, logging, os, threading, time
+from bisect import bisect_left, insort
+
+from admission_control import AdmissionIndex
+
+logger = logging.getLogger(__name__)
+
+CREATED = 'CREATED'
+PASSED_END_TIME = 'PASSED_END_TIME'
+TERMINATED = 'TERMINATED'
+FAILED = 'FAILED'
+PROVISIONED = 'PROVISIONED'
+RELEASED = 'RELEASED'
+
+HOLD_FIELDS = ('src', 'dst', 'srcvlan', 'dstvlan', 'capacity', 'start_sec', 'end_sec')
+INDEXED_FIELDS = ('gid', 'src', 'dst', 'srcvlan', 'dstvlan', 'capacity', 'start_sec', 'end_sec', 'created',
+                  'lifecycleState')
+
+
+class ReservationStore:
+    """Reservations made by the service: request parameters, schedule, capacity and version
+    (needed by NSI modify) and the last created reservation (see DELETE /nsi/connections).
+
+    Reservations are indexed by global reservation ID, STP and time window (see find()),
+    VLANs and capacity of active reservations are indexed for admission control (see conflicts()).
+    Records are kept in memory of one process, see SharedReservationStore for many processes.
+    Records of finished reservations are removed by ReservationReaper.
+    """
+    def __init__(self):
+        self.reservations = {}
+        self.last = None
+        self.by_gid = {}     # global reservation ID -> reservation IDs
+        self.by_stp = {}     # STP -> reservation IDs
+        self.by_start = []   # (start [sec], reservation ID) sorted by start
+        self.admission = AdmissionIndex()   # VLANs and capacity of not terminated reservations
+        self.watchers = []
+        self.holds = {}   # hold ID -> params of connection being reserved, see hold()
+        self.lock = threading.RLock()
+
+    def add(self, rid, params):
+        record = {'reservation_id': rid,
+                  'gid': params['gid'],
+                  'description': params['desc'],
+                  'src': params['src'],
+                  'dst': params['dst'],
+                  'src_domain': params.get('src_domain'),
+                  'src_port': params.get('src_port'),
+                  'dst_domain': params.get('dst_domain'),
+                  'dst_port': params.get('dst_port'),
+                  'srcvlan': params['srcvlan'],
+                  'dstvlan': params['dstvlan'],
+                  'capacity': params['capacity'],
+                  'start_sec': params['start_sec'],
+                  'end_sec': params['end_sec'],
+                  'explicit_routes': params.get('explicit_routes'),
+                  'provider': params.get('provider'),   # name of the provider when PROVIDERS are routed
+                  'version': 0,
+                  'lifecycleState': CREATED,
+                  'provisionState': RELEASED,
+                  'created': time.time()}
+        self._write({'rid': rid, 'set': record})
+
+    def update(self, rid, **changes):
+        """Changes the reservation record, returns False when reservation is unknown"""
+        with self.lock:
+            self._read()
+            record = self.reservations.get(rid)
+            if record is None:
+                return False
+            if changes.get('lifecycleState', CREATED) != CREATED and 'finished' not in record:
+                changes['finished'] = time.time()
+        self._write({'rid': rid, 'set': changes})
+        return True
+
+    def remove(self, rid):
+        """Forgets the reservation, returns False when reservation is unknown"""
+        with self.lock:
+            self._read()
+            if rid not in self.reservations:
+                return False
+        self._write({'rid': rid, 'delete': True})
+        return True
+
+    def watch(self, func):
+        """func(rid, record) is called after every change of a reservation (also made by other processes),
+        record is None when the reservation was removed. It is called with the lock held, so it must be short."""
+        self.watchers.append(func)
+
+    def get(self, rid):
+        """Returns copy of the reservation record, None when reservation is unknown"""
+        with self.lock:
+            self._read()
+            record = self.reservations.get(rid)
+            return dict(record) if record else None
+
+    def get_many(self, rids):
+        """Returns copies of records of known reservations among rids, in their order"""
+        with self.lock:
+            self._read()
+            return [dict(self.reservations[rid]) for rid in rids if rid in self.reservations]
+
+    def find(self, gid=None, stp=None, start=None, end=None):
+        """Returns copies of records of reservations having given global reservation ID, using given STP
+        and overlapping time window from start to end [sec] (criteria which are None are not checked)"""
+        with self.lock:
+            self._read()
+            candidates = []
+            if gid is not None:
+                candidates.append(self.by_gid.get(gid, ()))
+            if stp is not None:
+                candidates.append(self.by_stp.get(stp, ()))
+            if end is not None:
+                # reservations starting before the end of time window
+                candidates.append([rid for _, rid in self.by_start[:bisect_left(self.by_start, (end, ''))]])
+            if not candidates:
+                candidates.append(self.reservations)
+            rids = min(candidates, key=len)
+
+            records = []
+            for rid in rids:
+                record = self.reservations[rid]
+                if gid is not None and record['gid'] != gid:
+                    continue
+                if stp is not None and stp not in (record['src'], record['dst']):
+                    continue
+                if end is not None and not _start(record) < end:
+                    continue
+                if start is not None and not _end(record) > start:
+                    continue
+                records.append(dict(record))
+            return records
+
+    def conflicts(self, params, port_capacity=None, ignore=None):
+        """Returns descriptions of conflicts of requested connection with VLANs or port capacity (dict
+        of STP -> capacity) used by not terminated reservations, except 'ignore' reservation ID"""
+        with self.lock:
+            self._read()
+            return self.admission.conflicts(params, port_capacity, ignore)
+
+    def hold(self, hold, params, port_capacity=None, ignore=None):
+        """Checks conflicts of requested connection like conflicts() and when there are none indexes its VLANs
+        and capacity as 'hold' ID until unhold(), atomically, so concurrent requests aren't admitted for the same
+        VLANs while the provider processes the reservation. Returns descriptions of conflicts.
+        Holds are kept in memory of the process (see SharedReservationStore for holds shared by processes)."""
+        with self.lock:
+            self._read()
+            conflicts = self.admission.conflicts(params, port_capacity, ignore)
+            if not conflicts:
+                record = dict(params, created=time.time())
+                self.admission.add(hold, record)
+                self.holds[hold] = record
+            return conflicts
+
+    def unhold(self, hold):
+        with self.lock:
+            record = self.holds.pop(hold, None)
+            if record is not None:
+                self.admission.remove(hold, record)
+
+    def set_last(self, rid):
+        self._write({'last': rid})
+
+    def get_last(self):
+        with self.lock:
+            self._read()
+            return self.last
+
+    def stats(self):
+        with self.lock:
+            return {'reservations': len(self.reservations),
+                    'admitted': self.admission.size,
+                    'held': len(self.holds)}
+
+    def _write(self, entry):
+        with self.lock:
+            self._apply(entry)
+
+    def _read(self):
+        pass
+
+    def _apply(self, entry):
+        if 'last' in entry:
+            self.last = entry['last']
+            return
+        rid = entry['rid']
+        if entry.get('delete'):
+            record = self.reservations.pop(rid, None)
+            if record is not None:
+                self._unindex(rid, record)
+                self._notify(rid, None)
+            return
+        changes = entry['set']
+        record = self.reservations.get(rid)
+        if record is None:
+            record = self.reservations[rid] = {}
+        elif any(name in changes for name in INDEXED_FIELDS):
+            self._unindex(rid, record)
+        else:
+            record.update(changes)
+            self._notify(rid, record)
+            return
+        record.update(changes)
+        self._index(rid, record)
+        self._notify(rid, record)
+
+    def _notify(self, rid, record):
+        for func in self.watchers:
+            try:
+                func(rid, dict(record) if record is not None else None)
+            except Exception:
+                import traceback
+                logger.error(traceback.format_exc())
+
+    def _index(self, rid, record):
+        if 'gid' in record:
+            self.by_gid.setdefault(record['gid'], set()).add(rid)
+        for stp in set((record.get('src'), record.get('dst'))) - set([None]):
+            self.by_stp.setdefault(stp, set()).add(rid)
+        if 'start_sec' in record:
+            insort(self.by_start, (_start(record), rid))
+        if _admitted(record):
+            self.admission.add(rid, record)
+
+    def _unindex(self, rid, record):
+        _discard(self.by_gid, record.get('gid'), rid)
+        for stp in (record.get('src'), record.get('dst')):
+            _discard(self.by_stp, stp, rid)
+        if 'start_sec' in record:
+            key = (_start(record), rid)
+            i = bisect_left(self.by_start, key)
+            if i < len(self.by_start) and self.by_start[i] == key:
+                del self.by_start[i]
+        if _admitted(record):
+            self.admission.remove(rid, record)
+
+
+class SharedReservationStore(ReservationStore):
+    """Durable reservation store, also shared by worker processes of the service through the file.
+
+    Every change is appended as one JSON line to the file (log), before reading or writing a process
+    applies the changes appended by other processes since its previous access, so the log is loaded
+    lazily by the first access after start. Changes made concurrently by many threads are written
+    and synced to disk together (group commit). Concurrent modifications of the same reservation
+    are serialized by NSI provider (stale versions are rejected).
+
+    The log is compacted (only the latest state of every reservation is kept) by compact(),
+    which is run automatically when 'exclusive' process is the only user of the log.
+
+    Unless the process is 'exclusive', holds of admission control (see hold()) are appended to the log
+    too and every process decides them in the order of the log, so requests of different processes
+    aren't admitted for the same VLANs. Holds not released in hold_ttl seconds (by a process which
+    ended meanwhile) are dropped by the next hold.
+    """
+    def __init__(self, path, sync=True, exclusive=True, compact_ratio=4, compact_min=10000, hold_ttl=600):
+        ReservationStore.__init__(self)
+        self.path = path
+        self.sync = sync
+        self.exclusive = exclusive
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self.offset = 0
+        self.entries = 0   # number of entries in the log
+        self.log = open(path, 'ab')   # appends are atomic, so processes don't overwrite each other
+        self.pending = []  # entries waiting for group commit
+        self.written = self.committed = 0   # sequence numbers of entries
+        self.commit_lock = threading.Lock()
+        self.commits = self.compactions = 0
+        self.hold_ttl = hold_ttl
+        self.requested = {}   # hold ID -> conflicts found when the hold of this process was read from the log
+
+    def hold(self, hold, params, port_capacity=None, ignore=None):
+        if self.exclusive:
+            return ReservationStore.hold(self, hold, params, port_capacity, ignore)
+        params = dict((name, params[name]) for name in HOLD_FIELDS)
+        capacity = dict((stp, limit) for stp, limit in (port_capacity or {}).items()
+                        if stp in (params['src'], params['dst']))
+        with self.lock:
+            self.requested[hold] = None
+        try:
+            self._write({'hold': hold, 'params': params, 'port_capacity': capacity, 'ignore': ignore,
+                         'created': time.time()})
+        finally:
+            with self.lock:
+                conflicts = self.requested.pop(hold)
+        return conflicts
+
+    def unhold(self, hold):
+        if self.exclusive:
+            ReservationStore.unhold(self, hold)
+        else:
+            self._write({'unhold': hold})
+
+    def _write(self, entry):
+        with self.lock:
+            self.pending.append((json.dumps(entry, sort_keys=True) + '\n').encode('utf-8'))
+            self.written += 1
+            sequence = self.written
+
+        with self.commit_lock:   # the first waiting thread writes entries of all the others
+            if self.committed >= sequence:
+                return
+            with self.lock:
+                lines, self.pending = self.pending, []
+                last = self.written
+            self.log.write(b''.join(lines))
+            self.log.flush()
+            if self.sync:
+                os.fsync(self.log.fileno())
+            with self.lock:
+                self.commits += 1
+                self.committed = last
+                self._read()   # also applies entries written now
+                if self.exclusive and self.entries > max(self.compact_min, self.compact_ratio * len(self.reservations)):
+                    self._compact_locked()   # commit_lock is held, entries written meanwhile wait in 'pending'
+
+    def _read(self):
+        if os.path.getsize(self.path) <= self.offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1   # line being written by another process is read next time
+        for line in data[:end].splitlines():
+            try:
+                self._apply(json.loads(line.decode('utf-8')))
+                self.entries += 1
+            except ValueError:
+                logger.error("Skipping corrupted reservation store entry: %r", line)
+        self.offset += end
+
+    def _apply(self, entry):
+        if 'hold' in entry:
+            self._apply_hold(entry)
+        elif 'unhold' in entry:
+            ReservationStore.unhold(self, entry['unhold'])
+        else:
+            ReservationStore._apply(self, entry)
+
+    def _apply_hold(self, entry):
+        # decided by the state of the log before the entry, the same way by every process
+        params = dict(entry['params'], created=entry['created'])
+        for hold, record in list(self.holds.items()):
+            if record['created'] < entry['created'] - self.hold_ttl:
+                logger.warning("Dropping hold %s not released in %s sec", hold, self.hold_ttl)
+                ReservationStore.unhold(self, hold)
+        conflicts = self.admission.conflicts(params, entry['port_capacity'], entry['ignore'])
+        if not conflicts:
+            self.admission.add(entry['hold'], params)
+            self.holds[entry['hold']] = params
+        if entry['hold'] in self.requested:
+            self.requested[entry['hold']] = conflicts
+
+    def compact(self):
+        """Rewrites the log keeping only the latest state of reservations, must not be run
+        when other processes use the log"""
+        with self.commit_lock:
+            with self.lock:
+                self._compact_locked()
+
+    def _compact_locked(self):
+        # commit_lock and lock must be held
+        self._read()
+        entries = [{'rid': rid, 'set': record} for rid, record in self.reservations.items()]
+        if self.last:
+            entries.append({'last': self.last})
+        temporary = self.path + '.compacting'
+        with open(temporary, 'wb') as f:
+            for entry in entries:
+                f.write((json.dumps(entry, sort_keys=True) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        self.log.close()
+        os.rename(temporary, self.path)
+        self.log = open(self.path, 'ab')
+        logger.info("Reservation store compacted from %i to %i entries", self.entries, len(entries))
+        self.offset = os.path.getsize(self.path)
+        self.entries = len(entries)
+        self.compactions += 1
+
+    def stats(self):
+        stats = ReservationStore.stats(self)
+        with self.lock:
+            stats.update({'log_entries': self.entries,
+                    'log_size': self.offset,
+                    'commits': self.commits,
+                    'written': self.written,
+                    'compactions': self.compactions})
+        return stats
+
+
+def _start(record):
+    # -1 means not specified: from reservation time / without end
+    return record['start_sec'] if record['start_sec'] != -1 else int(record.get('created', 0))
+
+
+def _end(record):
+    return record['end_sec'] if record['end_sec'] != -1 else float('inf')
+
+
+def _admitted(record):
+    return record.get('lifecycleState') == CREATED and 'srcvlan' in record
+
+
+def _discard(index, key, rid):
+    rids = index.get(key)
+    if rids is not None:
+        rids.discard(rid)
+        if not rids:
+            del index[key]
+
+
+def create_store(config, exclusive=True):
+    """Creates reservation store selected by RESERVATION_STORE configuration option"""
+    path = config.get('RESERVATION_STORE')
+    if not path:
+        return ReservationStore()
+    logger.info("Using reservation store %s", path)
+    return SharedReservationStore(path, config.get('RESERVATION_STORE_SYNC', True), exclusive,
+                                  hold_ttl=config.get('RESERVATION_HOLD_TTL', 600))
@@ -0,0 +1,89 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq, logging, threading, time
+
+logger = logging.getLogger(__name__)
+
+
+class RetryQueue:
+    """Calls func(key) in a background thread until it succeeds (eg. deletes of connections
+    which failed while NSI provider was unavailable).
+
+    The first retry is made after 'interval' seconds, every next one after doubled interval
+    (up to max_interval). Keys failing for longer than max_age seconds are dropped.
+    """
+    def __init__(self, func, interval=30, max_interval=600, max_age=86400, max_size=10000, name='retries'):
+        self.func = func
+        self.interval = interval
+        self.max_interval = max_interval
+        self.max_age = max_age
+        self.max_size = max_size
+        self.name = name
+        self.pending = {}   # key -> (time of adding, current interval)
+        self.due = []       # heap of (time of next retry, key)
+        self.condition = threading.Condition()
+        self.thread = None
+        self.completed = self.retries = self.dropped = 0
+
+    def add(self, key, delay=None):
+        """Schedules retries of func(key), the first one after 'delay' seconds (default 'interval'),
+        returns False when the queue is full"""
+        with self.condition:
+            if key in self.pending:
+                return True
+            if len(self.pending) >= self.max_size:
+                return False
+            self.pending[key] = (time.time(), self.interval)
+            heapq.heappush(self.due, (time.time() + (self.interval if delay is None else delay), key))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=self.name)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.due or self.due[0][0] > time.time():
+                    self.condition.wait(max(self.due[0][0] - time.time(), 0) if self.due else None)
+                key = heapq.heappop(self.due)[1]
+            try:
+                self.func(key)
+                ok = True
+            except Exception as e:
+                ok = False
+                logger.warning("Retry of %s failed: %s", key, e)
+            with self.condition:
+                added, interval = self.pending[key]
+                self.retries += 1
+                if ok:
+                    self.completed += 1
+                    del self.pending[key]
+                elif time.time() - added > self.max_age:
+                    self.dropped += 1
+                    del self.pending[key]
+                    logger.error("Giving up retries of %s after %i sec", key, self.max_age)
+                else:
+                    interval = min(interval * 2, self.max_interval)
+                    self.pending[key] = (added, interval)
+                    heapq.heappush(self.due, (time.time() + interval, key))
+
+    def stats(self):
+        with self.condition:
+            return {'size': len(self.pending),
+                    'retries': self.retries,
+                    'completed': self.completed,
+                    'dropped': self.dropped}
@@ -0,0 +1,67 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit, logging, os, signal, subprocess, sys
+
+logger = logging.getLogger(__name__)
+
+WORKER_VARIABLE = 'NSI_CONNECTIONS_WORKER'
+
+
+def worker_number():
+    """Number of this worker process, 0 for the process started by the user"""
+    return int(os.environ.get(WORKER_VARIABLE, 0))
+
+
+def start_workers(config):
+    """Starts worker processes 1 .. SERVER_PROCESSES-1 running the same script as this process"""
+    workers = []
+    for number in range(1, config.get('SERVER_PROCESSES', 1)):
+        env = dict(os.environ)
+        env[WORKER_VARIABLE] = str(number)
+        workers.append(subprocess.Popen([sys.executable] + sys.argv, env=env))
+        logger.info("Started worker process %i (pid %s)", number, workers[-1].pid)
+
+    def stop_workers():
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+    atexit.register(stop_workers)
+    if workers:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))   # atexit isn't run when killed
+    return workers
+
+
+def serve(app, config, worker=0):
+    """Runs HTTP server selected by SERVER option, worker processes listen on subsequent ports"""
+    port = config['REST_PORT'] + worker
+    server = config.get('SERVER', 'development')
+    logger.info("Running %s HTTP server of worker %i on port %i", server, worker, port)
+
+    if server == 'development':
+        # requests are handled in separate threads (Jython threads run in parallel, there is no GIL)
+        app.run(host="0.0.0.0", port=port, threaded=True)
+    elif server == 'cheroot':
+        try:
+            from cheroot.wsgi import Server as WSGIServer
+        except ImportError:
+            from cherrypy.wsgiserver import CherryPyWSGIServer as WSGIServer   # older CherryPy installations
+        httpd = WSGIServer(('0.0.0.0', port), app, numthreads=config.get('SERVER_THREADS', 32),
+                           request_queue_size=config.get('SERVER_BACKLOG', 128))
+        try:
+            httpd.start()
+        finally:
+            httpd.stop()
+    else:
+        raise ValueError("Unknown HTTP server '%s'" % server)
@@ -0,0 +1,319 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, random, threading, time, uuid
+from datetime import datetime
+
+from nsi_backend import NSIBackend
+from deadlines import DeadlineExceeded, remaining
+from timers import Timers
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ('reserve', 'commit', 'abort', 'modify', 'provision', 'release', 'terminate', 'query')
+
+SERVICE_TYPE = 'http://services.ogf.org/nsi/2013/12/descriptions/EVTS.A-GOLE'
+
+
+class SimulatedFailure(Exception):
+    pass
+
+
+class SimulatedOutage(SimulatedFailure):
+    """Random failure of an operation, like unavailable NSI provider"""
+
+
+class SimulatedNSI(NSIBackend):
+    """In-process stand-in of NSI provider for testing REST API without BoD network.
+
+    Keeps reservation, provision and lifecycle states of connections in memory (values as returned
+    by NSI query, see GET /nsi/connections/<reservation_id>). Every operation sleeps for its configured
+    latency (seconds, number or [min, max] range) and fails with configured probability (0.0 - 1.0).
+    Reservations of the same VLAN on the same port in overlapping time are rejected.
+    Data plane changes are notified like dataPlaneStateChange notifications of NSI provider.
+    Operations sleep only until deadline of the calling thread, like NSI client interrupted then.
+    Operations sent by send() are confirmed after their latency by a background thread, like
+    replies of NSI provider received by requester.
+    """
+    pipelined = True
+
+    def __init__(self, latency={}, failure_rate={}, requester_nsa='urn:ogf:network:simulated:nsa', **options):
+        NSIBackend.__init__(self, **options)   # see NSIBackend for options
+        for operation in list(latency) + list(failure_rate):
+            if operation not in OPERATIONS:
+                raise ValueError("Unknown simulated NSI operation '%s'" % operation)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requester_nsa = requester_nsa
+        self.connections = {}
+        self.ports = {}   # STP -> reservation IDs using it
+        self.uncommitted = set()   # IDs of new reservations held until commit or abort
+        self.replies = Timers('simulated-nsi-replies')
+        self.lock = threading.Lock()
+
+    def _reserve(self, params):
+        self._simulate('reserve')
+        with self.lock:
+            self._check_conflicts(params)
+            rid = self._add(params, 'RESERVE_HELD')
+        try:
+            self._commit(rid)
+        except DeadlineExceeded as e:
+            e.connection_id = rid   # reservation is held until aborted
+            raise
+        return rid
+
+    def _send(self, operation, callback, *args):
+        latency = self._latency(operation)
+        self._fail(operation)
+        if operation == 'reserve':
+            with self.lock:
+                rid = self._add(args[0], 'RESERVE_CHECKING')
+        else:
+            rid = args[0]
+        self.replies.schedule(latency, self._reply, operation, rid, callback)
+        return rid
+
+    def _reply(self, operation, rid, callback):
+        confirm = {'reserve': self._checked, 'commit': self._committed,
+                   'abort': self._aborted, 'provision': self._provisioned}[operation]
+        try:
+            confirm(rid)
+        except SimulatedFailure as e:
+            callback(str(e))
+        else:
+            callback(None)
+
+    def _add(self, params, state):
+        # lock must be held
+        rid = 'urn:uuid:%s' % uuid.uuid4()
+        self.connections[rid] = {'params': dict(params),
+                                 'active': 'false',
+                                 'connectionId': rid,
+                                 'description': params['desc'],
+                                 'globalReservationId': params['gid'],
+                                 'lifecycleState': 'CREATED',
+                                 'notificationId': 0,
+                                 'provisionState': 'RELEASED',
+                                 'requesterNSA': self.requester_nsa,
+                                 'reservationState': state,
+                                 'version': 0,
+                                 'versionConsistent': 'true'}
+        if state == 'RESERVE_HELD':
+            self._hold(rid)
+        return rid
+
+    def _hold(self, rid):
+        params = self.connections[rid]['params']
+        for port in (params['src'], params['dst']):
+            self.ports.setdefault(port, set()).add(rid)
+        self.uncommitted.add(rid)
+
+    def _checked(self, rid):
+        with self.lock:
+            connection = self._get(rid)
+            try:
+                self._check_conflicts(connection['params'])
+            except SimulatedFailure:
+                connection['reservationState'] = 'RESERVE_FAILED'
+                raise
+            connection['reservationState'] = 'RESERVE_HELD'
+            self._hold(rid)
+
+    def _modify(self, rid, params):
+        self._simulate('modify')
+        with self.lock:
+            connection = self._get(rid)
+            connection['params']['end_sec'] = params['ep_end']
+            connection['params']['capacity'] = params.get('capacity', connection['params']['capacity'])
+            connection['version'] += 1
+            connection['reservationState'] = 'RESERVE_HELD'
+            version = connection['version']
+        self._commit(rid)
+        self.store.update(rid, version=version)   # as confirmed by NSI provider
+        return rid
+
+    def _commit(self, rid):
+        self._simulate('commit')
+        self._committed(rid)
+
+    def _committed(self, rid):
+        self._change(rid, 'reservationState', 'RESERVE_HELD', 'RESERVE_START')
+        with self.lock:
+            self.uncommitted.discard(rid)
+
+    def _abort(self, rid):
+        self._simulate('abort')
+        self._aborted(rid)
+
+    def _aborted(self, rid):
+        self._change(rid, 'reservationState', ('RESERVE_HELD', 'RESERVE_FAILED'), 'RESERVE_START')
+        with self.lock:
+            if rid in self.uncommitted:   # aborted new reservation doesn't use its ports
+                self.uncommitted.discard(rid)
+                for port in self.ports.values():
+                    port.discard(rid)
+
+    def _provision(self, rid):
+        self._simulate('provision')
+        self._provisioned(rid)
+
+    def _provisioned(self, rid):
+        self._change(rid, 'provisionState', 'RELEASED', 'PROVISIONED')
+
+    def _release(self, rid):
+        self._simulate('release')
+        self._change(rid, 'provisionState', 'PROVISIONED', 'RELEASED')
+
+    def _terminate(self, rid):
+        self._simulate('terminate')
+        with self.lock:
+            connection = self._get(rid)
+            connection['lifecycleState'] = 'TERMINATED'
+            connection['provisionState'] = 'RELEASED'
+            connection['active'] = 'false'
+            connection['notificationId'] += 1
+            for port in (connection['params']['src'], connection['params']['dst']):
+                self.ports.get(port, set()).discard(rid)
+
+    def forget(self, rid):
+        NSIBackend.forget(self, rid)
+        with self.lock:
+            connection = self.connections.pop(rid, None)
+            self.uncommitted.discard(rid)
+            if connection:
+                for port in (connection['params']['src'], connection['params']['dst']):
+                    _discard(self.ports, port, rid)
+
+    def _query(self, rid):
+        self._simulate('query')
+        with self.lock:
+            connection = self.connections.get(rid)
+            if not connection:
+                return {}
+            self._check_end_time(connection)
+            status = dict((name, str(value)) for name, value in connection.items() if name != 'params')
+            status.update(self._summary(connection))
+        return status
+
+    def _unavailable(self, error):
+        return isinstance(error, SimulatedOutage)
+
+    def _summary(self, connection):
+        """Typed criteria and connection states, as returned by NSI2Interface.querySummaries"""
+        params = connection['params']
+        p2ps = {'capacity': params['capacity'],
+                'directionality': 'Bidirectional',
+                'symmetricPath': True,
+                'sourceSTP': '%s?vlan=%s' % (params['src'], params['srcvlan']),
+                'destSTP': '%s?vlan=%s' % (params['dst'], params['dstvlan']),
+                'ero': list(params.get('explicit_routes') or [])}
+        return {'criteria': [{'version': connection['version'],
+                              'serviceType': SERVICE_TYPE,
+                              'schedule': {'startTime': _iso(params['start_sec']),
+                                           'endTime': _iso(params['end_sec'])},
+                              'p2ps': p2ps,
+                              'children': []}],
+                'connectionStates': {'reservationState': connection['reservationState'],
+                                     'provisionState': connection['provisionState'],
+                                     'lifecycleState': connection['lifecycleState'],
+                                     'dataPlaneStatus': {'active': connection['active'] == 'true',
+                                                         'version': connection['version'],
+                                                         'versionConsistent': True}}}
+
+    def _simulate(self, operation):
+        latency = self._latency(operation)
+        left = remaining()
+        if left is not None and left < latency:
+            time.sleep(max(left, 0))
+            raise DeadlineExceeded("Deadline of %s exceeded" % operation)
+        if latency:
+            time.sleep(latency)
+        self._fail(operation)
+
+    def _latency(self, operation):
+        latency = self.latency.get(operation, 0)
+        if isinstance(latency, (list, tuple)):
+            latency = random.uniform(*latency)
+        return latency
+
+    def _fail(self, operation):
+        if random.random() < self.failure_rate.get(operation, 0):
+            logger.debug("Simulated failure of %s", operation)
+            raise SimulatedOutage("Simulated failure of %s" % operation)
+
+    def _get(self, rid):
+        connection = self.connections.get(rid)
+        if not connection:
+            raise SimulatedFailure("No such reservation, id=%s" % rid)
+        self._check_end_time(connection)
+        if connection['lifecycleState'] != 'CREATED':
+            raise SimulatedFailure("Reservation %s is in state %s" % (rid, connection['lifecycleState']))
+        return connection
+
+    def _change(self, rid, state, old, new):
+        with self.lock:
+            connection = self._get(rid)
+            expected = old if isinstance(old, tuple) else (old,)
+            if connection[state] not in expected:
+                raise SimulatedFailure("Reservation %s %s is %s, expected %s" % (rid, state, connection[state],
+                                                                                 ' or '.join(expected)))
+            connection[state] = new
+            active = 'true' if connection['provisionState'] == 'PROVISIONED' else 'false'
+            changed = active != connection['active']
+            connection['active'] = active
+            connection['notificationId'] += 1
+            notification_id, version = connection['notificationId'], connection['version']
+        if changed:   # sent by NSI provider to requester as dataPlaneStateChange
+            self.notify(rid, notification_id, data_plane={'active': active == 'true', 'version': version,
+                                                          'versionConsistent': True})
+
+    def _check_end_time(self, connection):
+        end_sec = connection['params']['end_sec']
+        if connection['lifecycleState'] == 'CREATED' and 0 < end_sec <= time.time():
+            connection['lifecycleState'] = 'PASSED_END_TIME'
+            connection['provisionState'] = 'RELEASED'
+            connection['active'] = 'false'
+
+    def _check_conflicts(self, params):
+        for port, vlan in ((params['src'], params['srcvlan']), (params['dst'], params['dstvlan'])):
+            for rid in self.ports.get(port, ()):
+                connection = self.connections[rid]
+                self._check_end_time(connection)
+                other = connection['params']
+                if connection['lifecycleState'] != 'CREATED' or not _overlap(params, other):
+                    continue
+                if (other['src'], other['srcvlan']) == (port, vlan) or (other['dst'], other['dstvlan']) == (port, vlan):
+                    raise SimulatedFailure("VLAN %s on %s already reserved by %s" % (vlan, port, rid))
+
+
+def _discard(ports, port, rid):
+    rids = ports.get(port)
+    if rids is not None:
+        rids.discard(rid)
+        if not rids:
+            del ports[port]
+
+
+def _iso(seconds):
+    if seconds == -1:
+        return None
+    return datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _overlap(params, other):
+    # -1 means not specified: from now / without end
+    start, end = params['start_sec'], params['end_sec'] if params['end_sec'] > 0 else float('inf')
+    other_start, other_end = other['start_sec'], other['end_sec'] if other['end_sec'] > 0 else float('inf')
+    return start < other_end and other_start < end
@@ -0,0 +1,98 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, threading, time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# modes of NSI client initialisation (NSI_CLIENT_INIT option)
+EAGER = 'eager'             # clients are constructed before the service starts listening
+BACKGROUND = 'background'   # clients are constructed by warm-up thread, the service is not ready until then
+LAZY = 'lazy'               # clients are constructed by the first request using them
+MODES = (EAGER, BACKGROUND, LAZY)
+
+
+def _jvm_start():
+    """Start time [sec since epoch] of the JVM running Jython, None in other interpreters"""
+    try:
+        from java.lang.management import ManagementFactory
+    except ImportError:
+        return None
+    return ManagementFactory.getRuntimeMXBean().getStartTime() / 1000.0
+
+
+class Startup:
+    """Timing of startup steps of the service and its readiness (see GET /nsi/ready).
+
+    Steps are timed from 'started' (time of the first import of the service), time spent by JVM
+    and Jython before is reported as 'jvm' step.
+    """
+    def __init__(self, started=None):
+        self.started = started or time.time()
+        self.steps = []   # (name, seconds) in order of execution
+        self.error = None
+        self.ready = threading.Event()
+        jvm_start = _jvm_start()
+        if jvm_start and jvm_start < self.started:
+            self.steps.append(('jvm', self.started - jvm_start))
+        self.last = self.started
+
+    @contextmanager
+    def step(self, name):
+        """Times the block as a startup step"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.time() - start))
+            self.last = time.time()
+
+    def mark(self, name):
+        """Records time since the previous step (or start) as a step, eg. of imports"""
+        now = time.time()
+        self.steps.append((name, now - self.last))
+        self.last = now
+
+    def warm_up(self, func, background=False):
+        """Calls func as 'warm_up' step, now or in a background thread; the service is ready
+        when it succeeds"""
+        if not background:
+            self._warm_up(func)
+            return
+        thread = threading.Thread(target=self._warm_up, args=(func,), name='warm-up')
+        thread.daemon = True
+        thread.start()
+
+    def _warm_up(self, func):
+        try:
+            with self.step('warm_up'):
+                func()
+        except Exception as e:
+            import traceback
+            logger.error(traceback.format_exc())
+            self.error = str(e) or e.__class__.__name__
+            return
+        self.ready.set()
+        logger.info("Service ready after %.1f sec: %s", self.elapsed(),
+                    ', '.join('%s %.2f' % step for step in self.steps))
+
+    def elapsed(self):
+        return sum(seconds for name, seconds in self.steps if name == 'jvm') + self.last - self.started
+
+    def report(self):
+        return {'ready': self.ready.is_set(),
+                'error': self.error,
+                'steps': [{'name': name, 'seconds': seconds} for name, seconds in self.steps],
+                'total': self.elapsed()}
@@ -0,0 +1,171 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading, time
+from collections import OrderedDict
+
+
+class _Flight:
+    """Provider call in progress, shared by all concurrent queries for the same key"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class StatusCache:
+    """LRU cache of connection statuses with time-to-live and single-flight loading.
+
+    Empty statuses (connection not found) are cached for 'negative_ttl' seconds.
+    Concurrent lookups of a key which is not cached wait for the one provider call
+    made by the first of them, instead of calling the provider on their own.
+    ttl=0 disables caching but still coalesces concurrent lookups.
+    """
+    def __init__(self, ttl=5, max_size=10000, negative_ttl=None):
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()   # key -> (expiration time, value), the least recently used first
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.hits = self.negative_hits = self.misses = self.coalesced = self.evictions = 0
+
+    def get(self, key, loader):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry and entry[0] > time.time():
+                self.entries[key] = entry
+                self.hits += 1
+                if not entry[1]:
+                    self.negative_hits += 1
+                return self._copy(entry[1])
+
+            flight = self.flights.get(key)
+            if flight:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                flight = self.flights[key] = _Flight()
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return self._copy(flight.value)
+
+        try:
+            flight.value = loader(key)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                if not flight.error and not flight.stale:
+                    self._store(key, flight.value)
+            flight.done.set()
+        return self._copy(flight.value)
+
+    def get_many(self, keys, loader):
+        """Returns dict of values of all keys, values which are not cached are loaded by one
+        loader(keys) call returning dict of found values (missing keys get empty value {})"""
+        results, waiting, leading = {}, {}, {}
+        with self.lock:
+            now = time.time()
+            for key in keys:
+                if key in results or key in waiting or key in leading:
+                    continue
+                entry = self.entries.pop(key, None)
+                if entry and entry[0] > now:
+                    self.entries[key] = entry
+                    self.hits += 1
+                    if not entry[1]:
+                        self.negative_hits += 1
+                    results[key] = self._copy(entry[1])
+                elif key in self.flights:
+                    self.coalesced += 1
+                    waiting[key] = self.flights[key]
+                else:
+                    self.misses += 1
+                    leading[key] = self.flights[key] = _Flight()
+
+        if leading:
+            values, error = {}, None
+            try:
+                values = loader(list(leading))
+            except Exception as e:
+                error = e
+            with self.lock:
+                for key, flight in leading.items():
+                    del self.flights[key]
+                    flight.error = error
+                    flight.value = values.get(key, {})
+                    if not error and not flight.stale:
+                        self._store(key, flight.value)
+            for flight in leading.values():
+                flight.done.set()
+            if error:
+                raise error
+            for key, flight in leading.items():
+                results[key] = self._copy(flight.value)
+
+        for key, flight in waiting.items():
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            results[key] = self._copy(flight.value)
+        return results
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            flight = self.flights.get(key)
+            if flight:
+                flight.stale = True  # its result may be older than the change which caused invalidation
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            for flight in self.flights.values():
+                flight.stale = True
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries),
+                    'max_size': self.max_size,
+                    'ttl': self.ttl,
+                    'negative_ttl': self.negative_ttl,
+                    'hits': self.hits,
+                    'negative_hits': self.negative_hits,
+                    'misses': self.misses,
+                    'coalesced': self.coalesced,
+                    'evictions': self.evictions,
+                    'in_flight': len(self.flights)}
+
+    def _store(self, key, value):
+        ttl = self.ttl if value else self.negative_ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        self.entries[key] = (time.time() + ttl, value)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def _copy(value):
+        # callers are free to modify returned statuses
+        return dict(value) if isinstance(value, dict) else value
@@ -0,0 +1,88 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from contextlib import contextmanager
+
+# lifecycle states after which the connection doesn't change any more
+FINAL_STATES = ('FAILED', 'PASSED_END_TIME', 'TERMINATED')
+
+
+class WaitError(ValueError):
+    pass
+
+
+class _Watch:
+    """Threads waiting for a change of one connection"""
+    def __init__(self, lock):
+        self.condition = threading.Condition(lock)
+        self.generation = 0   # number of changes
+        self.count = 0        # number of waiting threads
+
+    def wait(self, seen, timeout):
+        """Waits up to timeout [sec] unless the connection changed after 'seen' generation"""
+        with self.condition:
+            if self.generation == seen:
+                self.condition.wait(timeout)
+
+
+class ChangeNotifier:
+    """Wakes up threads waiting for changes of connections (see NSIBackend.wait)"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.watches = {}   # reservation ID -> _Watch
+
+    @contextmanager
+    def watching(self, rid):
+        with self.lock:
+            watch = self.watches.get(rid)
+            if watch is None:
+                watch = self.watches[rid] = _Watch(self.lock)
+            watch.count += 1
+        try:
+            yield watch
+        finally:
+            with self.lock:
+                watch.count -= 1
+                if not watch.count:
+                    del self.watches[rid]
+
+    def changed(self, rid):
+        with self.lock:
+            watch = self.watches.get(rid)
+            if watch:
+                watch.generation += 1
+                watch.condition.notify_all()
+
+    def stats(self):
+        with self.lock:
+            return {'connections': len(self.watches),
+                    'waiting': sum(watch.count for watch in self.watches.values())}
+
+
+def parse_conditions(text):
+    """Parses comma separated attribute:value conditions of wait_for argument
+    (eg. 'provisionState:PROVISIONED,active:true'), raises WaitError when incorrect"""
+    conditions = []
+    for condition in text.split(','):
+        name, _, value = condition.strip().partition(':')
+        if not name or not value:
+            raise WaitError("Incorrect wait condition '%s', expected attribute:value" % condition)
+        conditions.append((name, value))
+    return conditions
+
+
+def satisfied(status, conditions):
+    """Returns True when all conditions are met by flat attributes of the status"""
+    return all(str(status.get(name)).lower() == value.lower() for name, value in conditions)
@@ -0,0 +1,53 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq, itertools, logging, threading, time
+
+logger = logging.getLogger(__name__)
+
+
+class Timers:
+    """Calls functions after their delays, all of them by one background thread
+    (so the functions must be short, eg. put an event to a queue)"""
+    def __init__(self, name='timers'):
+        self.name = name
+        self.due = []   # heap of (time, sequence number, func, args)
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def schedule(self, delay, func, *args):
+        with self.condition:
+            heapq.heappush(self.due, (time.time() + delay, next(self.counter), func, args))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=self.name)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.due)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.due or self.due[0][0] > time.time():
+                    self.condition.wait(max(self.due[0][0] - time.time(), 0) if self.due else None)
+                _, _, func, args = heapq.heappop(self.due)
+            try:
+                func(*args)
+            except Exception:
+                import traceback
+                logger.error(traceback.format_exc())
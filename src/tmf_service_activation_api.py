@@ -4,14 +4,24 @@ from flask import Blueprint, request, jsonify, abort
 from flask import current_app as app
 
 
-from attribute_utils import characterstics2attributes, prepare_nsi_attributes, status2characterstics
+from attribute_utils import characterstics2attributes, prepare_nsi_attributes, prepare_modify_attributes, \
+                            status2characterstics
+from log_config import Lazy
 
 activation_api = Blueprint('activation_api', __name__)
-LAST_RESERVATION = None
 
 LOGGER_INTRO = '\n'*3+'*'*80
 
-from nsi_connections import nsi
+from nsi_connections import nsi, store, jobs, reserve_and_provision, release_and_terminate, query_status, \
+                            modify_connection, unavailable_response, phase, create_once, idempotency_response, \
+                            pipeline, creation_job, connection_index
+from job_manager import JobQueueFull, COMPLETED
+from admission_control import AdmissionError
+from status_watch import WaitError
+from deadlines import DeadlineExceeded
+from idempotency import KeyReused, RequestInProgress
+from circuit_breaker import CircuitOpen
+from connection_listing import list_connections, ListingError
                                 
 
 #----------------------------------------------
@@ -20,10 +30,29 @@ from nsi_connections import nsi
 def create_service():
     """
     Create a new data plane connection
+    
+    When request contains 'Expect: 202-accepted' header the connection is created asynchronously:
+    the request is only validated and queued, and the progress can be tracked using the monitor 
+    resource returned in the 'location' header.
     ---
     tags:
         -   NSI connections
     parameters:
+        -   in: header
+            name: X-Request-Timeout
+            type: number
+            description: max time [sec] of NSI requests made for this request (also request_timeout query argument)
+            required: false
+        -   in: header
+            name: Expect
+            type: string
+            description: '202-accepted' for asynchronous connection creation
+            required: false
+        -   in: header
+            name: Idempotency-Key
+            type: string
+            description: unique key of the request, its retries with the same key get the original outcome
+            required: false
         -   in: body
             name: body
             description: NSI service request attributes
@@ -92,21 +121,36 @@ def create_service():
                         description: URN identifier of the reserved connection, example urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266
                     serviceCharacteristic:
                         $ref: '#/definitions/ConnAttributes'
+        202:
+            description: NSI connection request accepted for asynchronous processing
+            schema:
+                id: ConnCreationAccepted
+                properties:
+                    monitor_id:
+                        type: string
+                        description: identifier of the monitor resource tracking the connection creation
+                    serviceCharacteristic:
+                        $ref: '#/definitions/ConnAttributes'
         400:
             description: incorrect connection attributes provided
+        409:
+            description: VLAN or port capacity already used by other reservation of the service in overlapping time,
+                or request with the same Idempotency-Key is still in progress
+        422:
+            description: Idempotency-Key was used by a different request
         500:
             description: connection couldn't be reserved in the BoD system or other problem occured
+        503:
+            description: too many asynchronous requests are waiting for processing or NSI provider is unavailable
+        504:
+            description: X-Request-Timeout passed, a reservation held by BoD is aborted
     """
     app.logger.debug(LOGGER_INTRO)
     
-    # service is not suporting immediate asynchronous responses (see TMF Activation REST API spec) 
-    if request.headers.get('Expect') == '202-accepted':
-        abort(417)  
-    
     connAttributes = request.get_json() 
     if connAttributes:
         connAttributes = connAttributes.get('serviceCharacteristic')
-        app.logger.info("Creating connection with attributes \n%s", pformat(connAttributes))
+        app.logger.info("Creating connection with attributes \n%s", Lazy(pformat, connAttributes))
     if not connAttributes:
         app.logger.error("Responging HTTP code: 400")
         abort(400)
@@ -114,37 +158,154 @@ def create_service():
     try:
         if type(connAttributes) == list:
             connAttributes = characterstics2attributes(connAttributes)
-        params = prepare_nsi_attributes(connAttributes)
+        params = phase('prepare_nsi_attributes', prepare_nsi_attributes, connAttributes)
     except:
         import traceback
         app.logger.error(traceback.format_exc())
         app.logger.error("Bad connection attributes. Responging HTTP code: 400")
         abort(400)
         
-    try:      
-        reservation_id = 'urn:uuid:5f3d47d2-b201-4943-8606-7893d2dc246b' #nsi.reserve(params)
-        app.logger.debug("reservation ID=" + reservation_id)
-        
-        if not reservation_id:
-            app.logger.error("Couldn't reserve the connection. Responging HTTP code: 500")
-            abort(500)
-
-        #nsi.provision(reservation_id)
+    # immediate asynchronous response (see TMF Activation REST API spec)
+    if request.headers.get('Expect') == '202-accepted':
+        try:
+            job = create_once(queue_creation, params)
+        except AdmissionError as e:
+            app.logger.error("Connection conflicts with reservations: %s. Responging HTTP code: 409", e)
+            return jsonify({'error': str(e)}), 409
+        except (KeyReused, RequestInProgress) as e:
+            return idempotency_response(e)
+        except JobQueueFull:
+            app.logger.error("Too many requests queued. Responging HTTP code: 503")
+            abort(503)
+        app.logger.debug("Connection creation queued as job %s", job['id'])
         
-        app.logger.debug("Connection %s created" % reservation_id)
+        serviceDesc = request.get_json()
+        serviceDesc['monitor_id'] = job['id']
+        return jsonify(serviceDesc), 202, {'location': '/api/activation/monitor/%s' % job['id']}
         
-        global LAST_RESERVATION
-        LAST_RESERVATION = reservation_id
+    try:      
+        reservation_id = create_once(reserve_and_provision, params)
         
         connAttributes = request.get_json() 
         connAttributes['id'] = reservation_id
         
-        return jsonify(connAttributes, 201, {'location': '/api/activation/service/%s' % reservation_id})
+        return jsonify(connAttributes), 201, {'location': '/api/activation/service/%s' % reservation_id}
+    except AdmissionError as e:
+        app.logger.error("Connection conflicts with reservations: %s. Responging HTTP code: 409", e)
+        return jsonify({'error': str(e)}), 409
+    except (KeyReused, RequestInProgress) as e:
+        return idempotency_response(e)
+    except DeadlineExceeded as e:
+        app.logger.error("%s. Responging HTTP code: 504", e)
+        return jsonify({'error': str(e)}), 504
+    except CircuitOpen as e:
+        return unavailable_response(e)
+    except:
+        import traceback
+        app.logger.error(traceback.format_exc())
+        app.logger.error("Responging HTTP code: 500")
+        abort(500)
+
+
+def queue_creation(params):
+    """Queues asynchronous creation of the connection, conflicts are reported immediately"""
+    nsi.admit(params)
+    if pipeline:
+        return {'id': pipeline.submit(params).id}
+    return jobs.submit(reserve_and_provision, params)
+
+#----------------------------------------------    
+    
+@activation_api.route("/api/activation/service/<service_id>", methods=['PATCH'])
+def patch_service(service_id):
+    """
+    Change schedule end, capacity or description of the connection in place (NSI modify)
+    ---
+    tags:
+        -   NSI connections
+    parameters:
+        -   in: header
+            name: X-Request-Timeout
+            type: number
+            description: max time [sec] of NSI requests made for this request (also request_timeout query argument)
+            required: false
+        -   name: service_id
+            type: string
+            description: URN identifier of the reserved connection, example urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266
+        -   in: body
+            name: body
+            description: changed connection attributes
+            schema:
+                properties:
+                    serviceCharacteristic:
+                        properties:
+                            end_time:
+                                type: string
+                                description: new date and time when connection should be terminated (ISO 8601)
+                            capacity:
+                                type: integer
+                                description: new bandwidth of the connection
+                            description:
+                                type: string
+                                description: new description of the connection
+    responses:
+        200:
+            description: connection was modified, serviceCharacteristic contains its recorded attributes
+        400:
+            description: incorrect connection attributes provided
+        404:
+            description: connection was not made by the service
+        409:
+            description: the change conflicts with other reservations of the service
+        500:
+            description: connection couldn't be modified in the BoD system or other problem occured
+        503:
+            description: NSI provider is unavailable, see Retry-After header
+        504:
+            description: X-Request-Timeout passed
+    """
+    app.logger.debug(LOGGER_INTRO)
+    reservation_id = service_id
+    
+    connAttributes = request.get_json() 
+    if connAttributes:
+        connAttributes = connAttributes.get('serviceCharacteristic')
+    app.logger.info("Modifying connection %s with attributes \n%s", reservation_id, Lazy(pformat, connAttributes))
+    record = store.get(reservation_id)
+    if not record:
+        app.logger.error("Connection not found. Responging HTTP code: 404")
+        abort(404)
+    
+    try:
+        if type(connAttributes) == list:
+            connAttributes = characterstics2attributes(connAttributes)
+        params = phase('prepare_modify_attributes', prepare_modify_attributes, record, connAttributes)
+    except:
+        import traceback
+        app.logger.error(traceback.format_exc())
+        app.logger.error("Bad connection attributes. Responging HTTP code: 400")
+        abort(400)
+    
+    try:
+        connection = modify_connection(reservation_id, params)
+    except AdmissionError as e:
+        app.logger.error("Connection conflicts with reservations: %s. Responging HTTP code: 409", e)
+        return jsonify({'error': str(e)}), 409
+    except DeadlineExceeded as e:
+        app.logger.error("%s. Responging HTTP code: 504", e)
+        return jsonify({'error': str(e)}), 504
+    except CircuitOpen as e:
+        return unavailable_response(e)
     except:
         import traceback
         app.logger.error(traceback.format_exc())
         app.logger.error("Responging HTTP code: 500")
         abort(500)
+    
+    serviceDesc = {}
+    serviceDesc['serviceCharacteristic'] = status2characterstics(connection)
+    serviceDesc['id'] = reservation_id
+    return jsonify(serviceDesc)
 
 #----------------------------------------------    
     
@@ -160,20 +321,22 @@ def delete_service(service_id):
             type: string
             description: URN identifier of the reserved connection, example urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266
     responses:
-        200:
-            description: deletion was performed
+        202:
+            description: deletion was performed or is retried in background while NSI provider is unavailable
+        500:
+            description: connection couldn't be deleted in the BoD system or other problem occured
     """
     app.logger.debug(LOGGER_INTRO)
     reservation_id = service_id
     app.logger.info("Deleting connection %s", reservation_id)
     
     try:
-        pass
-        #~ nsi.release(reservation_id)
-        #~ nsi.terminate(reservation_id)
+        release_and_terminate(reservation_id)
     except:
         import traceback
         app.logger.error(traceback.format_exc())
+        app.logger.error("Responging HTTP code: 500")
+        abort(500)
         
     app.logger.debug("Connection %s delated", reservation_id)
     return "Connection %s has been deleted\n" % reservation_id, 202
@@ -188,12 +351,25 @@ def get_service(service_id):
     tags:
         -   NSI connections
     parameters:
+        -   in: header
+            name: X-Request-Timeout
+            type: number
+            description: max time [sec] of NSI requests made for this request (also request_timeout query argument)
+            required: false
         -   name: service_id
             type: string
             description: URN identifier of the reserved connection, example urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266
+        -   name: wait_for
+            in: query
+            type: string
+            description: comma separated attribute:value conditions (example provisionState:PROVISIONED), the response is returned when all of them are met or the timeout passes
+        -   name: timeout
+            in: query
+            type: number
+            description: max time [sec] of waiting for wait_for conditions (default and max WAIT_MAX_TIMEOUT)
     responses:
         200:
-            description: NSI service found
+            description: NSI service found (the latest status when wait_for conditions were not met before the timeout)
             schema:
                 properties:
                     serviceCharacteristic:
@@ -248,10 +424,16 @@ def get_service(service_id):
                                 description: consistency of reservation versions for NSI AG
                                 default: ['false', 'true']
                                 required: true
+        400:
+            description: incorrect wait_for or timeout
         404: 
             description: connection was not found 
         500:
             description: query request could not be sent to NSI API
+        503:
+            description: NSI provider is unavailable, see Retry-After header
+        504:
+            description: X-Request-Timeout passed
     """
     app.logger.debug(LOGGER_INTRO)
     reservation_id = service_id
@@ -259,7 +441,15 @@ def get_service(service_id):
     status = {}
     
     try:
-        status = nsi.query(reservation_id)
+        status = query_status(reservation_id, request.args)
+    except WaitError as e:
+        app.logger.error("%s. Responging HTTP code: 400", e)
+        abort(400)
+    except DeadlineExceeded as e:
+        app.logger.error("%s. Responging HTTP code: 504", e)
+        abort(504)
+    except CircuitOpen as e:
+        return unavailable_response(e)
     except:
         import traceback
         app.logger.error(traceback.format_exc())
@@ -269,9 +459,152 @@ def get_service(service_id):
         app.logger.debug("Connection not found")
         abort(404)
         
-    app.logger.debug("Connection status is \n%s", pformat(status))
+    app.logger.debug("Connection status is \n%s", Lazy(pformat, status))
     serviceDesc = {}
     serviceDesc['serviceCharacteristic'] = status2characterstics(status)
     serviceDesc['id'] = reservation_id
     
-    return jsonify(serviceDesc)
\ No newline at end of file
+    return jsonify(serviceDesc)
+
+#----------------------------------------------    
+    
+@activation_api.route("/api/activation/service", methods=['GET'])
+def list_services():
+    """
+    List connections made by the service (NSI provider is not queried)
+    ---
+    tags:
+        -   NSI connections
+    parameters:
+        -   name: state
+            in: query
+            type: string
+            description: comma separated lifecycle or provision states, example CREATED,PROVISIONED
+        -   name: src_domain
+            in: query
+            type: string
+        -   name: src_port
+            in: query
+            type: string
+        -   name: dst_domain
+            in: query
+            type: string
+        -   name: dst_port
+            in: query
+            type: string
+        -   name: vlan
+            in: query
+            type: integer
+            description: VLAN tag used on source or destination port
+        -   name: start_time
+            in: query
+            type: string
+            description: beginning of time window overlapping with connection schedule (ISO 8601)
+        -   name: end_time
+            in: query
+            type: string
+            description: end of time window overlapping with connection schedule (ISO 8601)
+        -   name: description
+            in: query
+            type: string
+            description: case-insensitive substring of connection description
+        -   name: limit
+            in: query
+            type: integer
+            description: max number of listed services (default 100, max 1000)
+        -   name: cursor
+            in: query
+            type: string
+            description: next_cursor returned with the previous page
+        -   name: fields
+            in: query
+            type: string
+            description: comma separated characteristics of listed services
+    responses:
+        200:
+            description: services ordered by creation time
+            schema:
+                properties:
+                    services:
+                        type: array
+                        description: services with 'id', 'href' and 'serviceCharacteristic'
+                    next_cursor:
+                        type: string
+                        description: cursor of the next page, null on the last page
+        400:
+            description: incorrect listing parameters
+    """
+    app.logger.debug("List services %s", request.args.to_dict())
+    try:
+        connections, next_cursor = list_connections(store, connection_index, request.args)
+    except ListingError as e:
+        app.logger.error("%s. Responging HTTP code: 400", e)
+        abort(400)
+        
+    services = []
+    for connection in connections:
+        rid = connection.pop('reservation_id', None)
+        serviceDesc = {'serviceCharacteristic': status2characterstics(connection)}
+        if rid:
+            serviceDesc['id'] = rid
+            serviceDesc['href'] = '/api/activation/service/%s' % rid
+        services.append(serviceDesc)
+    app.logger.debug("Listed %i services", len(services))
+    return jsonify({'services': services, 'next_cursor': next_cursor})
+
+#----------------------------------------------    
+    
+@activation_api.route("/api/activation/monitor/<monitor_id>", methods=['GET'])
+def get_monitor(monitor_id):
+    """
+    Query progress of asynchronous connection creation
+    ---
+    tags:
+        -   NSI connections
+    parameters:
+        -   name: monitor_id
+            type: string
+            description: identifier of the monitor resource returned when connection creation was accepted
+    responses:
+        200:
+            description: monitor found
+            schema:
+                properties:
+                    id:
+                        type: string
+                        description: identifier of the monitor resource
+                    state:
+                        type: string
+                        description: state of the connection creation
+                        default: ['InProgress', 'Completed', 'Failed']
+                    service_id:
+                        type: string
+                        description: URN identifier of the reserved connection (when state is Completed)
+                    href:
+                        type: string
+                        description: location of the created service (when state is Completed)
+                    error:
+                        type: string
+                        description: reason of the failure (when state is Failed)
+                    step:
+                        type: string
+                        description: current step of creation sent by the pipeline (see CREATE_PIPELINE)
+                        default: ['reserving', 'committing', 'provisioning', 'created', 'failed']
+        404: 
+            description: monitor was not found or already expired
+    """
+    app.logger.debug("Query monitor %s", monitor_id)
+    job = jobs.get(monitor_id) or creation_job(monitor_id)
+    if not job:
+        app.logger.debug("Monitor not found")
+        abort(404)
+        
+    monitor = {'id': job['id'], 'state': job['state']}
+    if job['state'] == COMPLETED:
+        monitor['service_id'] = job['result']
+        monitor['href'] = '/api/activation/service/%s' % job['result']
+    if job['error']:
+        monitor['error'] = job['error']
+    if job.get('step'):
+        monitor['step'] = job['step']
+    return jsonify(monitor)
@@ -0,0 +1,215 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging, re, sys, threading, time, uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_settings = {'slow_threshold': None}
+_sampler = []   # Sampler when profiling is enabled
+
+MAX_ID_LENGTH = 64
+_ID_CHARACTERS = re.compile(r'[^A-Za-z0-9._:@/-]')   # other characters of request IDs are dropped
+PROFILE_TOP = 15   # most frequent stacks reported for slow requests
+
+
+class Trace:
+    """Timed spans of a request, every span is a [name, start, duration, depth] list
+    (duration is None until the span ends)"""
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.start = time.time()
+        self.spans = []
+        self.samples = {}   # stack -> count, see Sampler
+        self.lock = threading.Lock()
+
+    def add(self, name, depth):
+        span = [name, time.time(), None, depth]
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def sample(self, stack):
+        with self.lock:
+            self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def format(self):
+        """Span tree (and profile samples) as text"""
+        with self.lock:
+            spans = [list(span) for span in self.spans]
+            samples = sorted(self.samples.items(), key=lambda sample: -sample[1])
+        lines = ["Request %s took %.3f sec" % (self.request_id, time.time() - self.start)]
+        for name, start, duration, depth in spans:
+            took = 'unfinished' if duration is None else '%.3f sec' % duration
+            lines.append("%s%s: %s (at +%.3f)" % ('  ' * (depth + 1), name, took, start - self.start))
+        if samples:
+            total = sum(count for stack, count in samples)
+            lines.append("Profile (%i samples):" % total)
+            for stack, count in samples[:PROFILE_TOP]:
+                lines.append("  %5.1f%% %s" % (100.0 * count / total, stack))
+        return '\n'.join(lines)
+
+
+class RequestIdFilter(logging.Filter):
+    """Sets request_id attribute of log records ('-' outside of traced requests)"""
+    def filter(self, record):
+        record.request_id = request_id() or '-'
+        return True
+
+
+class Sampler:
+    """Samples stacks of threads running traced requests every 'interval' seconds,
+    the statistical profile is logged with span trees of slow requests"""
+    def __init__(self, interval=0.01, depth=3):
+        self.interval = interval
+        self.depth = depth   # innermost frames of a sample
+        self.traces = {}     # thread ident -> Trace
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self._run, name='trace-sampler')
+        thread.daemon = True
+        thread.start()
+
+    def register(self, trace):
+        with self.lock:
+            self.traces[threading.current_thread().ident] = trace
+
+    def unregister(self):
+        with self.lock:
+            self.traces.pop(threading.current_thread().ident, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                traces = list(self.traces.items())
+            if not traces:
+                continue
+            frames = sys._current_frames()
+            for ident, trace in traces:
+                frame = frames.get(ident)
+                if frame is not None:
+                    trace.sample(self._stack(frame))
+
+    def _stack(self, frame):
+        names = []
+        while frame is not None and len(names) < self.depth:
+            code = frame.f_code
+            names.append('%s (%s:%i)' % (code.co_name, code.co_filename.split('/')[-1], frame.f_lineno))
+            frame = frame.f_back
+        return ' < '.join(names)
+
+
+def configure(slow_threshold=None, profile_interval=None):
+    """Span trees of requests lasting at least slow_threshold [sec] are logged (None: never),
+    profile_interval [sec] enables sampling of stacks of traced requests"""
+    _settings['slow_threshold'] = slow_threshold
+    del _sampler[:]
+    if profile_interval:
+        if hasattr(sys, '_current_frames'):
+            _sampler.append(Sampler(profile_interval))
+        else:
+            logger.warning("Stack sampling is not supported, profiling disabled")
+
+
+def new_id(requested=None):
+    """Request ID given by the client (unsafe characters removed) or a new one"""
+    if requested:
+        requested = _ID_CHARACTERS.sub('', requested)[:MAX_ID_LENGTH]
+    return requested or uuid.uuid4().hex
+
+
+def current():
+    """Trace of the request handled by this thread, None outside of traced requests"""
+    return getattr(_local, 'trace', None)
+
+
+def request_id():
+    trace = current()
+    return trace.request_id if trace else None
+
+
+def start(request_id=None):
+    """Starts a new trace of this thread until finish() is called"""
+    trace = Trace(new_id(request_id))
+    _local.trace = trace
+    _local.depth = 0
+    if _sampler:
+        _sampler[0].register(trace)
+    return trace
+
+
+def finish():
+    """Ends trace of this thread (logging it when it was slow), returns it"""
+    trace = current()
+    if trace is None:
+        return None
+    if _sampler:
+        _sampler[0].unregister()
+    threshold = _settings['slow_threshold']
+    if threshold is not None and time.time() - trace.start >= threshold:
+        logger.warning("Slow request, %s", trace.format())
+    _local.trace = None
+    return trace
+
+
+@contextmanager
+def traced(request_id=None):
+    """Traces the block as a separate request (eg. asynchronous job) with the given ID"""
+    previous = current(), getattr(_local, 'depth', 0)
+    start(request_id)
+    try:
+        yield
+    finally:
+        finish()
+        _local.trace, _local.depth = previous
+
+
+@contextmanager
+def span(name):
+    """Times the block as a span of the current trace (nested spans are indented)"""
+    trace = current()
+    if trace is None:
+        yield
+        return
+    depth = _local.depth
+    entry = trace.add(name, depth)
+    _local.depth = depth + 1
+    try:
+        yield
+    finally:
+        _local.depth = depth
+        entry[2] = time.time() - entry[1]
+
+
+def context():
+    """Trace and span depth of this thread, passed to within() in other threads"""
+    return current(), getattr(_local, 'depth', 0)
+
+
+@contextmanager
+def within(context):
+    """Records spans of the block (run by another thread) in the trace of context()"""
+    previous = current(), getattr(_local, 'depth', 0)
+    _local.trace, _local.depth = context
+    sampled = _sampler and context[0] is not None
+    if sampled:
+        _sampler[0].register(context[0])
+    try:
+        yield
+    finally:
+        if sampled:
+            _sampler[0].unregister()
+        _local.trace, _local.depth = previous
@@ -0,0 +1,321 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Load generator for nsi_connections REST API.
+
+Drives legacy (/nsi/connections) and TMF (/api/activation/service) APIs with a mix of
+create, query and delete requests from concurrent clients and reports throughput and
+latency percentiles per endpoint and per NSI backend operation.
+
+Examples:
+    # against running service
+    python benchmark.py --url http://localhost:9000 --concurrency 16 --duration 60
+
+    # in-process service using simulated NSI provider (no network needed)
+    python benchmark.py --local --concurrency 16 --duration 30 --mix create=1,query=8,delete=1 \\
+                        --output results.json
+"""
+
+from __future__ import print_function
+
+import argparse, json, os, random, sys, tempfile, threading, time
+
+try:
+    import httplib
+    from urlparse import urlparse
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import urlparse
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+from operation_stats import OperationStats
+
+properties = { 'src_domain':'urn:ogf:network:pionier.net.pl:2013:topology',
+                    'src_port':'felix-ge-1-0-9',
+                    'src_vlan': 1202,
+                    'dst_domain':'urn:ogf:network:geant.net:2013:topology',
+                    'dst_port':'iMinds__port__to__GEANT',
+                    'dst_vlan': 2001,
+                    'capacity': 50,
+                    'description': 'JRA1T3 testing'}
+
+LOCAL_CONFIG = """
+REST_PORT = 9000
+LOG_FILE = %(log_file)r
+NSI_BACKEND = "simulated"
+PROVIDER_NSA = "urn:ogf:network:simulated:nsa"
+PROVIDER_URI = None
+REQUESTER_NSA = "urn:ogf:network:simulated:nsa"
+REQUESTER_URI = None
+SIMULATED_LATENCY = %(latency)s
+"""
+
+status_codes_lock = threading.Lock()
+
+
+class HTTPClient:
+    def __init__(self, url):
+        url = urlparse(url)
+        self.host = url.netloc
+
+    def request(self, method, path, body=None, headers={}):
+        conn = httplib.HTTPConnection(self.host, timeout=600)
+        try:
+            headers = dict(headers)
+            if body is not None:
+                body = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            return response.status, _json(response.read()), response.getheader('location')
+        finally:
+            conn.close()
+
+
+class LocalClient:
+    """Calls in-process Flask application (see load_local_app)"""
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers={}):
+        data = json.dumps(body) if body is not None else None
+        response = self.client.open(path, method=method, data=data, headers=headers,
+                                    content_type='application/json')
+        return response.status_code, _json(response.data), response.headers.get('location')
+
+
+def _json(data):
+    try:
+        return json.loads(data.decode('utf-8') if isinstance(data, bytes) else data)
+    except ValueError:
+        return None
+
+
+def load_local_app(latency):
+    """Imports REST service configured with simulated NSI provider"""
+    workdir = tempfile.mkdtemp(prefix='nsi_benchmark_')
+    config = os.path.join(workdir, 'nsi_connections.conf')
+    with open(config, 'w') as f:
+        f.write(LOCAL_CONFIG % {'log_file': os.path.join(workdir, 'nsi_connections.log'),
+                                'latency': json.dumps(latency)})
+    os.environ['NSI_CONNECTIONS_SETTINGS'] = config
+    import nsi_connections
+    return nsi_connections.app
+
+
+class Scenario:
+    """Executes create/query/delete requests against one of APIs and records their latency"""
+    def __init__(self, client, api, stats, status_codes, monitor_poll=0.05):
+        self.client = client
+        self.api = api
+        self.stats = stats
+        self.status_codes = status_codes
+        self.monitor_poll = monitor_poll
+        self.created = []
+        self.lock = threading.Lock()
+
+    def timed(self, endpoint, method, path, body=None, headers={}, expected=(200,)):
+        start = time.time()
+        status, reply, location = None, None, None
+        try:
+            status, reply, location = self.client.request(method, path, body, headers)
+        finally:
+            self.stats.record(endpoint, time.time() - start, status in expected)
+            with status_codes_lock:
+                self.status_codes[str(status)] = self.status_codes.get(str(status), 0) + 1
+        return status, reply, location
+
+    def create(self, n):
+        attributes = dict(properties, description='benchmark %i' % n,
+                          src_port='benchmark-port-%i' % (n // 4000), src_vlan=n % 4000 + 1,
+                          dst_port='benchmark-port-%i' % (n // 4000), dst_vlan=n % 4000 + 1)
+        if self.api == 'legacy':
+            status, reply, _ = self.timed('POST /nsi/connections', 'POST', '/nsi/connections',
+                                          attributes, expected=(201,))
+            rid = reply.get('reservation_id') if status == 201 and reply else None
+        else:
+            characteristics = [{'name': name, 'value': value} for name, value in attributes.items()]
+            status, reply, location = self.timed('POST /api/activation/service (async)', 'POST',
+                                                 '/api/activation/service',
+                                                 {'serviceCharacteristic': characteristics},
+                                                 {'Expect': '202-accepted'}, expected=(202,))
+            rid = self.wait_for_monitor(location) if status == 202 else None
+        if rid:
+            with self.lock:
+                self.created.append(rid)
+
+    def wait_for_monitor(self, location):
+        while True:
+            status, reply, _ = self.timed('GET /api/activation/monitor/<id>', 'GET', location)
+            if status != 200 or reply.get('state') == 'Failed':
+                return None
+            if reply.get('state') == 'Completed':
+                return reply['service_id']
+            time.sleep(self.monitor_poll)
+
+    def query(self):
+        with self.lock:
+            rid = random.choice(self.created) if self.created else None
+        if not rid:
+            return False
+        if self.api == 'legacy':
+            self.timed('GET /nsi/connections/<id>', 'GET', '/nsi/connections/%s' % rid)
+        else:
+            self.timed('GET /api/activation/service/<id>', 'GET', '/api/activation/service/%s' % rid)
+        return True
+
+    def delete(self):
+        with self.lock:
+            rid = self.created.pop(random.randrange(len(self.created))) if self.created else None
+        if not rid:
+            return False
+        if self.api == 'legacy':
+            self.timed('DELETE /nsi/connections/<id>', 'DELETE', '/nsi/connections/%s' % rid)
+        else:
+            self.timed('DELETE /api/activation/service/<id>', 'DELETE', '/api/activation/service/%s' % rid,
+                       expected=(200, 202))
+        return True
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, weight = item.split('=')
+        if name not in ('create', 'query', 'delete'):
+            raise ValueError("Unknown request type '%s'" % name)
+        mix[name] = float(weight)
+    return mix
+
+
+def run(scenarios, mix, concurrency, duration):
+    counter = [0]
+    counter_lock = threading.Lock()
+    deadline = time.time() + duration
+    choices = [name for name, weight in mix.items() for i in range(int(weight * 10))]
+
+    def work():
+        while time.time() < deadline:
+            scenario = random.choice(scenarios)
+            choice = random.choice(choices)
+            if choice == 'query' and scenario.query():
+                continue
+            if choice == 'delete' and scenario.delete():
+                continue
+            with counter_lock:
+                counter[0] += 1
+                n = counter[0]
+            scenario.create(n)  # also when there is nothing to query or delete
+
+    threads = [threading.Thread(target=work) for i in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def backend_operations(service_stats):
+    """nsi_operations of GET /nsi/stats, names are prefixed by provider when PROVIDERS are routed"""
+    service_stats = service_stats or {}
+    operations = dict(service_stats.get('nsi_operations') or {})
+    for provider, provider_stats in (service_stats.get('providers') or {}).items():
+        for name, summary in (provider_stats.get('nsi_operations') or {}).items():
+            operations['%s/%s' % (provider, name)] = summary
+    return operations
+
+
+def report(stats, status_codes, elapsed, backend_stats):
+    results = {'duration': elapsed, 'endpoints': stats.snapshot(), 'status_codes': status_codes,
+               'backend_operations': backend_stats}
+    for name, summary in results['endpoints'].items():
+        summary['throughput'] = summary['count'] / elapsed
+
+    line = "%-42s %8s %7s %9s %9s %9s %9s"
+    print(line % ('endpoint', 'count', 'errors', 'req/s', 'p50[ms]', 'p95[ms]', 'p99[ms]'))
+    for name, summary in sorted(results['endpoints'].items()):
+        print(line % (name, summary['count'], summary['errors'], '%.1f' % summary['throughput'],
+                      _ms(summary['p50']), _ms(summary['p95']), _ms(summary['p99'])))
+    if backend_stats:
+        print()
+        print(line % ('NSI operation', 'count', 'errors', '', 'p50[ms]', 'p95[ms]', 'p99[ms]'))
+        for name, summary in sorted(backend_stats.items()):
+            print(line % (name, summary['count'], summary['errors'], '',
+                          _ms(summary['p50']), _ms(summary['p95']), _ms(summary['p99'])))
+    print()
+    print("HTTP status codes: %s" % results['status_codes'])
+    return results
+
+
+def _ms(seconds):
+    return '%.1f' % (seconds * 1000) if seconds is not None else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for nsi_connections REST API")
+    parser.add_argument('--url', default='http://localhost:9000', help="URL of running service")
+    parser.add_argument('--local', action='store_true',
+                        help="run service in-process with simulated NSI provider instead of using --url")
+    parser.add_argument('--latency', default='{"reserve": [0.05, 0.2], "commit": 0.02, "provision": 0.05, '
+                                             '"release": 0.05, "terminate": 0.05, "query": 0.02}',
+                        help="SIMULATED_LATENCY (JSON) used by --local")
+    parser.add_argument('--api', choices=('legacy', 'tmf', 'both'), default='both')
+    parser.add_argument('--concurrency', type=int, default=8, help="number of concurrent clients")
+    parser.add_argument('--duration', type=float, default=30, help="duration of the test [sec]")
+    parser.add_argument('--mix', default='create=1,query=8,delete=1', help="ratio of request types")
+    parser.add_argument('--no-cleanup', action='store_true', help="don't delete connections left after the test")
+    parser.add_argument('--output', help="file to write results in JSON format")
+    args = parser.parse_args()
+
+    if args.local:
+        app = load_local_app(json.loads(args.latency))
+        client = LocalClient(app)
+    else:
+        client = HTTPClient(args.url)
+
+    stats, status_codes = OperationStats(samples=1000000), {}
+    apis = ('legacy', 'tmf') if args.api == 'both' else (args.api,)
+    scenarios = [Scenario(client, api, stats, status_codes) for api in apis]
+
+    _, before, _ = client.request('GET', '/nsi/stats')
+    start = time.time()
+    run(scenarios, parse_mix(args.mix), args.concurrency, args.duration)
+    elapsed = time.time() - start
+    _, after, _ = client.request('GET', '/nsi/stats')
+
+    # operations made during the test are counted, latency percentiles cover the latest calls made by the service
+    backend_stats = backend_operations(after)
+    for name, summary in backend_stats.items():
+        previous = backend_operations(before).get(name, {})
+        summary['count'] -= previous.get('count', 0)
+        summary['errors'] -= previous.get('errors', 0)
+
+    results = report(stats, status_codes, elapsed, backend_stats)
+    results.update({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(start)),
+                    'target': 'local' if args.local else args.url,
+                    'api': args.api,
+                    'concurrency': args.concurrency,
+                    'mix': parse_mix(args.mix)})
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if not args.no_cleanup:
+        for scenario in scenarios:
+            while scenario.delete():
+                pass
+
+
+if __name__ == "__main__":
+    main()
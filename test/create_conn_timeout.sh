@@ -0,0 +1,8 @@
+#!/bin/bash
+
+# HTTP 504 when the connection isn't reserved and provisioned in 30 sec
+curl -H "Content-Type: application/json" -H "X-Request-Timeout: 30" \
+      -X POST -d '{"description":"JRA1T3 testing","src_domain":"urn:ogf:network:pionier.net.pl:2013:topology","src_port":"felix-ge-1-0-9","src_vlan":1202,"dst_domain":"urn:ogf:network:geant.net:2013:topology","dst_port":"iMinds__port__to__GEANT","dst_vlan":2001,"capacity":50}' \
+      http://localhost:9000/nsi/connections
+
+curl "http://localhost:9000/nsi/connections/urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266?request_timeout=5"
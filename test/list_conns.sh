@@ -0,0 +1,3 @@
+#!/bin/bash
+
+curl "http://localhost:9000/nsi/connections?state=PROVISIONED&src_domain=urn:ogf:network:pionier.net.pl:2013:topology&limit=50&fields=reservation_id,description,src_vlan,dst_vlan,end_time"
@@ -0,0 +1,11 @@
+#!/bin/bash
+
+curl -H "Content-Type: application/json" \
+      -X PATCH -d '{"end_time":"2017-09-1T13:00:00+02:00","capacity":100}' \
+      http://localhost:9000/nsi/connections/urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266
+
+curl -H "Content-Type: application/json" \
+      -X PATCH -d '{ "connections" : [ 
+      {"reservation_id":"urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266","end_time":"2017-09-1T13:00:00+02:00"},
+      {"reservation_id":"urn:uuid:5f3d47d2-b201-4943-8606-7893d2dc246b","end_time":"2017-09-1T13:00:00+02:00"} ] }' \
+      http://localhost:9000/nsi/connections/batch
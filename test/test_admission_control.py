@@ -0,0 +1,150 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of admission control of concurrent requests, run from ./test: python -m unittest test_admission_control"""
+
+import os, shutil, sys, tempfile, threading, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from admission_control import AdmissionError
+from reservation_store import ReservationStore, SharedReservationStore, FAILED, RELEASED
+from simulated_backend import SimulatedNSI
+
+
+def params(vlan, capacity=10):
+    return {'gid': 'gid', 'desc': 'test', 'src': 'urn:a:p1', 'dst': 'urn:b:p2',
+            'srcvlan': vlan, 'dstvlan': vlan, 'capacity': capacity, 'start_sec': -1, 'end_sec': -1}
+
+
+class HoldTest(unittest.TestCase):
+
+    def test_hold_conflicts_until_unhold(self):
+        store = ReservationStore()
+        self.assertEqual(store.hold('hold:1', params(10)), [])
+        self.assertTrue(store.hold('hold:2', params(10)))
+        self.assertTrue(store.conflicts(params(10)))
+        self.assertEqual(store.stats()['held'], 1)
+        store.unhold('hold:1')
+        store.unhold('hold:1')   # already released
+        self.assertEqual(store.conflicts(params(10)), [])
+        self.assertEqual(store.stats(), {'reservations': 0, 'admitted': 0, 'held': 0})
+
+    def test_hold_counts_capacity(self):
+        store = ReservationStore()
+        capacity = {'urn:a:p1': 25}
+        self.assertEqual(store.hold('hold:1', params(10), capacity), [])
+        self.assertEqual(store.hold('hold:2', params(11), capacity), [])
+        self.assertTrue(store.hold('hold:3', params(12), capacity))
+
+
+class SharedHoldTest(unittest.TestCase):
+    """Holds of worker processes sharing the log, each one has its own store"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'reservations.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def store(self, **options):
+        return SharedReservationStore(self.path, sync=False, exclusive=False, **options)
+
+    def test_hold_conflicts_in_other_process(self):
+        first, second = self.store(), self.store()
+        self.assertEqual(first.hold('hold:1', params(10)), [])
+        self.assertTrue(second.hold('hold:2', params(10)))
+        self.assertEqual(second.stats()['held'], 1)
+        first.unhold('hold:1')
+        self.assertEqual(second.hold('hold:3', params(10)), [])
+        self.assertTrue(first.hold('hold:4', params(10)))
+
+    def test_hold_counts_capacity_of_other_process(self):
+        first, second = self.store(), self.store()
+        capacity = {'urn:a:p1': 25}
+        self.assertEqual(first.hold('hold:1', params(10), capacity), [])
+        self.assertEqual(second.hold('hold:2', params(11), capacity), [])
+        self.assertTrue(first.hold('hold:3', params(12), capacity))
+
+    def test_concurrent_holds(self):
+        stores = [self.store() for _ in range(4)]
+        results = []
+
+        def hold(n):
+            results.append(stores[n].hold('hold:%i' % n, params(10)))
+        threads = [threading.Thread(target=hold, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        self.assertEqual(sorted(bool(conflicts) for conflicts in results), [False, True, True, True])
+
+    def test_stale_hold_dropped(self):
+        first, second = self.store(hold_ttl=0.1), self.store(hold_ttl=0.1)
+        self.assertEqual(first.hold('hold:1', params(10)), [])   # not released by an ended process
+        time.sleep(0.2)
+        self.assertEqual(second.hold('hold:2', params(10)), [])
+        self.assertEqual(first.stats()['held'], 1)
+
+
+class ConcurrentReserveTest(unittest.TestCase):
+
+    def reserve_concurrently(self, reserve, count=4):
+        results, errors = [], []
+
+        def run():
+            try:
+                results.append(reserve())
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=run) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        return results, errors
+
+    def test_reserve(self):
+        # the provider takes long to reserve, every request would pass admission checked without holding
+        nsi = SimulatedNSI(latency={'reserve': 0.2, 'commit': 0})
+        results, errors = self.reserve_concurrently(lambda: nsi.reserve(params(10)))
+        self.assertEqual(len(results), 1)
+        self.assertEqual([e.__class__ for e in errors], [AdmissionError] * 3)
+        self.assertEqual(nsi.store.stats()['held'], 0)
+        self.assertTrue(nsi.store.conflicts(params(10)))   # by the recorded reservation
+
+    def test_failed_reserve_releases_hold(self):
+        nsi = SimulatedNSI(failure_rate={'reserve': 1.0})
+        self.assertRaises(Exception, nsi.reserve, params(10))
+        self.assertEqual(nsi.store.stats()['held'], 0)
+        self.assertEqual(nsi.store.conflicts(params(10)), [])
+
+    def test_send(self):
+        nsi = SimulatedNSI(latency={'reserve': 0.2})
+        replies = []
+        results, errors = self.reserve_concurrently(lambda: nsi.send('reserve', replies.append, params(10)))
+        self.assertEqual(len(results), 1)
+        self.assertEqual([e.__class__ for e in errors], [AdmissionError] * 3)
+        self.assertEqual(nsi.store.stats()['held'], 0)
+
+        # aborted reservation doesn't use the VLAN
+        nsi.store.update(results[0], lifecycleState=FAILED, provisionState=RELEASED)
+        self.assertEqual(nsi.store.conflicts(params(10)), [])
+        time.sleep(0.3)
+        self.assertEqual(replies, [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
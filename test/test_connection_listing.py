@@ -0,0 +1,93 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of listing recorded connections, run from ./test: python -m unittest test_connection_listing"""
+
+import os, shutil, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from connection_listing import ConnectionIndex, list_connections
+from reservation_store import ReservationStore, SharedReservationStore, TERMINATED
+
+
+def params(i):
+    return {'gid': 'gid-%i' % i, 'desc': 'connection %i' % i, 'src': 'a:p1', 'dst': 'b:p2',
+            'src_domain': 'a', 'src_port': 'p1', 'dst_domain': 'b', 'dst_port': 'p2',
+            'srcvlan': 100 + i, 'dstvlan': 100 + i, 'capacity': 10, 'start_sec': -1, 'end_sec': -1}
+
+
+def list_all(store, index, args):
+    """IDs of connections of all pages"""
+    rids, cursor = [], None
+    while True:
+        page, cursor = list_connections(store, index, dict(args, cursor=cursor) if cursor else args)
+        rids.extend(connection['reservation_id'] for connection in page)
+        if not cursor:
+            return rids
+
+
+class ListConnectionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ReservationStore()
+        self.index = ConnectionIndex(self.store)
+        for i in range(25):
+            self.store.add('rid-%02i' % i, params(i))
+        self.store.update('rid-03', lifecycleState=TERMINATED)
+        self.store.remove('rid-04')
+
+    def test_pages(self):
+        page, cursor = list_connections(self.store, self.index, {'limit': '10'})
+        self.assertEqual(len(page), 10)
+        self.assertTrue(cursor)
+        expected = ['rid-%02i' % i for i in range(25) if i != 4]
+        self.assertEqual(list_all(self.store, self.index, {'limit': '7'}), expected)
+
+    def test_filtered_pages(self):
+        self.assertEqual(list_all(self.store, self.index, {'limit': '2', 'state': TERMINATED}), ['rid-03'])
+        self.assertEqual(list_all(self.store, self.index, {'limit': '3', 'description': 'connection 1'}),
+                         ['rid-01'] + ['rid-%02i' % i for i in range(10, 20)])
+        # selected by the STP index of the store
+        self.assertEqual(list_all(self.store, self.index, {'limit': '4', 'src_domain': 'a', 'src_port': 'p1'}),
+                         ['rid-%02i' % i for i in range(25) if i != 4])
+
+    def test_index_follows_store(self):
+        self.assertEqual(len(self.index.keys), 24)
+        self.store.remove('rid-05')
+        self.store.update('rid-06', version=1)
+        self.assertEqual(len(self.index.keys), 23)
+        self.assertEqual(len(list_all(self.store, self.index, {})), 23)
+
+
+class SharedStoreIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'reservations.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_records_loaded_from_log(self):
+        store = SharedReservationStore(self.path, sync=False)
+        for i in range(5):
+            store.add('rid-%02i' % i, params(i))
+        loaded = SharedReservationStore(self.path, sync=False)
+        index = ConnectionIndex(loaded)   # before the log is read
+        self.assertEqual(list_all(loaded, index, {'limit': '2'}), ['rid-%02i' % i for i in range(5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
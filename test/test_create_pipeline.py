@@ -0,0 +1,111 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of pipelined connection creation, run from ./test: python -m unittest test_create_pipeline"""
+
+import os, sys, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from create_pipeline import CreatePipeline, CREATED, FAILED
+from reservation_store import FAILED as RESERVATION_FAILED, TERMINATED
+from simulated_backend import SimulatedNSI
+
+
+def params(vlan):
+    return {'gid': 'gid', 'desc': 'test', 'src': 'urn:a:p1', 'dst': 'urn:b:p2',
+            'srcvlan': vlan, 'dstvlan': vlan, 'capacity': 10, 'start_sec': -1, 'end_sec': -1}
+
+
+def wait_terminated(nsi, rid, timeout=10):
+    """Waits for the background deletion of the connection (see NSIBackend.discard)"""
+    deadline = time.time() + timeout
+    while nsi.connections[rid]['lifecycleState'] != TERMINATED and time.time() < deadline:
+        time.sleep(0.05)
+    return nsi.connections[rid]['lifecycleState'] == TERMINATED
+
+
+class CountingNSI(SimulatedNSI):
+    """Simulated backend counting sent operations"""
+    def __init__(self, **options):
+        SimulatedNSI.__init__(self, **options)
+        self.sent = {}
+
+    def _send(self, operation, callback, *args):
+        self.sent[operation] = self.sent.get(operation, 0) + 1
+        return SimulatedNSI._send(self, operation, callback, *args)
+
+
+class CreatePipelineTest(unittest.TestCase):
+
+    def test_created(self):
+        nsi = CountingNSI(latency={'reserve': 0.05, 'commit': 0.05, 'provision': 0.05})
+        creation = CreatePipeline(nsi).submit(params(10))
+        self.assertTrue(creation.ended.wait(10))
+        self.assertEqual(creation.state, CREATED)
+        self.assertEqual(nsi.sent, {'reserve': 1, 'commit': 1, 'provision': 1})
+
+    def test_reserve_confirmed_after_timeout(self):
+        nsi = CountingNSI(latency={'reserve': 0.5})
+        pipeline = CreatePipeline(nsi, step_timeout=0.1)
+        creation = pipeline.submit(params(10))
+        self.assertTrue(creation.ended.wait(10))
+        self.assertEqual(creation.state, FAILED)
+        self.assertEqual(creation.error, "reserve failed: no confirmation of reserve in 0.1 sec")
+        time.sleep(0.8)   # the late confirmation of reserve is handled
+        self.assertEqual(nsi.sent.get('abort'), 1)
+        self.assertEqual(pipeline.stats()['total']['aborted'], 1)
+        self.assertEqual(nsi.store.get(creation.reservation_id)['lifecycleState'], RESERVATION_FAILED)
+        self.assertEqual(nsi.connections[creation.reservation_id]['reservationState'], 'RESERVE_START')
+
+    def test_reserve_failed_after_timeout(self):
+        nsi = CountingNSI()
+        nsi.reserve(params(10))
+        nsi.admission_control = False   # the conflict is found by the provider
+        nsi.latency = {'reserve': 0.5}
+        pipeline = CreatePipeline(nsi, step_timeout=0.1)
+        creation = pipeline.submit(params(10))
+        self.assertTrue(creation.ended.wait(10))
+        self.assertEqual(creation.state, FAILED)
+        time.sleep(0.8)   # the late failure of reserve is handled
+        self.assertEqual(nsi.sent.get('abort'), 1)
+        self.assertEqual(pipeline.stats()['total']['aborted'], 1)
+        self.assertEqual(nsi.connections[creation.reservation_id]['reservationState'], 'RESERVE_START')
+
+    def test_commit_confirmed_after_timeout(self):
+        # commit is confirmed before the abort sent at its timeout
+        nsi = CountingNSI(latency={'commit': 0.3, 'abort': 1.0})
+        pipeline = CreatePipeline(nsi, step_timeout=0.1)
+        creation = pipeline.submit(params(10))
+        self.assertTrue(creation.ended.wait(10))
+        self.assertEqual(creation.state, FAILED)
+        self.assertTrue(wait_terminated(nsi, creation.reservation_id))
+        self.assertEqual(nsi.store.get(creation.reservation_id)['lifecycleState'], TERMINATED)
+        self.assertEqual(pipeline.stats()['total']['deleted'], 1)
+        self.assertEqual(nsi.sent.get('provision'), None)
+
+    def test_provision_failed(self):
+        nsi = CountingNSI(failure_rate={'provision': 1.0})
+        pipeline = CreatePipeline(nsi)
+        creation = pipeline.submit(params(10))
+        self.assertTrue(creation.ended.wait(10))
+        self.assertEqual(creation.state, FAILED)
+        self.assertTrue(wait_terminated(nsi, creation.reservation_id))
+        self.assertEqual(nsi.store.get(creation.reservation_id)['lifecycleState'], TERMINATED)
+        self.assertEqual(nsi.store.conflicts(params(10)), [])
+        self.assertEqual(pipeline.stats()['total'], {CREATED: 0, FAILED: 1, 'aborted': 0, 'deleted': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of creations with Idempotency-Key header, run from ./test: python -m unittest test_idempotency"""
+
+import os, shutil, sys, tempfile, threading, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from circuit_breaker import CircuitOpen
+from idempotency import IdempotencyKeys, KeyReused, RequestInProgress
+
+CONFIG = '''
+LOG_FILE = %r
+NSI_BACKEND = "simulated"
+PROVIDER_NSA = "urn:provider"; PROVIDER_URI = "http://provider"
+REQUESTER_NSA = "urn:requester"; REQUESTER_URI = "http://requester"
+SIMULATED_LATENCY = {}
+CIRCUIT_BREAKER_THRESHOLD = 1
+'''
+
+
+class IdempotencyKeysTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.keys = IdempotencyKeys(wait=0.1, transient=(CircuitOpen,))
+
+    def create(self, vlan):
+        self.calls.append(vlan)
+        return 'rid-%i' % len(self.calls)
+
+    def test_replay(self):
+        self.assertEqual(self.keys.call('k1', 10, self.create, 10), 'rid-1')
+        self.assertEqual(self.keys.call('k1', 10, self.create, 10), 'rid-1')
+        self.assertEqual(self.calls, [10])
+        self.assertEqual(self.keys.replays, 1)
+
+    def test_failure_is_replayed(self):
+        def conflict(vlan):
+            self.calls.append(vlan)
+            raise ValueError("VLAN %i is used" % vlan)
+        self.assertRaises(ValueError, self.keys.call, 'k1', 10, conflict, 10)
+        self.assertRaises(ValueError, self.keys.call, 'k1', 10, conflict, 10)
+        self.assertEqual(self.calls, [10])
+
+    def test_key_reused(self):
+        self.keys.call('k1', 10, self.create, 10)
+        self.assertRaises(KeyReused, self.keys.call, 'k1', 11, self.create, 11)
+        self.assertEqual(self.calls, [10])
+
+    def test_transient_failure_is_dropped(self):
+        def unavailable(vlan):
+            self.calls.append(vlan)
+            raise CircuitOpen("provider unavailable")
+        self.assertRaises(CircuitOpen, self.keys.call, 'k1', 10, unavailable, 10)
+        self.assertEqual(self.keys.call('k1', 10, self.create, 10), 'rid-2')   # the retry creates the connection
+        self.assertEqual(self.calls, [10, 10])
+
+    def test_in_progress(self):
+        started, finish = threading.Event(), threading.Event()
+
+        def slow(vlan):
+            started.set()
+            finish.wait(10)
+            return self.create(vlan)
+        worker = threading.Thread(target=self.keys.call, args=('k1', 10, slow, 10))
+        worker.start()
+        started.wait(10)
+        self.assertRaises(RequestInProgress, self.keys.call, 'k1', 10, self.create, 10)
+        finish.set()
+        worker.join(10)
+        self.assertEqual(self.keys.call('k1', 10, self.create, 10), 'rid-1')
+
+
+class CreateConnectionTest(unittest.TestCase):
+    """POST /nsi/connections of the application with simulated NSI provider"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        config = os.path.join(cls.directory, 'nsi_connections.conf')
+        with open(config, 'w') as f:
+            f.write(CONFIG % os.path.join(cls.directory, 'nsi_connections.log'))
+        os.environ['NSI_CONNECTIONS_SETTINGS'] = config
+        import nsi_connections
+        cls.app = nsi_connections
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def post(self, key, vlan):
+        connection = {'description': 'test', 'src_domain': 'a', 'src_port': 'p1', 'src_vlan': vlan,
+                      'dst_domain': 'b', 'dst_port': 'p2', 'dst_vlan': vlan, 'capacity': 10,
+                      'start_time': '2029-01-01T00:00:00Z', 'end_time': '2029-02-01T00:00:00Z'}
+        return self.app.app.test_client().post('/nsi/connections', json=connection, headers={'Idempotency-Key': key})
+
+    def test_replay(self):
+        created = self.post('replay', 100)
+        self.assertEqual(created.status_code, 201)
+        replayed = self.post('replay', 100)
+        self.assertEqual(replayed.status_code, 201)
+        self.assertEqual(replayed.get_json()['reservation_id'], created.get_json()['reservation_id'])
+        self.assertEqual(self.post('replay', 101).status_code, 422)
+
+    def test_failure_after_reserve(self):
+        nsi = self.app.nsi
+        provision = nsi.provision
+        reserved = []
+
+        def unavailable(rid):
+            # circuit breaker opened by another request between reserve and provision
+            reserved.append(rid)
+            raise CircuitOpen("provider unavailable")
+        nsi.provision = unavailable
+        try:
+            self.assertEqual(self.post('retried', 200).status_code, 503)
+        finally:
+            nsi.provision = provision
+
+        # the reservation is deleted in background
+        deadline = time.time() + 10
+        while nsi.store.get(reserved[0])['lifecycleState'] != 'TERMINATED' and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(nsi.store.get(reserved[0])['lifecycleState'], 'TERMINATED')
+        retried = self.post('retried', 200)
+        self.assertEqual(retried.status_code, 201)
+        self.assertNotEqual(retried.get_json()['reservation_id'], reserved[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Copyright 2016 Poznan Supercomputing and Networking Center (PSNC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the reservation store log, run from ./test: python -m unittest test_reservation_store"""
+
+import os, shutil, sys, tempfile, threading, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from reservation_store import SharedReservationStore, TERMINATED
+
+WRITE_TIMEOUT = 30   # [sec] writes blocked longer than that are deadlocked
+
+
+def params(i):
+    return {'gid': 'gid-%i' % i, 'desc': 'test', 'src': 'urn:a:p1', 'dst': 'urn:b:p2',
+            'srcvlan': 100 + i, 'dstvlan': 100 + i, 'capacity': 10, 'start_sec': -1, 'end_sec': -1}
+
+
+class SharedReservationStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'reservations.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, func, threads=1):
+        """Runs func(thread number) in threads, fails when they don't finish in WRITE_TIMEOUT"""
+        errors = []
+
+        def run(n):
+            try:
+                func(n)
+            except Exception as e:
+                errors.append(e)
+        workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join(WRITE_TIMEOUT)
+            self.assertFalse(worker.is_alive(), "writes to the store blocked")
+        self.assertEqual(errors, [])
+
+    def test_compaction_past_threshold(self):
+        store = SharedReservationStore(self.path, sync=False, compact_ratio=2, compact_min=5)
+
+        def changes(n):
+            # every reservation is changed many times, so the log grows past compact_ratio
+            for i in range(n * 5, n * 5 + 5):
+                store.add('rid-%i' % i, params(i))
+                for version in range(1, 10):
+                    store.update('rid-%i' % i, version=version)
+                store.update('rid-%i' % i, lifecycleState=TERMINATED)
+        self.write(changes, threads=4)
+
+        stats = store.stats()
+        self.assertTrue(stats['compactions'] > 0)
+        self.assertEqual(stats['reservations'], 20)
+        self.assertTrue(stats['log_entries'] < stats['written'])
+        self.assertEqual(store.get('rid-7')['lifecycleState'], TERMINATED)
+        self.assertEqual(store.get('rid-7')['version'], 9)
+
+        # the compacted log has the same reservations
+        loaded = SharedReservationStore(self.path, sync=False)
+        self.assertEqual(len(loaded.find()), 20)
+        self.assertEqual(loaded.get('rid-19'), store.get('rid-19'))
+
+    def test_compact(self):
+        store = SharedReservationStore(self.path, sync=False)
+        store.add('rid-0', params(0))
+        for version in range(1, 10):
+            store.update('rid-0', version=version)
+        store.compact()
+        self.assertEqual(store.stats()['log_entries'], 1)
+        self.assertEqual(store.get('rid-0')['version'], 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
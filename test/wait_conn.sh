@@ -0,0 +1,5 @@
+#!/bin/bash
+
+curl "http://localhost:9000/nsi/connections/urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266?wait_for=provisionState:PROVISIONED,active:true&timeout=60"
+
+curl -N "http://localhost:9000/nsi/connections/urn:uuid:7ebc5196-9293-4346-b847-d2fa123b5266/events?timeout=300"